@@ -0,0 +1,23 @@
+"""
+Alembic migration: Add AnalysisChunk table (resumos parciais da análise map-reduce)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'analysis_chunks',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('chunk_hash', sa.String(64), nullable=False),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('content_hash', sa.String(64), nullable=True),
+        sa.Column('label', sa.String(255), nullable=True),
+        sa.Column('summary', sa.Text, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint('chunk_hash', 'model', name='uq_analysis_chunks_hash_model'),
+    )
+    op.create_index('ix_analysis_chunks_content_hash', 'analysis_chunks', ['content_hash'])
+
+def downgrade():
+    op.drop_index('ix_analysis_chunks_content_hash', table_name='analysis_chunks')
+    op.drop_table('analysis_chunks')
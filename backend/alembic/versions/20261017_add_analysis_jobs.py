@@ -0,0 +1,36 @@
+"""
+Alembic migration: Add AnalysisJob table (fila de análises de RFP)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'analysis_jobs',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('rfp_id', sa.Integer, sa.ForeignKey('rfps.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('provider_id', sa.Integer, sa.ForeignKey('ai_providers.id'), nullable=True),
+        sa.Column('status', sa.String(20), nullable=False, server_default='pending'),
+        sa.Column('progress', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('stage', sa.String(255), nullable=True),
+        sa.Column('result', sa.Text, nullable=True),
+        sa.Column('error', sa.Text, nullable=True),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('ix_analysis_jobs_rfp_id', 'analysis_jobs', ['rfp_id'])
+    op.create_index('ix_analysis_jobs_status_created_at', 'analysis_jobs', ['status', 'created_at'])
+    op.create_index(
+        'uq_analysis_jobs_rfp_active', 'analysis_jobs', ['rfp_id'], unique=True,
+        postgresql_where=sa.text("status IN ('pending', 'running')"),
+    )
+
+def downgrade():
+    op.drop_index('uq_analysis_jobs_rfp_active', table_name='analysis_jobs')
+    op.drop_index('ix_analysis_jobs_status_created_at', table_name='analysis_jobs')
+    op.drop_index('ix_analysis_jobs_rfp_id', table_name='analysis_jobs')
+    op.drop_table('analysis_jobs')
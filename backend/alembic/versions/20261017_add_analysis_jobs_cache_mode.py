@@ -0,0 +1,11 @@
+"""
+Alembic migration: Add cache_mode to analysis_jobs (cache de LLM por job)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('analysis_jobs', sa.Column('cache_mode', sa.String(10), nullable=False, server_default='use'))
+
+def downgrade():
+    op.drop_column('analysis_jobs', 'cache_mode')
@@ -0,0 +1,17 @@
+"""
+Alembic migration: Add Blob table (armazenamento deduplicado por conteúdo, com contagem de referências)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'blobs',
+        sa.Column('content_hash', sa.String(64), primary_key=True),
+        sa.Column('size', sa.BigInteger, nullable=False),
+        sa.Column('refcount', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table('blobs')
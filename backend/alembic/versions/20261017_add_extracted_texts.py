@@ -0,0 +1,20 @@
+"""
+Alembic migration: Add content_hash to rfp_files and ExtractedText cache table
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('rfp_files', sa.Column('content_hash', sa.String(64), nullable=True))
+    op.create_index('ix_rfp_files_content_hash', 'rfp_files', ['content_hash'])
+    op.create_table(
+        'extracted_texts',
+        sa.Column('content_hash', sa.String(64), primary_key=True),
+        sa.Column('text', sa.Text, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table('extracted_texts')
+    op.drop_index('ix_rfp_files_content_hash', table_name='rfp_files')
+    op.drop_column('rfp_files', 'content_hash')
@@ -0,0 +1,24 @@
+"""
+Alembic migration: Add FileUpload table (upload de arquivos em partes, retomável)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'file_uploads',
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('rfp_id', sa.Integer, sa.ForeignKey('rfps.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('filename', sa.String(255), nullable=False),
+        sa.Column('filepath', sa.String(255), nullable=False),
+        sa.Column('size', sa.BigInteger, nullable=False),
+        sa.Column('received', sa.BigInteger, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_file_uploads_rfp_id', 'file_uploads', ['rfp_id'])
+
+def downgrade():
+    op.drop_index('ix_file_uploads_rfp_id', table_name='file_uploads')
+    op.drop_table('file_uploads')
@@ -0,0 +1,22 @@
+"""
+Alembic migration: Add rpm_limit/tpm_limit to ai_providers and llm_rate_buckets (limites de taxa por chave de API)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('ai_providers', sa.Column('rpm_limit', sa.Integer, nullable=True))
+    op.add_column('ai_providers', sa.Column('tpm_limit', sa.Integer, nullable=True))
+    op.create_table(
+        'llm_rate_buckets',
+        sa.Column('key', sa.String(64), primary_key=True),
+        sa.Column('requests', sa.Float, nullable=False, server_default='0'),
+        sa.Column('tokens', sa.Float, nullable=False, server_default='0'),
+        sa.Column('refilled_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('blocked_until', sa.DateTime(timezone=True), nullable=True),
+    )
+
+def downgrade():
+    op.drop_table('llm_rate_buckets')
+    op.drop_column('ai_providers', 'tpm_limit')
+    op.drop_column('ai_providers', 'rpm_limit')
@@ -0,0 +1,26 @@
+"""
+Alembic migration: Add LLMResponse table (cache compartilhado de respostas das LLMs)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'llm_responses',
+        sa.Column('cache_key', sa.String(64), primary_key=True),
+        sa.Column('provider', sa.String(100), nullable=False),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('temperature', sa.Float, nullable=False),
+        sa.Column('status', sa.String(10), nullable=False, server_default='ready'),
+        sa.Column('content', sa.Text, nullable=True),
+        sa.Column('size', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('hits', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('last_hit_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('claimed_at', sa.DateTime, nullable=True),
+    )
+    op.create_index('ix_llm_responses_last_hit_at', 'llm_responses', ['last_hit_at'])
+
+def downgrade():
+    op.drop_index('ix_llm_responses_last_hit_at', table_name='llm_responses')
+    op.drop_table('llm_responses')
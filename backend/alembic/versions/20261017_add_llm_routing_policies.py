@@ -0,0 +1,22 @@
+"""
+Alembic migration: Add llm_routing_policies (roteamento/failover/hedging entre provedores por operação)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'llm_routing_policies',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('operation', sa.String(50), nullable=False, unique=True),
+        sa.Column('provider_ids', sa.JSON, nullable=True),
+        sa.Column('failover', sa.Boolean, nullable=False, server_default=sa.true()),
+        sa.Column('hedge', sa.Boolean, nullable=False, server_default=sa.false()),
+        sa.Column('hedge_delay_ms', sa.Integer, nullable=True),
+        sa.Column('max_attempts', sa.Integer, nullable=False, server_default='3'),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime, server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table('llm_routing_policies')
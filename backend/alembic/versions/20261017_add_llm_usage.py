@@ -0,0 +1,52 @@
+"""
+Alembic migration: Add LLMUsage (ledger de uso das LLMs) and LLMBudget (cotas por usuário/RFP) tables
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'llm_usage',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column('operation', sa.String(50), nullable=True),
+        sa.Column('provider_id', sa.Integer, sa.ForeignKey('ai_providers.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('provider', sa.String(100), nullable=False),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('rfp_id', sa.Integer, sa.ForeignKey('rfps.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('prompt_tokens', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('completion_tokens', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('max_tokens', sa.Integer, nullable=True),
+        sa.Column('cost', sa.Float, nullable=True),
+        sa.Column('latency_ms', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('status', sa.String(10), nullable=False, server_default='ok'),
+        sa.Column('finish_reason', sa.String(20), nullable=True),
+        sa.Column('cached', sa.Boolean, nullable=False, server_default=sa.false()),
+    )
+    op.create_index('ix_llm_usage_created_at', 'llm_usage', ['created_at'])
+    op.create_index('ix_llm_usage_user_id_created_at', 'llm_usage', ['user_id', 'created_at'])
+    op.create_index('ix_llm_usage_rfp_id_created_at', 'llm_usage', ['rfp_id', 'created_at'])
+    op.create_index('ix_llm_usage_operation_created_at', 'llm_usage', ['operation', 'created_at'])
+    op.create_table(
+        'llm_budgets',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('scope', sa.String(10), nullable=False),
+        sa.Column('scope_id', sa.Integer, nullable=True),
+        sa.Column('period', sa.String(10), nullable=False),
+        sa.Column('max_tokens', sa.BigInteger, nullable=True),
+        sa.Column('max_cost', sa.Float, nullable=True),
+        sa.Column('action', sa.String(10), nullable=False, server_default='reject'),
+        sa.Column('downgrade_model', sa.String(100), nullable=True),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime, server_default=sa.func.now()),
+        sa.UniqueConstraint('scope', 'scope_id', 'period', name='uq_llm_budgets_scope_period'),
+    )
+
+def downgrade():
+    op.drop_table('llm_budgets')
+    op.drop_index('ix_llm_usage_operation_created_at', table_name='llm_usage')
+    op.drop_index('ix_llm_usage_rfp_id_created_at', table_name='llm_usage')
+    op.drop_index('ix_llm_usage_user_id_created_at', table_name='llm_usage')
+    op.drop_index('ix_llm_usage_created_at', table_name='llm_usage')
+    op.drop_table('llm_usage')
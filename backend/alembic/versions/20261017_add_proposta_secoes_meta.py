@@ -0,0 +1,11 @@
+"""
+Alembic migration: Add secoes_meta to propostas (hash das entradas de cada seção, para regeneração incremental)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('propostas', sa.Column('secoes_meta', sa.JSON, nullable=True))
+
+def downgrade():
+    op.drop_column('propostas', 'secoes_meta')
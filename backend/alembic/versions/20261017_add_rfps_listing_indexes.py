@@ -0,0 +1,16 @@
+"""
+Alembic migration: Add composite indexes for keyset pagination of RFPs (updated_at, id)
+"""
+from alembic import op
+
+def upgrade():
+    # A paginação por cursor exige updated_at preenchido
+    op.execute("UPDATE rfps SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL")
+    op.create_index('ix_rfps_updated_at_id', 'rfps', ['updated_at', 'id'])
+    op.create_index('ix_rfps_user_id_updated_at_id', 'rfps', ['user_id', 'updated_at', 'id'])
+    op.create_index('ix_rfps_status_updated_at_id', 'rfps', ['status', 'updated_at', 'id'])
+
+def downgrade():
+    op.drop_index('ix_rfps_status_updated_at_id', table_name='rfps')
+    op.drop_index('ix_rfps_user_id_updated_at_id', table_name='rfps')
+    op.drop_index('ix_rfps_updated_at_id', table_name='rfps')
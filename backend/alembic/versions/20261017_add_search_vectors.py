@@ -0,0 +1,63 @@
+"""
+Alembic migration: Add full-text search vectors (Portuguese) kept up to date by triggers, with GIN indexes
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# tabela -> (colunas que disparam a atualização, expressão do vetor sobre NEW)
+SEARCH_VECTORS = {
+    'rfps': (
+        ['nome', 'resumo_ia'],
+        "setweight(to_tsvector('portuguese', coalesce(NEW.nome, '')), 'A') || "
+        "setweight(to_tsvector('portuguese', coalesce(NEW.resumo_ia, '')), 'B')",
+    ),
+    'escopo_servico': (
+        ['titulo', 'descricao'],
+        "setweight(to_tsvector('portuguese', coalesce(NEW.titulo, '')), 'A') || "
+        "setweight(to_tsvector('portuguese', coalesce(NEW.descricao, '')), 'B')",
+    ),
+    # to_tsvector(json) indexa apenas os valores string, não as chaves
+    'propostas': (
+        ['dados_json'],
+        "setweight(to_tsvector('portuguese', coalesce(NEW.dados_json, '{}'::json)), 'C')",
+    ),
+    'extracted_texts': (
+        ['text'],
+        "setweight(to_tsvector('portuguese', left(NEW.text, 1000000)), 'D')",
+    ),
+}
+
+def upgrade():
+    for table, (columns, expression) in SEARCH_VECTORS.items():
+        op.add_column(table, sa.Column('search_vector', TSVECTOR, nullable=True))
+        if table == 'extracted_texts':
+            # tsvector tem limite de 1MB: textos com muitos termos distintos são indexados só no início
+            body = f"""
+    BEGIN
+        NEW.search_vector := {expression};
+    EXCEPTION WHEN program_limit_exceeded THEN
+        NEW.search_vector := setweight(to_tsvector('portuguese', left(NEW.text, 100000)), 'D');
+    END;"""
+        else:
+            body = f"""
+    NEW.search_vector := {expression};"""
+        op.execute(f"""
+CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+BEGIN{body}
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""")
+        op.execute(f"""
+CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {', '.join(columns)} ON {table}
+FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update()""")
+        # Preenche as linhas existentes pelo próprio trigger
+        op.execute(f"UPDATE {table} SET {columns[0]} = {columns[0]}")
+        op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], postgresql_using='gin')
+
+def downgrade():
+    for table in reversed(list(SEARCH_VECTORS)):
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}")
+        op.execute(f"DROP FUNCTION IF EXISTS {table}_search_vector_update()")
+        op.drop_column(table, 'search_vector')
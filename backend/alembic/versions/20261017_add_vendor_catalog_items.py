@@ -0,0 +1,37 @@
+"""
+Alembic migration: Add vendor_catalog_items (SKU catalog) with prefix and trigram (pg_trgm) indexes
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # vendor_id (inteiro) junto com os trigramas no mesmo índice GiST
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.create_table(
+        'vendor_catalog_items',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('vendor_id', sa.Integer, sa.ForeignKey('vendors.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('part_number', sa.String(100), nullable=False),
+        sa.Column('part_number_norm', sa.String(100, collation='C'), nullable=False),
+        sa.Column('descricao', sa.Text, nullable=True),
+        sa.Column('modelo', sa.String(255), nullable=True),
+        sa.Column('preco', sa.Float, nullable=True),
+        sa.Column('moeda', sa.String(3), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint('vendor_id', 'part_number', name='uq_vendor_catalog_items_vendor_pn'),
+    )
+    op.create_index('ix_vendor_catalog_items_pn_norm', 'vendor_catalog_items', ['part_number_norm'])
+    op.create_index('ix_vendor_catalog_items_vendor_pn_norm', 'vendor_catalog_items', ['vendor_id', 'part_number_norm'])
+    op.create_index('ix_vendor_catalog_items_pn_norm_trgm', 'vendor_catalog_items', ['vendor_id', 'part_number_norm'],
+                    postgresql_using='gist', postgresql_ops={'part_number_norm': 'gist_trgm_ops'})
+    op.create_index('ix_vendor_catalog_items_descricao_trgm', 'vendor_catalog_items', ['vendor_id', 'descricao'],
+                    postgresql_using='gist', postgresql_ops={'descricao': 'gist_trgm_ops'})
+
+def downgrade():
+    op.drop_index('ix_vendor_catalog_items_descricao_trgm', table_name='vendor_catalog_items')
+    op.drop_index('ix_vendor_catalog_items_pn_norm_trgm', table_name='vendor_catalog_items')
+    op.drop_index('ix_vendor_catalog_items_vendor_pn_norm', table_name='vendor_catalog_items')
+    op.drop_index('ix_vendor_catalog_items_pn_norm', table_name='vendor_catalog_items')
+    op.drop_table('vendor_catalog_items')
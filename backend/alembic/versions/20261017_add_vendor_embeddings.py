@@ -0,0 +1,18 @@
+"""
+Alembic migration: Add VendorEmbedding table (pré-filtro de vendors por similaridade)
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table(
+        'vendor_embeddings',
+        sa.Column('vendor_id', sa.Integer, sa.ForeignKey('vendors.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('profile_hash', sa.String(64), nullable=False),
+        sa.Column('vector', sa.JSON, nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+def downgrade():
+    op.drop_table('vendor_embeddings')
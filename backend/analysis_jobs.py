@@ -0,0 +1,207 @@
+import os
+import threading
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import AnalysisJob, AIProvider, RFP, User
+from rfp_analysis import run_rfp_analysis
+from llm import CACHE_USE
+from usage import usage_scope
+
+logger = logging.getLogger(__name__)
+
+# Configuração da fila de análises
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '2'))
+ANALYSIS_POLL_INTERVAL = float(os.getenv('ANALYSIS_POLL_INTERVAL', '5'))
+ANALYSIS_STALE_SECONDS = int(os.getenv('ANALYSIS_STALE_SECONDS', '120'))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_MAX_ATTEMPTS', '3'))
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def get_active_job(db: Session, rfp_id: int):
+    return db.query(AnalysisJob).filter(
+        AnalysisJob.rfp_id == rfp_id,
+        AnalysisJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+
+# Cria um job para a RFP, ou devolve o job que já está na fila/em execução
+def enqueue_analysis(db: Session, rfp: RFP, user: User, provider: AIProvider, cache: str = CACHE_USE) -> AnalysisJob:
+    job = get_active_job(db, rfp.id)
+    if job:
+        return job
+    job = AnalysisJob(rfp_id=rfp.id, user_id=user.id, provider_id=provider.id, cache_mode=cache, status='pending', progress=0, stage="Na fila")
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Outro pedido criou o job ativo ao mesmo tempo (índice único parcial)
+        db.rollback()
+        return get_active_job(db, rfp.id)
+    db.refresh(job)
+    dispatcher.wake()
+    return job
+
+# Executa os jobs pendentes com concorrência limitada. O estado fica no Postgres:
+# cada processo reivindica jobs com FOR UPDATE SKIP LOCKED e jobs cujo heartbeat
+# parou (processo reiniciado) voltam para a fila.
+class AnalysisDispatcher:
+    def __init__(self, max_workers: int = ANALYSIS_WORKERS, poll_interval: float = ANALYSIS_POLL_INTERVAL):
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._slots = threading.Semaphore(max_workers)
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.max_workers <= 0 or self._thread:
+            return
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis")
+        self._thread = threading.Thread(target=self._loop, name="analysis-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("Fila de análises iniciada com %s worker(s)", self.max_workers)
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._thread = None
+        self._executor = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                self._heartbeat()
+                self._requeue_stale()
+                self._dispatch()
+            except Exception:
+                logger.error("Falha no dispatcher de análises", exc_info=True)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _dispatch(self):
+        while self._slots.acquire(blocking=False):
+            job_id = self._claim_next()
+            if job_id is None:
+                self._slots.release()
+                return
+            with self._lock:
+                self._running.add(job_id)
+            self._executor.submit(self._run, job_id)
+
+    def _claim_next(self):
+        with SessionLocal() as db:
+            job = (
+                db.query(AnalysisJob)
+                .filter(AnalysisJob.status == 'pending')
+                .order_by(AnalysisJob.created_at, AnalysisJob.id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not job:
+                return None
+            now = _now()
+            job.status = 'running'
+            job.started_at = now
+            job.heartbeat_at = now
+            job.attempts = (job.attempts or 0) + 1
+            db.commit()
+            return job.id
+
+    # Mantém vivos os jobs deste processo enquanto aguardam a IA
+    def _heartbeat(self):
+        with self._lock:
+            ids = list(self._running)
+        if not ids:
+            return
+        with SessionLocal() as db:
+            db.query(AnalysisJob).filter(AnalysisJob.id.in_(ids), AnalysisJob.status == 'running').update(
+                {AnalysisJob.heartbeat_at: _now()}, synchronize_session=False
+            )
+            db.commit()
+
+    # Jobs 'running' sem heartbeat pertencem a um processo que morreu
+    def _requeue_stale(self):
+        limit = _now() - datetime.timedelta(seconds=ANALYSIS_STALE_SECONDS)
+        with SessionLocal() as db:
+            stale = (
+                db.query(AnalysisJob)
+                .filter(AnalysisJob.status == 'running', AnalysisJob.heartbeat_at < limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for job in stale:
+                if job.attempts >= ANALYSIS_MAX_ATTEMPTS:
+                    job.status = 'failed'
+                    job.error = "Job interrompido repetidas vezes"
+                    job.finished_at = _now()
+                else:
+                    logger.warning("Reenfileirando job de análise %s (heartbeat expirado)", job.id)
+                    job.status = 'pending'
+                    job.stage = "Na fila (retomado)"
+            if stale:
+                db.commit()
+
+    def _run(self, job_id: int):
+        try:
+            with SessionLocal() as db:
+                job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+                try:
+                    self._execute(db, job)
+                except Exception as e:
+                    logger.error("Falha na análise do job %s", job_id, exc_info=True)
+                    db.rollback()
+                    job.status = 'failed'
+                    job.error = str(e)
+                    job.finished_at = _now()
+                    db.commit()
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            self._slots.release()
+            self.wake()
+
+    def _execute(self, db: Session, job: AnalysisJob):
+        rfp = db.query(RFP).filter(RFP.id == job.rfp_id).first()
+        if not rfp:
+            raise RuntimeError("RFP não encontrada")
+        provider = None
+        if job.provider_id:
+            provider = db.query(AIProvider).filter(AIProvider.id == job.provider_id).first()
+        if not provider:
+            provider = db.query(AIProvider).filter(AIProvider.is_selected == True).first()
+        if not provider:
+            raise RuntimeError("Nenhum provedor IA selecionado")
+
+        def progress(percent: int, stage: str):
+            job.progress = percent
+            job.stage = stage
+            job.heartbeat_at = _now()
+            db.commit()
+
+        with usage_scope("analise_rfp", user_id=job.user_id, rfp_id=rfp.id):
+            resumo = run_rfp_analysis(db, rfp, provider, progress, job.cache_mode)
+        job.status = 'completed'
+        job.progress = 100
+        job.stage = "Concluído"
+        job.result = resumo
+        job.finished_at = _now()
+        db.commit()
+
+dispatcher = AnalysisDispatcher()
@@ -2,18 +2,26 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from models import User
-from database import SessionLocal
+from database import SessionLocal, AsyncSessionLocal
+from cache import TTLCache, invalidate_on_write
 
 load_dotenv()
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'uma-chave-secreta')
 ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# Usuários autenticados por e-mail; limpo a cada escrita em User (inclusive em outros workers)
+user_cache = TTLCache('users', USER_CACHE_TTL)
+invalidate_on_write(User, 'users')
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -46,7 +54,20 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Sessão assíncrona (asyncpg) para os endpoints async def
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Carrega o usuário desvinculado da sessão, para poder ser compartilhado entre requisições
+async def _load_detached_user(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalars().first()
+    if user is not None:
+        db.expunge(user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -59,7 +80,22 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_user_by_email(db, email)
+    user = await user_cache.aget(email, lambda: _load_detached_user(db, email))
     if user is None:
         raise credentials_exception
     return user
+
+# Usuário do header Authorization ("Bearer <token>") fora da injeção de dependências
+# (middlewares); None se ausente ou inválido
+async def user_from_authorization(authorization: str):
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    if email is None:
+        return None
+    async with AsyncSessionLocal() as db:
+        return await user_cache.aget(email, lambda: _load_detached_user(db, email))
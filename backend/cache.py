@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import uuid
+import select
+import logging
+import threading
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, object_session
+from database import engine, SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Canal do Postgres usado para propagar invalidações entre os workers do uvicorn
+CACHE_CHANNEL = 'cache_invalidation'
+CACHE_LISTEN_RECONNECT_SECONDS = 5
+
+# Identifica este processo para ignorar as próprias notificações
+_ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex}"
+_caches = {}
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, maxsize: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+        # Incrementado a cada invalidação: valores carregados antes dela não são gravados
+        self._generation = 0
+        _caches[name] = self
+
+    def _lookup(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > time.monotonic():
+                return True, hit[1], self._generation
+            return False, None, self._generation
+
+    def _store(self, key, value, generation: int):
+        if value is None:
+            return
+        with self._lock:
+            if generation == self._generation:
+                if len(self._data) >= self.maxsize:
+                    self._data.pop(next(iter(self._data)))
+                self._data[key] = (time.monotonic() + self.ttl, value)
+
+    # Retorna o valor em cache ou chama loader(); resultados None não são guardados
+    def get(self, key, loader):
+        found, value, generation = self._lookup(key)
+        if found:
+            return value
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    # Igual a get(), com loader assíncrono
+    async def aget(self, key, loader):
+        found, value, generation = self._lookup(key)
+        if found:
+            return value
+        value = await loader()
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+def _invalidate_local(name: str, key=None):
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.invalidate(key)
+
+def _clear_all():
+    for cache in _caches.values():
+        cache.invalidate()
+
+def _broadcast(name: str, key=None):
+    if engine.dialect.name != 'postgresql':
+        return
+    payload = json.dumps({"origin": _ORIGIN, "cache": name, "key": key})
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CACHE_CHANNEL, "payload": payload})
+            conn.commit()
+    except Exception:
+        logger.warning("Falha ao propagar invalidação do cache %s", name, exc_info=True)
+
+# Invalida a entrada (ou o cache inteiro) neste processo e nos demais workers
+def invalidate(name: str, key=None):
+    _invalidate_local(name, key)
+    _broadcast(name, key)
+
+# --- Invalidação automática a partir de escritas via ORM ---
+
+def _pending(session: Session) -> set:
+    return session.info.setdefault('cache_invalidations', set())
+
+# Qualquer insert/update/delete do modelo limpa o cache após o commit
+def invalidate_on_write(model, cache_name: str):
+    def mark(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            _pending(session).add(cache_name)
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, mark)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for name in session.info.pop('cache_invalidations', ()):
+        invalidate(name)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('cache_invalidations', None)
+
+# --- LISTEN/NOTIFY ---
+
+class InvalidationListener:
+    def __init__(self):
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if engine.dialect.name != 'postgresql' or self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(SQLALCHEMY_DATABASE_URL)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {CACHE_CHANNEL}")
+                # Notificações perdidas enquanto desconectado: começa do zero
+                _clear_all()
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.warning("Conexão LISTEN do cache perdida; reconectando", exc_info=True)
+                self._stopping.wait(CACHE_LISTEN_RECONNECT_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _handle(self, payload: str):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if data.get("origin") == _ORIGIN:
+            return
+        _invalidate_local(data.get("cache"), data.get("key"))
+
+listener = InvalidationListener()
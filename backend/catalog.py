@@ -0,0 +1,238 @@
+import os
+import io
+import re
+import csv
+import codecs
+import logging
+from openpyxl import load_workbook
+from sqlalchemy import select, delete, func, bindparam, column, literal, true, Integer, Text
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY
+from models import CatalogItem
+
+logger = logging.getLogger(__name__)
+
+CATALOG_IMPORT_BATCH = int(os.getenv('CATALOG_IMPORT_BATCH', '2000'))
+CATALOG_LOOKUP_MAX = int(os.getenv('CATALOG_LOOKUP_MAX', '20'))
+# Similaridade (0-1) a partir da qual a validação troca o part number do BoM pelo do catálogo
+CATALOG_AUTOFIX_SIMILARITY = float(os.getenv('CATALOG_AUTOFIX_SIMILARITY', '0.8'))
+CATALOG_CANDIDATES = 3
+
+CATALOG_EXTENSIONS = ('csv', 'xlsx')
+
+# Nomes aceitos no cabeçalho da planilha (comparados sem acento, caixa ou espaços)
+COLUMN_ALIASES = {
+    "part_number": ("partnumber", "pn", "sku", "codigo", "codigodoproduto", "productid", "productnumber"),
+    "descricao": ("descricao", "description", "produto", "product", "productdescription"),
+    "modelo": ("modelo", "model"),
+    "preco": ("preco", "price", "listprice", "precodelista", "valor", "gpl"),
+    "moeda": ("moeda", "currency"),
+}
+
+class CatalogImportError(ValueError):
+    pass
+
+def normalize_part_number(part_number) -> str:
+    return re.sub(r'[^0-9A-Z]', '', str(part_number or '').upper())[:100]
+
+def _header_key(name) -> str:
+    name = str(name or '').lower()
+    for accented, plain in (("áàâã", "a"), ("éê", "e"), ("í", "i"), ("óôõ", "o"), ("ú", "u"), ("ç", "c")):
+        name = re.sub(f"[{accented}]", plain, name)
+    return re.sub(r'[^0-9a-z]', '', name)
+
+def _column_indexes(header) -> dict:
+    keys = [_header_key(name) for name in header]
+    indexes = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for i, key in enumerate(keys):
+            if key in aliases:
+                indexes[field] = i
+                break
+    if "part_number" not in indexes:
+        raise CatalogImportError("Coluna de part number (SKU) não encontrada no cabeçalho")
+    return indexes
+
+# "1.234,56", "1,234.56", "R$ 99,90" ou número da planilha
+def parse_price(value):
+    if value is None or isinstance(value, (int, float)):
+        return float(value) if value is not None else None
+    text = re.sub(r'[^0-9,.\-]', '', str(value))
+    if not text:
+        return None
+    if ',' in text and '.' in text:
+        decimal = ',' if text.rfind(',') > text.rfind('.') else '.'
+        text = text.replace('.' if decimal == ',' else ',', '').replace(',', '.')
+    elif ',' in text:
+        text = text.replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _csv_rows(fileobj):
+    head = fileobj.read(65536)
+    try:
+        # Incremental: um caractere multibyte cortado no fim do trecho não invalida o UTF-8
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        # Excel em português grava CSV em Windows-1252
+        encoding = 'cp1252'
+    fileobj.seek(0)
+    first_line = head.split(b'\n', 1)[0].decode(encoding, errors='replace')
+    delimiter = max((';', ',', '\t'), key=first_line.count)
+    yield from csv.reader(io.TextIOWrapper(fileobj, encoding=encoding, errors='replace', newline=''), delimiter=delimiter)
+
+def _xlsx_rows(fileobj):
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _cell(row, indexes, field):
+    i = indexes.get(field)
+    return row[i] if i is not None and i < len(row) else None
+
+# Células do XLSX vêm tipadas: part number numérico (ex.: 12345.0) vira "12345"
+def _text(value, size: int):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()[:size] or None
+
+def iter_catalog_rows(fileobj, ext: str):
+    rows = _xlsx_rows(fileobj) if ext == 'xlsx' else _csv_rows(fileobj)
+    header = next(rows, None)
+    if header is None:
+        raise CatalogImportError("Arquivo vazio")
+    indexes = _column_indexes(header)
+    for row in rows:
+        moeda = _text(_cell(row, indexes, "moeda"), 3)
+        yield {
+            "part_number": _text(_cell(row, indexes, "part_number"), 100),
+            "descricao": _text(_cell(row, indexes, "descricao"), 4000),
+            "modelo": _text(_cell(row, indexes, "modelo"), 255),
+            "preco": parse_price(_cell(row, indexes, "preco")),
+            "moeda": moeda.upper() if moeda else None,
+        }
+
+def _upsert(db: Session, vendor_id: int, batch: dict):
+    stmt = pg_insert(CatalogItem).values([{"vendor_id": vendor_id, **row} for row in batch.values()])
+    db.execute(stmt.on_conflict_do_update(
+        constraint='uq_vendor_catalog_items_vendor_pn',
+        set_={
+            "part_number_norm": stmt.excluded.part_number_norm,
+            "descricao": stmt.excluded.descricao,
+            "modelo": stmt.excluded.modelo,
+            "preco": stmt.excluded.preco,
+            "moeda": stmt.excluded.moeda,
+            "updated_at": func.now(),
+        },
+    ))
+
+# Importa (upsert por part number) a lista de preços do vendor numa única transação;
+# replace=True remove antes os itens atuais do catálogo do vendor
+def import_catalog(db: Session, vendor_id: int, fileobj, ext: str, replace: bool = False) -> dict:
+    if ext not in CATALOG_EXTENSIONS:
+        raise CatalogImportError(f"Formato não suportado: {ext} (use CSV ou XLSX)")
+    if replace:
+        db.execute(delete(CatalogItem).where(CatalogItem.vendor_id == vendor_id))
+    imported = skipped = 0
+    batch = {}
+    for row in iter_catalog_rows(fileobj, ext):
+        norm = normalize_part_number(row["part_number"])
+        if not norm:
+            skipped += 1
+            continue
+        # Part number repetido no mesmo lote: vale a última linha (o upsert não aceita duplicatas)
+        batch[row["part_number"]] = {**row, "part_number_norm": norm}
+        imported += 1
+        if len(batch) >= CATALOG_IMPORT_BATCH:
+            _upsert(db, vendor_id, batch)
+            batch = {}
+    if batch:
+        _upsert(db, vendor_id, batch)
+    db.commit()
+    logger.info("Catálogo do vendor %s importado: %s linhas (%s ignoradas)", vendor_id, imported, skipped)
+    return {"imported": imported, "skipped": skipped}
+
+# --- Busca ---
+
+CATALOG_COLUMNS = (
+    CatalogItem.id, CatalogItem.vendor_id, CatalogItem.part_number, CatalogItem.descricao,
+    CatalogItem.modelo, CatalogItem.preco, CatalogItem.moeda,
+)
+
+# Limite superior de um prefixo normalizado: maior que qualquer letra/dígito (collation C).
+# Intervalo em vez de LIKE: usa o índice também em plano genérico (statements preparados do asyncpg)
+PREFIX_END = "~"
+
+def _by_vendor(query, vendor_id):
+    return query.where(CatalogItem.vendor_id == vendor_id) if vendor_id is not None else query
+
+# Autocomplete em etapas, cada uma limitada e servida por índice: prefixo do part number
+# normalizado (btree), part number parecido (KNN no GiST de trigramas) e, por fim, palavras
+# da descrição (similaridade de palavra, também KNN)
+def lookup_queries(q: str, vendor_id: int = None, limit: int = 10) -> list:
+    norm = normalize_part_number(q)
+    queries = []
+    if norm:
+        queries.append(("prefixo", _by_vendor(
+            select(*CATALOG_COLUMNS, literal(1.0).label("score"))
+            .where(CatalogItem.part_number_norm >= norm, CatalogItem.part_number_norm < norm + PREFIX_END), vendor_id)
+            .order_by(CatalogItem.part_number_norm).limit(limit)))
+    if len(norm) >= 3:
+        queries.append(("part_number", _by_vendor(
+            select(*CATALOG_COLUMNS, func.similarity(CatalogItem.part_number_norm, norm).label("score"))
+            .where(CatalogItem.part_number_norm.op("%")(norm)), vendor_id)
+            .order_by(CatalogItem.part_number_norm.op("<->")(norm)).limit(limit)))
+    text = q.strip()
+    if len(text) >= 3:
+        words = bindparam("words", text, type_=Text)
+        queries.append(("descricao", _by_vendor(
+            select(*CATALOG_COLUMNS, func.word_similarity(words, CatalogItem.descricao).label("score"))
+            .where(words.op("<%")(CatalogItem.descricao)), vendor_id)
+            .order_by(words.op("<<->")(CatalogItem.descricao)).limit(limit)))
+    return queries
+
+def _merge_hits(hits: list, rows, match: str, limit: int):
+    seen = {hit["id"] for hit in hits}
+    for row in rows:
+        if len(hits) >= limit:
+            break
+        if row["id"] not in seen:
+            seen.add(row["id"])
+            hits.append({**row, "score": round(float(row["score"]), 4), "match": match})
+
+async def lookup(db, q: str, vendor_id: int = None, limit: int = 10) -> list:
+    hits = []
+    for match, query in lookup_queries(q, vendor_id, limit):
+        if len(hits) >= limit:
+            break
+        _merge_hits(hits, (await db.execute(query)).mappings().all(), match, limit)
+    return hits
+
+# Candidatos do catálogo para vários part numbers numa única consulta (LATERAL + KNN por linha)
+def match_part_numbers(db: Session, vendor_id: int, part_numbers: dict, candidates: int = CATALOG_CANDIDATES) -> dict:
+    keys = [key for key, pn in part_numbers.items() if normalize_part_number(pn)]
+    if not keys:
+        return {}
+    lines = func.unnest(
+        bindparam("keys", keys, type_=ARRAY(Integer)),
+        bindparam("norms", [normalize_part_number(part_numbers[key]) for key in keys], type_=ARRAY(Text)),
+    ).table_valued(column("key", Integer), column("norm", Text)).render_derived(name="lines")
+    nearest = (
+        select(*CATALOG_COLUMNS, func.similarity(CatalogItem.part_number_norm, lines.c.norm).label("score"))
+        .where(CatalogItem.vendor_id == vendor_id, CatalogItem.part_number_norm.op("%")(lines.c.norm))
+        .order_by(CatalogItem.part_number_norm.op("<->")(lines.c.norm))
+        .limit(candidates)
+        .lateral("nearest")
+    )
+    result = {}
+    for row in db.execute(select(lines.c.key, nearest).select_from(lines).join(nearest, true())).mappings():
+        row = dict(row)
+        result.setdefault(row.pop("key"), []).append({**row, "score": round(float(row["score"]), 4)})
+    return result
@@ -0,0 +1,242 @@
+import os
+import re
+import hashlib
+import logging
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from llm import complete, CACHE_USE, CACHE_BYPASS
+from usage import usage_scope, bind_scope
+from models import AnalysisChunk, AIProvider
+from extraction import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+# Janela de contexto do modelo e tamanho dos trechos da etapa "map"
+ANALYSIS_CONTEXT_TOKENS = int(os.getenv('ANALYSIS_CONTEXT_TOKENS', '128000'))
+ANALYSIS_CHUNK_TOKENS = int(os.getenv('ANALYSIS_CHUNK_TOKENS', '12000'))
+ANALYSIS_MAP_CONCURRENCY = int(os.getenv('ANALYSIS_MAP_CONCURRENCY', '4'))
+ANALYSIS_MAP_MAX_TOKENS = int(os.getenv('ANALYSIS_MAP_MAX_TOKENS', '2000'))
+# Estimativa conservadora para português quando o tiktoken não está disponível
+CHARS_PER_TOKEN = 3
+
+# Alterar o prompt do map invalida os resumos parciais armazenados
+MAP_PROMPT_VERSION = "1"
+
+MAP_SYSTEM_PROMPT = (
+    "Você é um Analista de Pré-Vendas Sênior. Você receberá um trecho de uma RFP (Request for Proposal) "
+    "e deve extrair, em Markdown conciso, todas as informações relevantes do trecho."
+)
+
+MAP_USER_PROMPT = (
+    "Extraia do trecho abaixo tudo o que for relevante para uma análise de RFP: identificação (projeto, cliente, número, datas), "
+    "objetivo, escopo técnico, tecnologias, equipamentos e serviços (com modelos e quantidades), requisitos obrigatórios e desejáveis, "
+    "critérios de qualificação, modelo de precificação, entregáveis, prazos, condições comerciais, riscos e pontos a esclarecer.\n"
+    "- Preserve números, quantidades, datas, modelos e referências a itens/cláusulas exatamente como aparecem.\n"
+    "- Não invente informações; se o trecho não tiver nada relevante, responda apenas 'Sem informações relevantes'.\n"
+    "- Use listas curtas, sem introdução nem conclusão.\n"
+)
+
+CONDENSE_USER_PROMPT = (
+    "As notas abaixo foram extraídas de diferentes trechos de uma mesma RFP. "
+    "Consolide-as em notas únicas em Markdown, removendo repetições e preservando números, quantidades, datas, modelos e requisitos. "
+    "Não invente informações.\n\nNotas:\n"
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Títulos de seção comuns em editais: "3.1 OBJETO", "CAPÍTULO II", "ANEXO I", "CLÁUSULA 5"...
+SECTION_HEADING = re.compile(
+    r"^[ \t]*(?:\d+(?:\.\d+)*[.)]?[ \t]+[A-ZÀ-Ý]|(?:CAP[ÍI]TULO|SE[ÇC][ÃA]O|ANEXO|CL[ÁA]USULA|T[ÍI]TULO)\b)",
+    re.MULTILINE,
+)
+
+@dataclass
+class Chunk:
+    filename: str
+    content_hash: str
+    index: int
+    page_start: int
+    page_end: int
+    text: str
+
+    @property
+    def label(self) -> str:
+        pages = f"p. {self.page_start}" if self.page_start == self.page_end else f"p. {self.page_start}-{self.page_end}"
+        return f"{self.filename} ({pages}, trecho {self.index + 1})"
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(f"{MAP_PROMPT_VERSION}\0{self.content_hash}\0{self.text}".encode("utf-8")).hexdigest()
+
+def _split_oversized(text: str, max_tokens: int) -> list:
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    for separator in ("\n\n", "\n"):
+        pieces = [p for p in text.split(separator) if p.strip()]
+        if len(pieces) > 1:
+            out, current = [], ""
+            for piece in pieces:
+                candidate = f"{current}{separator}{piece}" if current else piece
+                if current and count_tokens(candidate) > max_tokens:
+                    out.extend(_split_oversized(current, max_tokens))
+                    current = piece
+                else:
+                    current = candidate
+            if current:
+                out.extend(_split_oversized(current, max_tokens))
+            return out
+    # Texto sem quebras (ex.: tabela achatada): corte por caracteres
+    size = max(1, max_tokens - 1) * CHARS_PER_TOKEN
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+# Quebra o texto de um arquivo em trechos de até max_tokens, respeitando
+# páginas e preferindo começar um trecho novo em títulos de seção
+def chunk_file_text(filename: str, content_hash: str, text: str, max_tokens: int = ANALYSIS_CHUNK_TOKENS) -> list:
+    units = []  # (página, texto, inicia_secao)
+    for page_no, page in enumerate(text.split(PAGE_BREAK), start=1):
+        starts = [m.start() for m in SECTION_HEADING.finditer(page)]
+        bounds = sorted(set([0] + starts + [len(page)]))
+        for a, b in zip(bounds, bounds[1:]):
+            piece = page[a:b]
+            if not piece.strip():
+                continue
+            for j, part in enumerate(_split_oversized(piece, max_tokens)):
+                units.append((page_no, part, j == 0 and a in starts))
+
+    chunks = []
+    current, current_tokens = [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(Chunk(
+                filename=filename,
+                content_hash=content_hash,
+                index=len(chunks),
+                page_start=current[0][0],
+                page_end=current[-1][0],
+                text="\n".join(part for _, part, _ in current).strip(),
+            ))
+        current, current_tokens = [], 0
+
+    for page_no, part, starts_section in units:
+        tokens = count_tokens(part)
+        if current and (current_tokens + tokens > max_tokens or (starts_section and current_tokens > max_tokens // 2)):
+            flush()
+        current.append((page_no, part, starts_section))
+        current_tokens += tokens
+    flush()
+    return chunks
+
+def _complete(provider: AIProvider, system: str, user: str, operation: str, cache: str = CACHE_USE) -> str:
+    with usage_scope(operation):
+        return complete(
+            provider,
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            max_tokens=ANALYSIS_MAP_MAX_TOKENS,
+            temperature=0.1,
+            cache=cache
+        )
+
+def _summarize_chunk(provider: AIProvider, chunk: Chunk, cache: str = CACHE_USE) -> str:
+    return _complete(provider, MAP_SYSTEM_PROMPT, f"{MAP_USER_PROMPT}\nTrecho ({chunk.label}):\n{chunk.text}", "analise_map", cache)
+
+def _store_summary(db: Session, chunk: Chunk, model: str, summary: str):
+    stmt = pg_insert(AnalysisChunk).values(
+        chunk_hash=chunk.hash, model=model, content_hash=chunk.content_hash, label=chunk.label[:255], summary=summary
+    )
+    db.execute(stmt.on_conflict_do_update(
+        constraint='uq_analysis_chunks_hash_model',
+        set_={'summary': stmt.excluded.summary, 'label': stmt.excluded.label},
+    ))
+    db.commit()
+
+def _noop_progress(percent: int, stage: str):
+    pass
+
+# Etapa "map": resume cada trecho em paralelo (limitado por ANALYSIS_MAP_CONCURRENCY);
+# trechos já resumidos em análises anteriores vêm da tabela analysis_chunks
+# (exceto com cache=refresh|bypass; bypass também não grava os novos resumos)
+def summarize_chunks(db: Session, provider: AIProvider, chunks: list, progress=_noop_progress, cache: str = CACHE_USE) -> list:
+    model = provider.model
+    stored = {}
+    hashes = [c.hash for c in chunks]
+    if hashes and cache == CACHE_USE:
+        rows = db.query(AnalysisChunk.chunk_hash, AnalysisChunk.summary).filter(
+            AnalysisChunk.model == model, AnalysisChunk.chunk_hash.in_(hashes)
+        ).all()
+        stored = dict(rows)
+    summaries = [stored.get(h) for h in hashes]
+    missing = [i for i, s in enumerate(summaries) if s is None]
+    logger.info("Análise map-reduce: %s trechos, %s reaproveitados", len(chunks), len(chunks) - len(missing))
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, ANALYSIS_MAP_CONCURRENCY)) as pool:
+            futures = {pool.submit(bind_scope(_summarize_chunk), provider, chunks[i], cache): i for i in missing}
+            for done, fut in enumerate(as_completed(futures), start=1):
+                i = futures[fut]
+                summaries[i] = fut.result()
+                if cache != CACHE_BYPASS:
+                    _store_summary(db, chunks[i], model, summaries[i])
+                progress(done, len(missing))
+    return summaries
+
+def _join_notes(labeled: list) -> str:
+    return "\n\n".join(f"### {label}\n{summary}" for label, summary in labeled)
+
+# Etapa "reduce" intermediária: consolida notas em lotes até caberem no orçamento
+def condense_notes(provider: AIProvider, labeled: list, budget: int, cache: str = CACHE_USE) -> str:
+    notes = _join_notes(labeled)
+    while count_tokens(notes) > budget and len(labeled) > 1:
+        batches, current = [], []
+        for item in labeled:
+            if current and count_tokens(_join_notes(current + [item])) > ANALYSIS_CHUNK_TOKENS:
+                batches.append(current)
+                current = []
+            current.append(item)
+        batches.append(current)
+        if len(batches) == len(labeled):
+            # Cada nota sozinha já estoura o lote: agrupa de dois em dois para garantir progresso
+            batches = [labeled[i:i + 2] for i in range(0, len(labeled), 2)]
+        with ThreadPoolExecutor(max_workers=max(1, ANALYSIS_MAP_CONCURRENCY)) as pool:
+            results = list(pool.map(
+                bind_scope(lambda batch: _complete(provider, MAP_SYSTEM_PROMPT, CONDENSE_USER_PROMPT + _join_notes(batch), "analise_condensar", cache)),
+                batches,
+            ))
+        labeled = [
+            (f"{batch[0][0]} … {batch[-1][0]}" if len(batch) > 1 else batch[0][0], result)
+            for batch, result in zip(batches, results)
+        ]
+        notes = _join_notes(labeled)
+    return notes
+
+# Map-reduce completo: trechos por arquivo/seção/página -> resumos parciais -> notas
+# consolidadas que cabem no prompt final (template de 12 seções)
+def build_rfp_notes(db: Session, provider: AIProvider, files: list, budget: int, progress=_noop_progress, cache: str = CACHE_USE) -> str:
+    chunks = []
+    for file_rec, text in files:
+        chunks.extend(chunk_file_text(file_rec.filename, file_rec.content_hash or "", text))
+    progress(0, f"Resumindo {len(chunks)} trecho(s)")
+    summaries = summarize_chunks(db, provider, chunks, lambda done, total: progress(int(100 * done / total), f"Trechos resumidos: {done}/{total}"), cache)
+    labeled = [(c.label, s) for c, s in zip(chunks, summaries)]
+    return condense_notes(provider, labeled, budget, cache)
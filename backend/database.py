@@ -1,7 +1,9 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv
+from metrics import TimedQueuePool, TimedAsyncQueuePool
 
 load_dotenv()
 
@@ -11,7 +13,26 @@ DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 DB_PORT = os.getenv('POSTGRES_PORT', '5432')
 DB_NAME = os.getenv('POSTGRES_DB', 'rfp_db')
 
+# Pool de conexões (vale para o engine síncrono e para o assíncrono)
+DB_POOL_SIZE = int(os.getenv('POSTGRES_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('POSTGRES_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('POSTGRES_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('POSTGRES_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=TimedAsyncQueuePool, **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,159 @@
+import os
+import io
+import re
+import json
+import uuid
+import hashlib
+import logging
+import threading
+import unicodedata
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+from storage import STORAGE_LOCAL_ROOT, file_sha256
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "proposta_template.docx")
+# Documentos renderizados, por hash de (dados da proposta + versão do template)
+DOCX_RENDER_CACHE_DIR = os.getenv('DOCX_RENDER_CACHE_DIR', f"{STORAGE_LOCAL_ROOT}/renders")
+DOCX_RENDER_CACHE_MAX_MB = int(os.getenv('DOCX_RENDER_CACHE_MAX_MB', '512'))
+
+# Environment que compila cada parte do template uma única vez (from_string é chamado
+# pelo docxtpl a cada render com o mesmo XML)
+class _CompilingEnvironment(Environment):
+    def __init__(self):
+        super().__init__()
+        self._compiled = {}
+        self._compile_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        template = self._compiled.get(source)
+        if template is None:
+            with self._compile_lock:
+                template = self._compiled.get(source)
+                if template is None:
+                    template = super().from_string(source, globals, template_class)
+                    self._compiled[source] = template
+        return template
+
+class CompiledTemplate:
+    def __init__(self, path: str):
+        stat_result = os.stat(path)
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self.stamp = (stat_result.st_mtime_ns, stat_result.st_size)
+        self.version = hashlib.sha256(self.data).hexdigest()
+        self.env = _CompilingEnvironment()
+        # XML do corpo já limpo pelo docxtpl (patch_xml é a etapa mais cara do render)
+        tpl = DocxTemplate(io.BytesIO(self.data))
+        tpl.init_docx()
+        self.body_xml = tpl.patch_xml(tpl.get_xml())
+        # Render vazio: compila corpo, cabeçalhos, rodapés e propriedades no environment
+        _Renderer(self).render({}, self.env)
+
+class _Renderer(DocxTemplate):
+    def __init__(self, compiled: CompiledTemplate):
+        super().__init__(io.BytesIO(compiled.data))
+        self.compiled = compiled
+
+    def build_xml(self, context, jinja_env=None):
+        return self.render_xml_part(self.compiled.body_xml, self.docx._part, context, jinja_env)
+
+_template_lock = threading.Lock()
+_template = None
+
+# Template compilado; recarregado só quando mtime/tamanho mudam e o conteúdo (hash) é outro
+def get_template(path: str = TEMPLATE_PATH) -> CompiledTemplate:
+    global _template
+    stat_result = os.stat(path)
+    stamp = (stat_result.st_mtime_ns, stat_result.st_size)
+    current = _template
+    if current is not None and current.stamp == stamp:
+        return current
+    with _template_lock:
+        current = _template
+        if current is None or current.stamp != stamp:
+            if current is not None and current.version == file_sha256(path):
+                current.stamp = stamp
+            else:
+                logger.info("Compilando template %s", path)
+                _template = current = CompiledTemplate(path)
+    return current
+
+# Chaves das seções normalizadas para variáveis do Jinja ("Escopo de Serviços" -> ESCOPO_DE_SERVICOS)
+def normalize_key(key: str) -> str:
+    nk = unicodedata.normalize('NFKD', key)
+    nk = nk.encode('ASCII', 'ignore').decode('ASCII')
+    return re.sub(r"\W+", "_", nk).strip("_").upper()
+
+def proposta_context(raw_sections: dict) -> dict:
+    sections = {normalize_key(k): v for k, v in raw_sections.items()}
+    logger.debug("Sections normalized for Jinja: %s", list(sections.keys()))
+    return sections
+
+def render_key(dados: dict, version: str) -> str:
+    payload = json.dumps(dados, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{version}\n{payload}".encode("utf-8")).hexdigest()
+
+# Locks por chave: downloads simultâneos da mesma proposta renderizam uma vez só
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+def _render_lock(key: str) -> threading.Lock:
+    with _render_locks_guard:
+        return _render_locks.setdefault(key, threading.Lock())
+
+def _prune_cache(keep: str):
+    entries = []
+    for name in os.listdir(DOCX_RENDER_CACHE_DIR):
+        path = os.path.join(DOCX_RENDER_CACHE_DIR, name)
+        if path == keep or name.endswith(".tmp"):
+            continue
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat_result.st_mtime, stat_result.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    limit = DOCX_RENDER_CACHE_MAX_MB * 1024 * 1024
+    # Remove os menos usados (mtime é atualizado a cada acerto)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Arquivo renderizado do cache (mtime atualizado) ou gerado por write(caminho_temporario)
+def cached_render(key: str, suffix: str, write) -> str:
+    path = os.path.join(DOCX_RENDER_CACHE_DIR, f"{key}{suffix}")
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    with _render_lock(key):
+        if not os.path.isfile(path):
+            os.makedirs(DOCX_RENDER_CACHE_DIR, exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            write(tmp)
+            os.replace(tmp, path)
+    with _render_locks_guard:
+        _render_locks.pop(key, None)
+    _prune_cache(keep=path)
+    return path
+
+# Renderiza a proposta em disco (ou reaproveita o arquivo já renderizado) e retorna (caminho, chave).
+# context_builder só é chamado se houver render; recebe os dados e devolve o contexto do Jinja.
+def render_docx(dados: dict, context_builder=proposta_context) -> tuple:
+    template = get_template()
+    key = render_key(dados, template.version)
+
+    def write(tmp: str):
+        tpl = _Renderer(template)
+        tpl.render(context_builder(dados), template.env)
+        tpl.save(tmp)
+
+    return cached_render(key, ".docx", write), key
@@ -0,0 +1,68 @@
+import os
+import hashlib
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+# '' (padrão): o worker envia o arquivo; 'x-accel': nginx (X-Accel-Redirect); 'x-sendfile': Apache/lighttpd
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+# Location interna do nginx que aponta para o diretório do backend, ex.:
+#   location /protected/ { internal; alias /app/; }
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected').rstrip('/')
+# Arquivos exigem autenticação: o cliente guarda, mas revalida sempre (ETag/Last-Modified)
+DOWNLOAD_CACHE_CONTROL = os.getenv('DOWNLOAD_CACHE_CONTROL', 'private, no-cache')
+
+def _etag(stat_result: os.stat_result, content_hash: str = None) -> str:
+    if content_hash:
+        return f'"{content_hash}"'
+    # Sem hash do conteúdo: mesmo formato do ETag do Starlette (mtime + tamanho)
+    base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{hashlib.md5(base.encode(), usedforsecurity=False).hexdigest()}"'
+
+def content_disposition(filename: str, disposition: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Comparação fraca, como manda a RFC 9110 para If-None-Match
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+# Resposta de download com validadores fortes (ETag = SHA-256 do conteúdo), 304 condicional,
+# Range/If-Range (via FileResponse) e, se configurado, envio delegado ao proxy
+def file_response(request: Request, path: str, filename: str, content_hash: str = None, media_type: str = None, disposition: str = "attachment") -> Response:
+    stat_result = os.stat(path)
+    headers = {
+        "ETag": _etag(stat_result, content_hash),
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": DOWNLOAD_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if DOWNLOAD_OFFLOAD in ("x-accel", "x-sendfile"):
+        headers["Content-Disposition"] = content_disposition(filename, disposition)
+        if DOWNLOAD_OFFLOAD == "x-accel":
+            relative = os.path.relpath(os.path.abspath(path), os.getcwd()).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = quote(f"{DOWNLOAD_ACCEL_PREFIX}/{relative}")
+        else:
+            headers["X-Sendfile"] = os.path.abspath(path)
+        return Response(media_type=media_type, headers=headers)
+    return FileResponse(
+        path, filename=filename, media_type=media_type, headers=headers,
+        stat_result=stat_result, content_disposition_type=disposition,
+    )
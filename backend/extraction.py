@@ -0,0 +1,301 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from docx import Document
+from PyPDF2 import PdfReader
+from models import RFPFile, ExtractedText, AnalysisChunk
+from storage import file_sha256, local_path
+from metrics import observe_extraction
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".docx", ".pdf")
+# Separador entre páginas de PDF no texto extraído (usado pelo chunker da análise)
+PAGE_BREAK = "\f"
+
+# Configuração do pool de extração
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+EXTRACTION_PAGES_PER_TASK = int(os.getenv('EXTRACTION_PAGES_PER_TASK', '40'))
+EXTRACTION_FILE_TIMEOUT = int(os.getenv('EXTRACTION_FILE_TIMEOUT', '120'))
+EXTRACTION_MEMORY_MB = int(os.getenv('EXTRACTION_MEMORY_MB', '1024'))
+# Tempo extra antes de considerar um worker travado fora do alcance do SIGALRM (código C)
+EXTRACTION_HANG_GRACE = 30
+
+# forkserver evita fazer fork do processo do uvicorn (multithread); spawn fora do Linux
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Blobs do armazenamento não têm extensão: o tipo vem do nome original do arquivo
+def file_ext(file_rec: RFPFile) -> str:
+    return os.path.splitext(file_rec.filename or file_rec.filepath)[1].lower()
+
+def extract_file_text(path: str, ext: str = None):
+    ext = ext or os.path.splitext(path)[1].lower()
+    if ext == ".docx":
+        doc = Document(path)
+        return "\n".join([p.text for p in doc.paragraphs])
+    if ext == ".pdf":
+        reader = PdfReader(path)
+        return PAGE_BREAK.join([page.extract_text() or "" for page in reader.pages])
+    return None
+
+def _noop_progress(done: int, total: int):
+    pass
+
+# --- Funções executadas nos processos do pool ---
+
+def _init_worker(memory_mb: int):
+    if resource and memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("Tempo limite de extração excedido")
+
+def _run_with_timeout(timeout: int, fn, *args):
+    if timeout <= 0 or not hasattr(signal, "SIGALRM"):
+        return fn(*args)
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(timeout)
+    try:
+        return fn(*args)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _pdf_page_count(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def _pdf_pages_text(path: str, start: int, end: int) -> str:
+    reader = PdfReader(path)
+    return PAGE_BREAK.join([reader.pages[i].extract_text() or "" for i in range(start, end)])
+
+def _docx_text(path: str) -> str:
+    return extract_file_text(path, ".docx")
+
+def _task_pdf_page_count(path: str, timeout: int) -> int:
+    return _run_with_timeout(timeout, _pdf_page_count, path)
+
+def _task_pdf_pages(path: str, start: int, end: int, timeout: int) -> str:
+    return _run_with_timeout(timeout, _pdf_pages_text, path, start, end)
+
+def _task_docx(path: str, timeout: int) -> str:
+    return _run_with_timeout(timeout, _docx_text, path)
+
+# --- Orquestração ---
+
+def _kill_pool(pool: ProcessPoolExecutor):
+    # Não há API pública para matar um worker travado; encerra os processos do pool
+    for proc in list((pool._processes or {}).values()):
+        proc.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_round(paths: list, exts: list, indices: list, results: list, workers: int, on_done) -> list:
+    timeout = EXTRACTION_FILE_TIMEOUT
+    ctx = multiprocessing.get_context(_START_METHOD)
+    if _START_METHOD == "forkserver":
+        # Workers nascem do forkserver já com PyPDF2/python-docx importados
+        ctx.set_forkserver_preload([__name__])
+    pool = ProcessPoolExecutor(
+        max_workers=max(1, min(workers, len(indices) * 4)),
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(EXTRACTION_MEMORY_MB,),
+    )
+    futures = {}
+    parts = {}
+    expected = {}
+    failed = set()
+    broken = set()
+
+    def submit(key, fn, *args):
+        try:
+            futures[pool.submit(fn, *args)] = key
+        except BrokenProcessPool:
+            broken.add(key[1])
+
+    def fail(i, exc):
+        if i not in failed:
+            failed.add(i)
+            logger.warning("Falha ao extrair texto de %s: %s", paths[i], exc)
+            on_done(i)
+
+    for i in indices:
+        if exts[i] == ".pdf":
+            submit(("count", i), _task_pdf_page_count, paths[i], timeout)
+        else:
+            submit(("docx", i), _task_docx, paths[i], timeout)
+
+    try:
+        while futures:
+            done, _ = wait(futures, timeout=timeout + EXTRACTION_HANG_GRACE, return_when=FIRST_COMPLETED)
+            if not done:
+                # Nenhuma tarefa terminou nem estourou o alarme: worker travado
+                for kind, i, *_ in futures.values():
+                    fail(i, "worker travado")
+                futures.clear()
+                _kill_pool(pool)
+                break
+            for fut in done:
+                kind, i, *rest = futures.pop(fut)
+                if i in failed or i in broken:
+                    continue
+                try:
+                    value = fut.result()
+                except BrokenProcessPool:
+                    # Um worker morreu (ex.: limite de memória); o arquivo será reprocessado
+                    broken.add(i)
+                    continue
+                except Exception as e:
+                    fail(i, e)
+                    continue
+                if kind == "count":
+                    ranges = range(0, value, EXTRACTION_PAGES_PER_TASK)
+                    expected[i] = len(ranges)
+                    parts[i] = {}
+                    if not ranges:
+                        results[i] = ""
+                        on_done(i)
+                    for start in ranges:
+                        end = min(value, start + EXTRACTION_PAGES_PER_TASK)
+                        submit(("pages", i, start), _task_pdf_pages, paths[i], start, end, timeout)
+                elif kind == "docx":
+                    results[i] = value
+                    on_done(i)
+                else:
+                    parts[i][rest[0]] = value
+                    if len(parts[i]) == expected[i]:
+                        # Remonta as faixas de páginas na ordem original
+                        results[i] = PAGE_BREAK.join(parts[i][start] for start in sorted(parts[i]))
+                        on_done(i)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return sorted(broken - failed)
+
+# Extrai o texto de vários arquivos em paralelo (arquivos e faixas de páginas de PDFs
+# grandes são distribuídos num pool de processos). Retorna os textos na mesma ordem
+# de `paths`; arquivos não suportados, com erro, timeout ou estouro de memória ficam None.
+# `exts` informa o tipo de cada arquivo quando o caminho não tem extensão.
+def extract_files_parallel(paths: list, workers: int = None, progress=_noop_progress, exts: list = None) -> list:
+    workers = EXTRACTION_WORKERS if workers is None else workers
+    exts = exts or [os.path.splitext(p)[1].lower() for p in paths]
+    results = [None] * len(paths)
+    pending = [i for i, ext in enumerate(exts) if ext in SUPPORTED_EXTENSIONS]
+    total = len(pending)
+    done = 0
+    # Início de cada arquivo, para a métrica de tempo de extração por tipo
+    started = {}
+
+    def on_done(i: int):
+        nonlocal done
+        done += 1
+        observe_extraction(exts[i], "ok" if results[i] is not None else "error", time.perf_counter() - started[i])
+        progress(done, total)
+
+    if workers <= 1:
+        for i in pending:
+            started[i] = time.perf_counter()
+            try:
+                results[i] = extract_file_text(paths[i], exts[i])
+            except Exception as e:
+                logger.warning("Falha ao extrair texto de %s: %s", paths[i], e)
+            on_done(i)
+        return results
+    # Se um worker morrer, os arquivos afetados ganham uma segunda rodada num pool novo
+    for attempt in range(2):
+        if not pending:
+            break
+        now = time.perf_counter()
+        started.update((i, now) for i in pending if i not in started)
+        pending = _extract_round(paths, exts, pending, results, workers, on_done)
+    for i in pending:
+        logger.warning("Extração de %s abortada: o worker foi encerrado", paths[i])
+        on_done(i)
+    return results
+
+# Garante que o RFPFile tenha o hash do conteúdo (arquivos antigos não têm)
+def ensure_content_hash(db: Session, file_rec: RFPFile) -> str:
+    if not file_rec.content_hash:
+        file_rec.content_hash = file_sha256(local_path(file_rec.filepath))
+        db.commit()
+    return file_rec.content_hash
+
+def store_extracted_text(db: Session, content_hash: str, text: str):
+    # ON CONFLICT DO NOTHING: outro worker pode ter extraído o mesmo conteúdo
+    db.execute(
+        pg_insert(ExtractedText)
+        .values(content_hash=content_hash, text=text)
+        .on_conflict_do_nothing(index_elements=[ExtractedText.content_hash])
+    )
+    db.commit()
+
+# Texto do arquivo, extraído uma única vez por conteúdo (SHA-256)
+def get_file_text(db: Session, file_rec: RFPFile):
+    if file_ext(file_rec) not in SUPPORTED_EXTENSIONS:
+        return None
+    content_hash = ensure_content_hash(db, file_rec)
+    cached = db.query(ExtractedText.text).filter(ExtractedText.content_hash == content_hash).scalar()
+    if cached is not None:
+        logger.debug("Texto de %s reaproveitado do cache (%s)", file_rec.filename, content_hash)
+        return cached
+    started = time.perf_counter()
+    text = extract_file_text(local_path(file_rec.filepath), file_ext(file_rec))
+    observe_extraction(file_ext(file_rec), "ok" if text is not None else "error", time.perf_counter() - started)
+    if text is not None:
+        store_extracted_text(db, content_hash, text)
+    return text
+
+# Textos de vários arquivos: usa o cache e extrai os faltantes em paralelo
+def get_files_text(db: Session, file_recs: list, progress=_noop_progress) -> list:
+    results = [None] * len(file_recs)
+    misses = {}
+    for i, file_rec in enumerate(file_recs):
+        if file_ext(file_rec) not in SUPPORTED_EXTENSIONS:
+            continue
+        content_hash = ensure_content_hash(db, file_rec)
+        misses.setdefault(content_hash, []).append(i)
+    if misses:
+        cached = db.query(ExtractedText.content_hash, ExtractedText.text).filter(
+            ExtractedText.content_hash.in_(list(misses))
+        ).all()
+        for content_hash, text in cached:
+            for i in misses.pop(content_hash):
+                results[i] = text
+    if misses:
+        hashes = list(misses)
+        # Arquivos idênticos na mesma RFP são extraídos uma única vez
+        firsts = [file_recs[misses[h][0]] for h in hashes]
+        texts = extract_files_parallel(
+            [local_path(f.filepath) for f in firsts], progress=progress, exts=[file_ext(f) for f in firsts]
+        )
+        for content_hash, text in zip(hashes, texts):
+            if text is None:
+                continue
+            store_extracted_text(db, content_hash, text)
+            for i in misses[content_hash]:
+                results[i] = text
+    return results
+
+# Remove textos (e resumos de trechos) em cache que não são mais referenciados por nenhum arquivo
+def purge_orphan_texts(db: Session, hashes):
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return
+    in_use = {
+        h for (h,) in db.query(RFPFile.content_hash).filter(RFPFile.content_hash.in_(hashes)).distinct()
+    }
+    orphans = hashes - in_use
+    if orphans:
+        db.query(ExtractedText).filter(ExtractedText.content_hash.in_(orphans)).delete(synchronize_session=False)
+        db.query(AnalysisChunk).filter(AnalysisChunk.content_hash.in_(orphans)).delete(synchronize_session=False)
+        db.commit()
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+import unicodedata
+from typing import Literal
+from concurrent.futures import Future
+from fastapi import Query, Header
+from sqlalchemy import func, select, delete, update
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from llm_clients import get_client
+from models import AIProvider, LLMResponse
+from usage import enforce_budget, record_usage
+from routing import route
+from ratelimit import governed, estimate_tokens, settle
+
+logger = logging.getLogger(__name__)
+
+# Cache compartilhado das respostas das LLMs (tabela llm_responses)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_CACHE_TTL_HOURS = float(os.getenv('LLM_CACHE_TTL_HOURS', '168'))
+LLM_CACHE_MAX_MB = float(os.getenv('LLM_CACHE_MAX_MB', '256'))
+LLM_CACHE_PURGE_SECONDS = float(os.getenv('LLM_CACHE_PURGE_SECONDS', '600'))
+# Outro worker gerando a mesma resposta: espera até este limite antes de assumir a chamada
+LLM_CACHE_PENDING_TIMEOUT = float(os.getenv('LLM_CACHE_PENDING_TIMEOUT', '600'))
+LLM_CACHE_POLL_SECONDS = 0.5
+
+# Modos por chamada: 'use' (lê e grava), 'refresh' (ignora o cache, grava a nova resposta)
+# e 'bypass' (não lê nem grava)
+CACHE_USE = "use"
+CACHE_REFRESH = "refresh"
+CACHE_BYPASS = "bypass"
+CACHE_MODES = (CACHE_USE, CACHE_REFRESH, CACHE_BYPASS)
+
+# Dependência dos endpoints que chamam a LLM: ?cache=refresh|bypass ou
+# Cache-Control: no-cache (refresh) / no-store (bypass)
+def llm_cache_mode(cache: Literal["use", "refresh", "bypass"] = Query(CACHE_USE), cache_control: str = Header(None)) -> str:
+    if cache == CACHE_USE and cache_control:
+        directives = {d.strip().lower() for d in cache_control.split(",")}
+        if "no-store" in directives:
+            return CACHE_BYPASS
+        if "no-cache" in directives:
+            return CACHE_REFRESH
+    return cache
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "refresh": 0, "bypass": 0, "errors": 0}
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _normalize_text(text) -> str:
+    if not isinstance(text, str):
+        return text
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n")
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+def _normalize_messages(messages: list) -> list:
+    return [{**m, "content": _normalize_text(m.get("content"))} for m in messages]
+
+def cache_key(provider_name: str, model: str, temperature: float, max_tokens: int, messages: list) -> str:
+    payload = json.dumps({
+        "provider": provider_name,
+        "model": model,
+        "temperature": float(temperature),
+        "max_tokens": max_tokens,
+        "messages": _normalize_messages(messages),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# --- Armazenamento ---
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+def _lookup(key: str):
+    with SessionLocal() as db:
+        row = db.query(LLMResponse.status, LLMResponse.content, LLMResponse.created_at, LLMResponse.claimed_at).filter(LLMResponse.cache_key == key).first()
+        if row is None:
+            return None
+        if row.status == "ready" and row.created_at < _utcnow() - datetime.timedelta(hours=LLM_CACHE_TTL_HOURS):
+            return None
+        if row.status == "ready":
+            db.execute(update(LLMResponse).where(LLMResponse.cache_key == key).values(hits=LLMResponse.hits + 1, last_hit_at=_utcnow()))
+            db.commit()
+        return row
+
+# Reserva a chave para este processo (linha 'pending'); False se outro worker já reservou
+def _claim(key: str, provider_name: str, model: str, temperature: float) -> bool:
+    now = _utcnow()
+    with SessionLocal() as db:
+        db.add(LLMResponse(cache_key=key, provider=provider_name, model=model, temperature=temperature, status="pending", claimed_at=now, last_hit_at=now))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+        # Reserva abandonada (worker morreu) ou resposta expirada: assume com compare-and-set
+        row = db.query(LLMResponse.status, LLMResponse.claimed_at, LLMResponse.created_at).filter(LLMResponse.cache_key == key).first()
+        if row is None:
+            return False
+        if row.status == "pending":
+            if row.claimed_at >= now - datetime.timedelta(seconds=LLM_CACHE_PENDING_TIMEOUT):
+                return False
+            current = LLMResponse.claimed_at == row.claimed_at
+        else:
+            if row.created_at >= now - datetime.timedelta(hours=LLM_CACHE_TTL_HOURS):
+                return False
+            current = LLMResponse.created_at == row.created_at
+        result = db.execute(
+            update(LLMResponse)
+            .where(LLMResponse.cache_key == key, LLMResponse.status == row.status, current)
+            .values(status="pending", claimed_at=now)
+        )
+        db.commit()
+        return result.rowcount == 1
+
+def _store(key: str, provider_name: str, model: str, temperature: float, content: str):
+    now = _utcnow()
+    values = dict(status="ready", content=content, size=len(content.encode("utf-8")), created_at=now, last_hit_at=now, claimed_at=None)
+    with SessionLocal() as db:
+        result = db.execute(update(LLMResponse).where(LLMResponse.cache_key == key).values(**values))
+        if result.rowcount == 0:
+            db.add(LLMResponse(cache_key=key, provider=provider_name, model=model, temperature=temperature, hits=0, **values))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+    _maybe_purge()
+
+def _release(key: str):
+    with SessionLocal() as db:
+        db.execute(delete(LLMResponse).where(LLMResponse.cache_key == key, LLMResponse.status == "pending"))
+        db.commit()
+
+def _wait_for_other_worker(key: str):
+    deadline = time.monotonic() + LLM_CACHE_PENDING_TIMEOUT
+    while time.monotonic() < deadline:
+        row = _cache_op(_lookup, None, key)
+        if row is None:
+            return None  # o outro worker falhou: segue com a própria chamada
+        if row.status == "ready":
+            return row.content
+        time.sleep(LLM_CACHE_POLL_SECONDS)
+    return None
+
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+# Remove respostas expiradas e, acima de LLM_CACHE_MAX_MB, as menos usadas recentemente
+def purge_cache():
+    now = _utcnow()
+    limit = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+    with SessionLocal() as db:
+        db.execute(delete(LLMResponse).where(LLMResponse.status == "ready", LLMResponse.created_at < now - datetime.timedelta(hours=LLM_CACHE_TTL_HOURS)))
+        db.execute(delete(LLMResponse).where(LLMResponse.status == "pending", LLMResponse.claimed_at < now - datetime.timedelta(seconds=2 * LLM_CACHE_PENDING_TIMEOUT)))
+        running = func.sum(LLMResponse.size).over(order_by=(LLMResponse.last_hit_at.desc(), LLMResponse.cache_key)).label("running")
+        ranked = select(LLMResponse.cache_key, running).where(LLMResponse.status == "ready").subquery()
+        db.execute(delete(LLMResponse).where(LLMResponse.cache_key.in_(select(ranked.c.cache_key).where(ranked.c.running > limit))))
+        db.commit()
+
+def _maybe_purge():
+    global _last_purge
+    with _purge_lock:
+        if time.monotonic() - _last_purge < LLM_CACHE_PURGE_SECONDS:
+            return
+        _last_purge = time.monotonic()
+    try:
+        purge_cache()
+    except Exception:
+        logger.warning("Falha ao limpar o cache de respostas LLM", exc_info=True)
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["coalesced"]) / lookups, 4) if lookups else None
+    with SessionLocal() as db:
+        entries, size = db.query(func.count(LLMResponse.cache_key), func.coalesce(func.sum(LLMResponse.size), 0)).filter(LLMResponse.status == "ready").one()
+    stats.update(entries=entries, bytes=int(size))
+    return stats
+
+# --- Chamada ---
+
+_inflight_lock = threading.Lock()
+_inflight = {}  # chave -> Future da chamada em andamento neste processo
+
+def _call(provider: AIProvider, model: str, messages: list, max_tokens: int, temperature: float) -> str:
+    reserved = estimate_tokens(messages, max_tokens)
+    started = None
+
+    # Latência medida a partir do envio (sem a espera na fila do limite de taxa)
+    def create():
+        nonlocal started
+        started = time.monotonic()
+        return get_client(provider).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+
+    try:
+        response = governed(provider, reserved, create)
+    except Exception:
+        if started is not None:
+            record_usage(provider, model, max_tokens, latency_ms=int((time.monotonic() - started) * 1000), status="error")
+        raise
+    usage = getattr(response, "usage", None)
+    choice = response.choices[0]
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    settle(provider, reserved, prompt_tokens + completion_tokens)
+    record_usage(
+        provider, model, max_tokens,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency_ms=int((time.monotonic() - started) * 1000),
+        finish_reason=getattr(choice, "finish_reason", None),
+    )
+    return choice.message.content or ""
+
+# Falha no banco do cache não impede a chamada ao provedor
+def _cache_op(fn, fallback, *args):
+    try:
+        return fn(*args)
+    except Exception:
+        logger.warning("Falha ao acessar o cache de respostas LLM", exc_info=True)
+        return fallback
+
+# Completion (não streaming) com cache compartilhado: chamadas idênticas simultâneas,
+# no mesmo processo ou em outros workers, resultam numa única chamada ao provedor.
+# O uso é registrado no ledger (usage.py) e as cotas do escopo atual podem recusar a
+# chamada (BudgetExceeded) ou trocar o modelo. Em falha do provedor, a política de
+# roteamento da operação pode repassar a chamada a outro (failover/hedging).
+def complete(provider: AIProvider, messages: list, max_tokens: int, temperature: float, cache: str = CACHE_USE) -> str:
+    model = enforce_budget(provider.model)
+
+    # Roteada entre provedores (routing.py); a chave do cache é a do provedor primário
+    def call(target: AIProvider, target_model: str) -> str:
+        return _call(target, target_model, messages, max_tokens, temperature)
+
+    if not LLM_CACHE_ENABLED or cache == CACHE_BYPASS:
+        _count("bypass")
+        return route(provider, model, call)
+    started = time.monotonic()
+    key = cache_key(provider.name, model, temperature, max_tokens, messages)
+
+    def served_from_cache(content: str) -> str:
+        record_usage(provider, model, max_tokens, latency_ms=int((time.monotonic() - started) * 1000), cached=True)
+        return content
+
+    if cache == CACHE_USE:
+        row = _cache_op(_lookup, None, key)
+        if row is not None and row.status == "ready":
+            _count("hits")
+            return served_from_cache(row.content)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        _count("coalesced")
+        return served_from_cache(future.result())
+    try:
+        _count("refresh" if cache == CACHE_REFRESH else "misses")
+        content = None
+        if cache == CACHE_USE and not _cache_op(_claim, True, key, provider.name, model, temperature):
+            content = _wait_for_other_worker(key)
+            if content is not None:
+                served_from_cache(content)
+        if content is None:
+            try:
+                content = route(provider, model, call)
+            except Exception:
+                _count("errors")
+                _cache_op(_release, None, key)
+                raise
+            _cache_op(_store, None, key, provider.name, model, temperature, content)
+        future.set_result(content)
+        return content
+    except BaseException as e:
+        if not future.done():
+            future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
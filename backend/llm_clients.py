@@ -0,0 +1,107 @@
+import os
+import hashlib
+import logging
+import threading
+import httpx
+import anyio
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from models import AIProvider
+
+logger = logging.getLogger(__name__)
+
+# Pool de conexões compartilhado por todas as chamadas a um provedor
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '50'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '600'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+# Retentativas internas do SDK; por padrão ficam com ratelimit.governed (Retry-After compartilhado e jitter)
+LLM_CLIENT_MAX_RETRIES = int(os.getenv('LLM_CLIENT_MAX_RETRIES', '0'))
+
+class _ProviderClients:
+    def __init__(self, fingerprint: str, sync_client: OpenAI, async_client: AsyncOpenAI):
+        self.fingerprint = fingerprint
+        self.sync_client = sync_client
+        self.async_client = async_client
+
+_lock = threading.Lock()
+_registry = {}  # provider_id -> _ProviderClients
+
+def _fingerprint(provider: AIProvider) -> str:
+    return hashlib.sha256(provider.api_key.encode("utf-8")).hexdigest()
+
+def _http_options() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+    }
+
+def _build(provider: AIProvider, fingerprint: str) -> _ProviderClients:
+    http2 = LLM_HTTP2
+    try:
+        sync_http = DefaultHttpxClient(http2=http2, **_http_options())
+        async_http = DefaultAsyncHttpxClient(http2=http2, **_http_options())
+    except ImportError:
+        # Pacote h2 ausente: segue em HTTP/1.1 com keep-alive
+        logger.warning("Pacote h2 não instalado; clientes LLM usarão HTTP/1.1")
+        sync_http = DefaultHttpxClient(**_http_options())
+        async_http = DefaultAsyncHttpxClient(**_http_options())
+    logger.info("Criando clientes LLM para o provedor %s (%s)", provider.id, provider.name)
+    return _ProviderClients(
+        fingerprint,
+        OpenAI(api_key=provider.api_key, http_client=sync_http, max_retries=LLM_CLIENT_MAX_RETRIES),
+        AsyncOpenAI(api_key=provider.api_key, http_client=async_http, max_retries=LLM_CLIENT_MAX_RETRIES),
+    )
+
+def _close(entry: _ProviderClients):
+    try:
+        entry.sync_client.close()
+    except Exception:
+        logger.debug("Falha ao fechar cliente LLM síncrono", exc_info=True)
+    try:
+        # Handlers síncronos rodam no threadpool do anyio, que permite voltar ao event loop
+        anyio.from_thread.run(entry.async_client.close)
+    except Exception:
+        # Fora do threadpool (ex.: script): o pool assíncrono é liberado pelo GC
+        pass
+
+def _get(provider: AIProvider) -> _ProviderClients:
+    fingerprint = _fingerprint(provider)
+    stale = None
+    with _lock:
+        entry = _registry.get(provider.id)
+        if entry is None or entry.fingerprint != fingerprint:
+            # Chave alterada (inclusive por outro worker): recria os clientes
+            stale = entry
+            entry = _build(provider, fingerprint)
+            _registry[provider.id] = entry
+    if stale is not None:
+        _close(stale)
+    return entry
+
+# Cliente síncrono compartilhado do provedor (conexões keep-alive reaproveitadas)
+def get_client(provider: AIProvider) -> OpenAI:
+    return _get(provider).sync_client
+
+# Cliente assíncrono compartilhado do provedor, para os endpoints em streaming
+def get_async_client(provider: AIProvider) -> AsyncOpenAI:
+    return _get(provider).async_client
+
+# Descarta os clientes de um provedor; chamado quando a linha do provedor muda
+def invalidate_provider(provider_id: int):
+    with _lock:
+        entry = _registry.pop(provider_id, None)
+    if entry is not None:
+        _close(entry)
+
+async def close_all():
+    with _lock:
+        entries = list(_registry.values())
+        _registry.clear()
+    for entry in entries:
+        entry.sync_client.close()
+        await entry.async_client.close()
@@ -1,8 +1,25 @@
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth_router, users_router, rfps_router, vendors_router, bom_router, propostas_router, escopo_servico_router, proposta_tecnica_router, ai_config_router, ai_providers_router
+from routers import auth_router, users_router, rfps_router, vendors_router, bom_router, propostas_router, escopo_servico_router, proposta_tecnica_router, ai_config_router, ai_providers_router, analysis_jobs_router, profiles_router, search_router, catalog_router
+from analysis_jobs import dispatcher as analysis_dispatcher
+from llm_clients import close_all as close_llm_clients
+from cache import listener as cache_listener
+from proposal_export import shutdown_pool as shutdown_export_pool
+from database import engine, async_engine
+from metrics import MetricsMiddleware, register_pool_collector, render_metrics, METRICS_TOKEN
+from profiling import ProfilingMiddleware, track_routes
+from auth import get_db
+from models import RFPFile
+from downloads import file_response
+from usage import BudgetExceeded
+from ratelimit import RateLimitTimeout, retry_after
+import openai
+from sqlalchemy.orm import Session
+import anyio
+import os
+import hmac
 
-from fastapi.staticfiles import StaticFiles
 import logging
 
 # Configurar logger
@@ -12,8 +29,32 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(me
 app = FastAPI()
 
 
-# Serve arquivos enviados
-app.mount("/uploaded_rfps", StaticFiles(directory="uploaded_rfps", html=False), name="uploaded_rfps")
+# Serve arquivos enviados (com ETag do conteúdo, 304 condicional e Range)
+UPLOADED_RFPS_DIR = "uploaded_rfps"
+
+@app.get("/uploaded_rfps/{name}", include_in_schema=False)
+def serve_uploaded_rfp(name: str, request: Request, db: Session = Depends(get_db)):
+    path = os.path.join(UPLOADED_RFPS_DIR, name)
+    if name != os.path.basename(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not Found")
+    content_hash = db.query(RFPFile.content_hash).filter(RFPFile.filepath == path).limit(1).scalar()
+    return file_response(request, path, name, content_hash, disposition="inline")
+
+# Cota de uso de IA do usuário/RFP excedida (ver usage.py)
+@app.exception_handler(BudgetExceeded)
+async def budget_exceeded_handler(request: Request, exc: BudgetExceeded):
+    return JSONResponse(status_code=429, content={"detail": str(exc)})
+
+# Provedor de IA saturado: fila do limite de taxa estourou ou 429 persistiu após as retentativas
+@app.exception_handler(RateLimitTimeout)
+async def rate_limit_timeout_handler(request: Request, exc: RateLimitTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(int(exc.retry_after) + 1)})
+
+@app.exception_handler(openai.RateLimitError)
+async def provider_rate_limit_handler(request: Request, exc: openai.RateLimitError):
+    delay = retry_after(exc)
+    headers = {"Retry-After": str(int(delay) + 1)} if delay is not None else None
+    return JSONResponse(status_code=503, content={"detail": "Provedor de IA sobrecarregado; tente novamente em instantes"}, headers=headers)
 
 # Configuração do CORS
 origins = [
@@ -33,6 +74,19 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Métricas Prometheus: latência por rota, requisições em andamento, SQL e LLM por requisição
+app.add_middleware(MetricsMiddleware)
+# Profiling por amostragem sob demanda (header X-Profile de admin ou PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+register_pool_collector({"sync": engine, "async": async_engine.sync_engine})
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 
 # Middleware para logar origem e rota
 @app.middleware("http")
@@ -53,6 +107,49 @@ app.include_router(escopo_servico_router.router)
 app.include_router(proposta_tecnica_router.router)
 app.include_router(ai_config_router.router)
 app.include_router(ai_providers_router.router)
+app.include_router(analysis_jobs_router.router)
+app.include_router(profiles_router.router)
+app.include_router(search_router.router)
+app.include_router(catalog_router.router)
+# Handlers/dependências síncronos registram a thread do threadpool no profile da requisição
+track_routes(app)
+
+# Handlers síncronos rodam no threadpool do anyio (padrão: 40 threads)
+THREADPOOL_SIZE = int(os.getenv('THREADPOOL_SIZE', '40'))
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+# Fila de análises: retoma jobs pendentes ao subir e encerra os workers ao desligar
+@app.on_event("startup")
+def start_analysis_workers():
+    analysis_dispatcher.start()
+
+# Recebe invalidações de cache feitas pelos demais workers (LISTEN/NOTIFY)
+@app.on_event("startup")
+def start_cache_listener():
+    cache_listener.start()
+
+@app.on_event("shutdown")
+def stop_cache_listener():
+    cache_listener.stop()
+
+@app.on_event("shutdown")
+def stop_analysis_workers():
+    analysis_dispatcher.stop()
+
+@app.on_event("shutdown")
+def stop_export_workers():
+    shutdown_export_pool()
+
+@app.on_event("shutdown")
+async def close_shared_llm_clients():
+    await close_llm_clients()
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import contextvars
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# Com vários workers (uvicorn/gunicorn) defina PROMETHEUS_MULTIPROC_DIR: cada processo grava
+# suas métricas nesse diretório e /metrics agrega todos
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+# Se definido, /metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP (até o fim do corpo da resposta)",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requisições HTTP em andamento", ["method"], multiprocess_mode="livesum",
+)
+HTTP_DB_TIME = Histogram(
+    "http_request_db_seconds", "Tempo em comandos SQL por requisição", ["route"], buckets=LATENCY_BUCKETS,
+)
+HTTP_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "Comandos SQL executados por requisição", ["route"], buckets=STATEMENT_BUCKETS,
+)
+# Soma das chamadas: com chamadas em paralelo pode passar da duração da requisição
+HTTP_LLM_TIME = Histogram(
+    "http_request_llm_seconds", "Tempo aguardando provedores LLM por requisição", ["route"], buckets=LLM_BUCKETS,
+)
+DB_STATEMENTS = Counter("db_statements_total", "Comandos SQL executados", ["engine"])
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Espera para obter uma conexão do pool (inclui abrir conexão nova)",
+    ["engine"], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "Duração das chamadas aos provedores LLM",
+    ["provider", "model", "operation", "status"], buckets=LLM_BUCKETS,
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens consumidos nos provedores LLM", ["provider", "model", "kind"])
+LLM_FAILOVERS = Counter(
+    "llm_failovers_total", "Chamadas repassadas a outro provedor após falha", ["operation", "from_provider", "to_provider"],
+)
+LLM_HEDGES = Counter(
+    "llm_hedges_total", "Chamadas duplicadas em outro provedor (hedging), por quem respondeu primeiro", ["operation", "winner"],
+)
+LLM_RATE_QUEUE = Gauge(
+    "llm_rate_limit_queue_depth", "Chamadas aguardando saldo no limite de taxa do provedor", ["provider"], multiprocess_mode="livesum",
+)
+LLM_RATE_WAIT = Histogram(
+    "llm_rate_limit_wait_seconds", "Espera na fila do limite de taxa antes de chamar o provedor", ["provider"], buckets=LLM_BUCKETS,
+)
+LLM_RATE_RETRIES = Counter(
+    "llm_rate_limit_retries_total", "Chamadas repetidas após 429/5xx/falha de conexão", ["provider", "reason"],
+)
+EXTRACTION_TIME = Histogram(
+    "extraction_duration_seconds", "Extração de texto por arquivo (inclui espera no pool de processos)",
+    ["ext", "outcome"], buckets=LATENCY_BUCKETS,
+)
+
+# --- Contadores da requisição atual ---
+
+class RequestStats:
+    __slots__ = ("db_statements", "db_seconds", "llm_seconds")
+
+    def __init__(self):
+        self.db_statements = 0
+        self.db_seconds = 0.0
+        self.llm_seconds = 0.0
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+def current_request_stats():
+    return _request_stats.get()
+
+def observe_llm(provider: str, model: str, operation: str, status: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0):
+    LLM_LATENCY.labels(provider, model, operation or "", status).observe(seconds)
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, model, "completion").inc(completion_tokens)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.llm_seconds += seconds
+
+def observe_extraction(ext: str, outcome: str, seconds: float):
+    EXTRACTION_TIME.labels(ext or "", outcome).observe(seconds)
+
+# --- SQL ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_STATEMENTS.labels("async" if conn.dialect.is_async else "sync").inc()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_statements += 1
+        stats.db_seconds += elapsed
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection is not None else None
+    if starts:
+        starts.pop()
+
+# Pools que medem a espera por uma conexão (usados em database.py)
+class TimedQueuePool(QueuePool):
+    engine_label = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(self.engine_label).observe(time.perf_counter() - started)
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(self.engine_label).observe(time.perf_counter() - started)
+
+# Ocupação dos pools, lida na hora da coleta
+class PoolCollector:
+    def __init__(self, engines: dict):
+        self.engines = engines
+
+    def collect(self):
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Conexões em uso no pool", labels=["engine"])
+        size = GaugeMetricFamily("db_pool_size", "Conexões mantidas pelo pool", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Conexões acima de pool_size", labels=["engine"])
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            checked_out.add_metric([name], pool.checkedout())
+            size.add_metric([name], pool.size())
+            overflow.add_metric([name], max(0, pool.overflow()))
+        yield checked_out
+        yield size
+        yield overflow
+
+def register_pool_collector(engines: dict):
+    # Em modo multiprocesso só valem métricas gravadas em arquivo
+    if not PROMETHEUS_MULTIPROC_DIR:
+        REGISTRY.register(PoolCollector(engines))
+
+# --- Middleware ASGI ---
+
+# Mede cada requisição HTTP; a rota é o template do path (ex.: /rfps/{rfp_id}), resolvido pelo router
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status = 500
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        in_progress = HTTP_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            if path != "/metrics":
+                HTTP_LATENCY.labels(method, path, str(status)).observe(elapsed)
+                HTTP_DB_TIME.labels(path).observe(stats.db_seconds)
+                HTTP_DB_STATEMENTS.labels(path).observe(stats.db_statements)
+                HTTP_LLM_TIME.labels(path).observe(stats.llm_seconds)
+
+def render_metrics() -> tuple:
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
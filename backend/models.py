@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, JSON
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Boolean, ForeignKey, DateTime, Text, JSON, Index, UniqueConstraint, text
+from sqlalchemy.orm import relationship, declarative_base, deferred
+from sqlalchemy.schema import FetchedValue
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy import func
 import datetime
 
 Base = declarative_base()
 
+# Vetor de busca textual (português) mantido por trigger no banco; carregado só se acessado
+def search_vector_column():
+    return deferred(Column(TSVECTOR, server_default=FetchedValue(), server_onupdate=FetchedValue()))
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True, index=True)
@@ -41,6 +47,14 @@ class RFP(Base):
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     propostas = relationship('Proposta', back_populates='rfp')
     files = relationship('RFPFile', back_populates='rfp', cascade='all, delete-orphan')
+    search_vector = search_vector_column()  # nome (A) e resumo_ia (B)
+    # Paginação por cursor (updated_at, id) na listagem, com ou sem filtro de dono/status
+    __table_args__ = (
+        Index('ix_rfps_updated_at_id', 'updated_at', 'id'),
+        Index('ix_rfps_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+        Index('ix_rfps_status_updated_at_id', 'status', 'updated_at', 'id'),
+        Index('ix_rfps_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
 class BoMItem(Base):
     __tablename__ = 'bom_items'
@@ -58,8 +72,12 @@ class Proposta(Base):
     dados_json = Column(JSON, nullable=True)
     arquivo_pdf = Column(String(255), nullable=True)
     arquivo_docx = Column(String(255), nullable=True)
+    # Por seção de dados_json: hash das entradas usadas na geração e quando foi gerada
+    secoes_meta = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    search_vector = search_vector_column()  # valores string de dados_json (C)
     rfp = relationship('RFP', back_populates='propostas')
+    __table_args__ = (Index('ix_propostas_search_vector', 'search_vector', postgresql_using='gin'),)
 
 class EscopoServico(Base):
     __tablename__ = 'escopo_servico'
@@ -69,6 +87,8 @@ class EscopoServico(Base):
     descricao = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    search_vector = search_vector_column()  # titulo (A) e descricao (B)
+    __table_args__ = (Index('ix_escopo_servico_search_vector', 'search_vector', postgresql_using='gin'),)
 
 class RFPFile(Base):
     __tablename__ = 'rfp_files'
@@ -76,10 +96,154 @@ class RFPFile(Base):
     rfp_id = Column(Integer, ForeignKey('rfps.id', ondelete='CASCADE'))
     filename = Column(String(255), nullable=False)
     filepath = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 do conteúdo
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     rfp = relationship('RFP', back_populates='files')
 
+class FileUpload(Base):
+    __tablename__ = 'file_uploads'
+    # Upload em partes (retomável) de um arquivo de RFP; vira um RFPFile no commit
+    id = Column(String(32), primary_key=True)
+    rfp_id = Column(Integer, ForeignKey('rfps.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    filename = Column(String(255), nullable=False)
+    filepath = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, default=0)  # último offset confirmado
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class Blob(Base):
+    __tablename__ = 'blobs'
+    # Conteúdo de arquivo armazenado uma única vez (endereçado pelo SHA-256), com contagem de referências
+    content_hash = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ExtractedText(Base):
+    __tablename__ = 'extracted_texts'
+    # Texto extraído de um arquivo, compartilhado por todos os RFPFile com o mesmo conteúdo
+    content_hash = Column(String(64), primary_key=True)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    search_vector = search_vector_column()  # texto (D), limitado ao 1º milhão de caracteres
+    __table_args__ = (Index('ix_extracted_texts_search_vector', 'search_vector', postgresql_using='gin'),)
+
+class AnalysisChunk(Base):
+    __tablename__ = 'analysis_chunks'
+    # Resumo parcial (etapa "map") de um trecho de arquivo; reaproveitado entre análises
+    id = Column(Integer, primary_key=True, index=True)
+    chunk_hash = Column(String(64), nullable=False)
+    model = Column(String(100), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # arquivo de origem
+    label = Column(String(255), nullable=True)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    __table_args__ = (UniqueConstraint('chunk_hash', 'model', name='uq_analysis_chunks_hash_model'),)
+
+class VendorEmbedding(Base):
+    __tablename__ = 'vendor_embeddings'
+    # Embedding do perfil do vendor (tecnologias, produtos, certificações, requisitos) para o pré-filtro do matching
+    vendor_id = Column(Integer, ForeignKey('vendors.id', ondelete='CASCADE'), primary_key=True)
+    model = Column(String(100), nullable=False)
+    profile_hash = Column(String(64), nullable=False)  # SHA-256 do texto do perfil embutido
+    vector = Column(JSON, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CatalogItem(Base):
+    __tablename__ = 'vendor_catalog_items'
+    # Lista de preços/SKUs do fabricante, importada de CSV/XLSX; valida e completa os itens de BoM
+    id = Column(BigInteger, primary_key=True)
+    vendor_id = Column(Integer, ForeignKey('vendors.id', ondelete='CASCADE'), nullable=False)
+    part_number = Column(String(100), nullable=False)
+    part_number_norm = Column(String(100, collation='C'), nullable=False)  # só letras maiúsculas e dígitos
+    descricao = Column(Text, nullable=True)
+    modelo = Column(String(255), nullable=True)
+    preco = Column(Float, nullable=True)
+    moeda = Column(String(3), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Prefixo via btree (collation C: ordem por bytes); aproximação via GiST de trigramas (pg_trgm),
+    # com o vendor na mesma chave (btree_gist) para a busca por vizinhos mais próximos já filtrada
+    __table_args__ = (
+        UniqueConstraint('vendor_id', 'part_number', name='uq_vendor_catalog_items_vendor_pn'),
+        Index('ix_vendor_catalog_items_pn_norm', 'part_number_norm'),
+        Index('ix_vendor_catalog_items_vendor_pn_norm', 'vendor_id', 'part_number_norm'),
+        Index('ix_vendor_catalog_items_pn_norm_trgm', 'vendor_id', 'part_number_norm', postgresql_using='gist', postgresql_ops={'part_number_norm': 'gist_trgm_ops'}),
+        Index('ix_vendor_catalog_items_descricao_trgm', 'vendor_id', 'descricao', postgresql_using='gist', postgresql_ops={'descricao': 'gist_trgm_ops'}),
+    )
+
+class LLMResponse(Base):
+    __tablename__ = 'llm_responses'
+    # Cache de respostas das LLMs, por hash de (provedor, modelo, temperatura, max_tokens, mensagens normalizadas)
+    cache_key = Column(String(64), primary_key=True)
+    provider = Column(String(100), nullable=False)
+    model = Column(String(100), nullable=False)
+    temperature = Column(Float, nullable=False)
+    status = Column(String(10), nullable=False, default='ready')  # 'pending' enquanto um worker gera a resposta
+    content = Column(Text, nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_hit_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+
+class LLMUsage(Base):
+    __tablename__ = 'llm_usage'
+    # Ledger de uso das LLMs: uma linha por completion (inclusive acertos do cache, com cached=True e sem tokens)
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    operation = Column(String(50), nullable=True)
+    provider_id = Column(Integer, ForeignKey('ai_providers.id', ondelete='SET NULL'), nullable=True)
+    provider = Column(String(100), nullable=False)
+    model = Column(String(100), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    rfp_id = Column(Integer, ForeignKey('rfps.id', ondelete='SET NULL'), nullable=True)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    max_tokens = Column(Integer, nullable=True)
+    cost = Column(Float, nullable=True)  # USD, pelos preços de LLM_PRICES
+    latency_ms = Column(Integer, nullable=False, default=0)
+    status = Column(String(10), nullable=False, default='ok')  # 'ok' ou 'error'
+    finish_reason = Column(String(20), nullable=True)  # 'length' = cortada por max_tokens
+    cached = Column(Boolean, nullable=False, default=False)
+    __table_args__ = (
+        Index('ix_llm_usage_created_at', 'created_at'),
+        Index('ix_llm_usage_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_llm_usage_rfp_id_created_at', 'rfp_id', 'created_at'),
+        Index('ix_llm_usage_operation_created_at', 'operation', 'created_at'),
+    )
+
+class LLMBudget(Base):
+    __tablename__ = 'llm_budgets'
+    # Cota de uso por usuário ou RFP; scope_id nulo = cota padrão para todos do escopo
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(10), nullable=False)  # 'user' ou 'rfp'
+    scope_id = Column(Integer, nullable=True)
+    period = Column(String(10), nullable=False)  # 'day', 'month' ou 'total'
+    max_tokens = Column(BigInteger, nullable=True)
+    max_cost = Column(Float, nullable=True)
+    action = Column(String(10), nullable=False, default='reject')  # 'reject' ou 'downgrade'
+    downgrade_model = Column(String(100), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    __table_args__ = (UniqueConstraint('scope', 'scope_id', 'period', name='uq_llm_budgets_scope_period'),)
+
+class LLMRoutingPolicy(Base):
+    __tablename__ = 'llm_routing_policies'
+    # Roteamento entre provedores por operação (prefixo da operação do ledger, ex.: 'analise', 'bom_ia'; 'default' vale para as demais)
+    id = Column(Integer, primary_key=True, index=True)
+    operation = Column(String(50), nullable=False, unique=True)
+    provider_ids = Column(JSON, nullable=True)  # ordem de preferência; nulo = selecionado e depois os demais
+    failover = Column(Boolean, nullable=False, default=True)
+    hedge = Column(Boolean, nullable=False, default=False)
+    hedge_delay_ms = Column(Integer, nullable=True)  # nulo = p95 da latência do 1º provedor
+    max_attempts = Column(Integer, nullable=False, default=3)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
 class AIProvider(Base):
     __tablename__ = 'ai_providers'
     id = Column(Integer, primary_key=True, index=True)
@@ -87,9 +251,21 @@ class AIProvider(Base):
     model = Column(String(100), nullable=False)
     api_key = Column(String(255), nullable=False)
     is_selected = Column(Boolean, default=False)
+    # Limites da conta no provedor (por minuto, compartilhados por provedores com a mesma chave); nulo = sem limite
+    rpm_limit = Column(Integer, nullable=True)
+    tpm_limit = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class LLMRateBucket(Base):
+    __tablename__ = 'llm_rate_buckets'
+    # Token bucket por chave de API (hash), compartilhado pelos workers (ratelimit.py)
+    key = Column(String(64), primary_key=True)
+    requests = Column(Float, nullable=False, default=0)
+    tokens = Column(Float, nullable=False, default=0)
+    refilled_at = Column(DateTime(timezone=True), nullable=False)
+    blocked_until = Column(DateTime(timezone=True), nullable=True)  # Retry-After recebido do provedor
+
 class AIConfig(Base):
     __tablename__ = 'ai_config'
     id = Column(Integer, primary_key=True, index=True)
@@ -97,3 +273,29 @@ class AIConfig(Base):
     model = Column(String(100), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AnalysisJob(Base):
+    __tablename__ = 'analysis_jobs'
+    id = Column(Integer, primary_key=True, index=True)
+    rfp_id = Column(Integer, ForeignKey('rfps.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    provider_id = Column(Integer, ForeignKey('ai_providers.id'), nullable=True)
+    cache_mode = Column(String(10), nullable=False, default='use')  # use, refresh, bypass (cache de LLM)
+    status = Column(String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    progress = Column(Integer, nullable=False, default=0)
+    stage = Column(String(255), nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    rfp = relationship('RFP')
+
+    # Apenas um job ativo por RFP: pedidos duplicados reaproveitam o job em andamento
+    __table_args__ = (
+        Index('ix_analysis_jobs_status_created_at', 'status', 'created_at'),
+        Index('uq_analysis_jobs_rfp_active', 'rfp_id', unique=True,
+              postgresql_where=text("status IN ('pending', 'running')")),
+    )
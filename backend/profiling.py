@@ -0,0 +1,343 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import datetime
+import threading
+import inspect
+import functools
+import contextvars
+import anyio
+import anyio.to_thread
+from fastapi.routing import APIRoute
+from fastapi.dependencies.utils import is_coroutine_callable
+from auth import user_from_authorization
+from storage import STORAGE_LOCAL_ROOT
+
+logger = logging.getLogger(__name__)
+
+# Profiling por amostragem, opcional por requisição: header X-Profile (só admin) ou uma
+# fração das requisições (PROFILE_SAMPLE_RATE). Requisições não perfiladas não são afetadas.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', f"{STORAGE_LOCAL_ROOT}/profiles")
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_HEADER = b"x-profile"
+
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+_STDLIB_DIR = os.path.dirname(os.__file__)
+
+class Profile:
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.datetime.utcnow()
+        self.started = time.monotonic()
+        self.route = None
+        self.status = None
+        self.duration_ms = None
+        self._lock = threading.Lock()
+        self._threads = {}  # ident -> [nome, entradas ativas]
+        self._frames = {}  # (arquivo, função, linha) -> índice
+        self._counts = {}  # (nome da thread, pilha de índices) -> amostras
+        self.samples = 0
+
+    # Threads que executam código da requisição (threadpool do anyio, pools com bind_scope)
+    def enter(self, ident: int, name: str):
+        with self._lock:
+            entry = self._threads.setdefault(ident, [name, 0])
+            entry[1] += 1
+
+    def leave(self, ident: int):
+        with self._lock:
+            entry = self._threads.get(ident)
+            if entry:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._threads[ident]
+
+    def sample(self, frames: dict):
+        if time.monotonic() - self.started > PROFILE_MAX_SECONDS:
+            return
+        with self._lock:
+            for ident, (name, _) in self._threads.items():
+                self._sample_thread(name, frames.get(ident))
+
+    def _sample_thread(self, name: str, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_name, code.co_firstlineno)
+            index = self._frames.get(key)
+            if index is None:
+                index = self._frames[key] = len(self._frames)
+            stack.append(index)
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            key = (name, tuple(stack))
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.samples += 1
+
+    def meta(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "samples": self.samples,
+        }
+
+    def data(self) -> dict:
+        with self._lock:
+            frames = [None] * len(self._frames)
+            for (filename, name, line), index in self._frames.items():
+                frames[index] = [_short_path(filename), name, line]
+            threads = {}
+            for (thread, stack), count in self._counts.items():
+                threads.setdefault(thread, []).append([list(stack), count])
+        return {"frames": frames, "threads": threads}
+
+def _short_path(filename: str) -> str:
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    if filename.startswith(_BACKEND_DIR + os.sep):
+        return os.path.relpath(filename, _BACKEND_DIR)
+    if filename.startswith(_STDLIB_DIR + os.sep):
+        return os.path.relpath(filename, _STDLIB_DIR)
+    return filename
+
+# Uma única thread amostra as pilhas de todas as requisições perfiladas (sys._current_frames);
+# só existe enquanto houver alguma
+class _Sampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = set()
+        self._thread = None
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(interval)
+
+_sampler = _Sampler()
+_current = contextvars.ContextVar("profile", default=None)
+
+# Executa fn registrando a thread atual no profile da requisição (se houver)
+def run_tracked(fn, *args, **kwargs):
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    ident = threading.get_ident()
+    profile.enter(ident, threading.current_thread().name)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.leave(ident)
+
+# Igual ao run_in_threadpool do Starlette, com a thread registrada no profile da requisição;
+# usado nas chamadas ao threadpool feitas pelo próprio código dos handlers async
+async def run_in_threadpool(func, *args, **kwargs):
+    return await anyio.to_thread.run_sync(functools.partial(run_tracked, func, *args, **kwargs))
+
+# Handlers síncronos rodam no threadpool do anyio: troca o endpoint de cada rota já incluída
+# no app por um que registra a thread no profile da requisição (se houver). Dependências ficam
+# como estão (são leves e dependency_overrides procura pela função original)
+def track_routes(app):
+    for route in app.routes:
+        call = getattr(route, "dependant", None) and route.dependant.call
+        if isinstance(route, APIRoute) and inspect.isfunction(call) and not is_coroutine_callable(call):
+            route.dependant.call = _tracked(call)
+
+def _tracked(call):
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        return run_tracked(call, *args, **kwargs)
+    return wrapper
+
+# --- Armazenamento: <id>.jsonl com os metadados na 1ª linha e as amostras na 2ª ---
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.jsonl")
+
+def save_profile(profile: Profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = _profile_path(profile.id)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(profile.meta(), ensure_ascii=False) + "\n")
+        f.write(json.dumps(profile.data(), ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+    _prune_profiles()
+
+def _prune_profiles():
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith(".jsonl"):
+            try:
+                entries.append((os.stat(os.path.join(PROFILE_DIR, name)).st_mtime, name))
+            except FileNotFoundError:
+                continue
+    for _, name in sorted(entries)[:max(0, len(entries) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+def list_profiles() -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    result = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".jsonl"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                result.append(json.loads(f.readline()))
+        except (FileNotFoundError, ValueError):
+            continue
+    return sorted(result, key=lambda meta: meta["started_at"], reverse=True)
+
+def load_profile(profile_id: str):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(_profile_path(profile_id), encoding="utf-8") as f:
+            meta = json.loads(f.readline())
+            data = json.loads(f.readline())
+    except FileNotFoundError:
+        return None
+    return meta, data
+
+def delete_profile(profile_id: str) -> bool:
+    if not PROFILE_ID_RE.match(profile_id):
+        return False
+    try:
+        os.remove(_profile_path(profile_id))
+        return True
+    except FileNotFoundError:
+        return False
+
+def _frame_name(frame: list) -> str:
+    filename, name, line = frame
+    return f"{name} ({filename}:{line})"
+
+# Formato "collapsed" (flamegraph.pl, speedscope, inferno): uma linha por pilha com o nº de amostras
+def to_collapsed(data: dict) -> str:
+    names = [_frame_name(frame).replace(";", ",") for frame in data["frames"]]
+    lines = []
+    for thread, stacks in data["threads"].items():
+        for stack, count in stacks:
+            lines.append(";".join([thread.replace(";", ",")] + [names[i] for i in stack]) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+# Arquivo do speedscope (https://www.speedscope.app): um profile "sampled" por thread
+def to_speedscope(meta: dict, data: dict) -> dict:
+    interval = meta["interval_ms"]
+    profiles = []
+    for thread, stacks in data["threads"].items():
+        weights = [count * interval for _, count in stacks]
+        profiles.append({
+            "type": "sampled",
+            "name": thread,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": [stack for stack, _ in stacks],
+            "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{meta['method']} {meta['path']} ({meta['started_at']})",
+        "exporter": "rfp-backend",
+        "activeProfileIndex": 0,
+        "shared": {"frames": [{"name": _frame_name(frame), "file": frame[0], "line": frame[2]} for frame in data["frames"]]},
+        "profiles": profiles,
+    }
+
+# --- Middleware ASGI ---
+
+def _header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trigger = None
+        if _header(scope, PROFILE_HEADER) is not None:
+            user = await user_from_authorization(_header(scope, b"authorization"))
+            if user is not None and user.perfil == "admin":
+                trigger = "header"
+        if trigger is None and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        if trigger is None:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["method"], scope["path"], trigger)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if trigger == "header":
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = _current.set(profile)
+        loop_thread = threading.get_ident()
+        # A thread do event loop é compartilhada: em handlers async ela inclui outras requisições
+        profile.enter(loop_thread, "event-loop")
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _sampler.remove(profile)
+            profile.leave(loop_thread)
+            _current.reset(token)
+            profile.duration_ms = int((time.monotonic() - profile.started) * 1000)
+            profile.route = getattr(scope.get("route"), "path", None)
+            try:
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(save_profile, profile)
+            except Exception:
+                logger.warning("Falha ao salvar o profile %s", profile.id, exc_info=True)
@@ -0,0 +1,155 @@
+import os
+import html
+import zipfile
+import logging
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from docx_render import render_docx, render_key, cached_render
+
+logger = logging.getLogger(__name__)
+
+# Processos que renderizam as propostas do export em lote (o template fica compilado em cada um)
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+EXPORT_MAX_RFPS = int(os.getenv('EXPORT_MAX_RFPS', '500'))
+EXPORT_READ_CHUNK = 1024 * 1024
+# Versão do layout HTML do PDF: mudar invalida os PDFs em cache
+PDF_LAYOUT_VERSION = "pdf-v1"
+
+PDF_CSS = """
+@page { size: A4; margin: 2cm; @bottom-right { content: counter(page) "/" counter(pages); font-size: 9pt; } }
+body { font-family: sans-serif; font-size: 11pt; line-height: 1.4; }
+h1 { font-size: 18pt; margin-bottom: 1.5em; }
+h2 { font-size: 13pt; margin-top: 1.5em; border-bottom: 1px solid #999; }
+"""
+
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def pdf_available() -> bool:
+    return importlib.util.find_spec("weasyprint") is not None
+
+# --- Funções executadas nos processos do pool ---
+
+def _paragraphs(body: str) -> str:
+    parts = []
+    for block in (body or "").split("\n\n"):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        if not lines:
+            continue
+        if all(line.startswith(("- ", "* ")) for line in lines):
+            items = "".join(f"<li>{html.escape(line[2:])}</li>" for line in lines)
+            parts.append(f"<ul>{items}</ul>")
+        else:
+            parts.append(f"<p>{'<br>'.join(html.escape(line) for line in lines)}</p>")
+    return "".join(parts)
+
+def proposta_html(dados: dict, title: str) -> str:
+    sections = "".join(f"<h2>{html.escape(str(heading))}</h2>{_paragraphs(str(body))}" for heading, body in dados.items())
+    return f"<html><head><meta charset='utf-8'><style>{PDF_CSS}</style></head><body><h1>{html.escape(title)}</h1>{sections}</body></html>"
+
+def render_pdf(dados: dict, title: str) -> str:
+    from weasyprint import HTML
+    key = render_key({"title": title, "dados": dados}, PDF_LAYOUT_VERSION)
+    return cached_render(key, ".pdf", lambda tmp: HTML(string=proposta_html(dados, title)).write_pdf(tmp))
+
+def _task_render(dados: dict, title: str, fmt: str) -> str:
+    if fmt == "pdf":
+        return render_pdf(dados, title)
+    return render_docx(dados)[0]
+
+# --- Pool ---
+
+_pool_lock = threading.Lock()
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context(_START_METHOD)
+            if _START_METHOD == "forkserver":
+                ctx.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=ctx)
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# --- ZIP em streaming ---
+
+# Destino não-seekable do ZipFile: o zipfile usa data descriptors e o que for escrito
+# é entregue ao cliente a cada bloco, sem montar o arquivo inteiro em memória
+class _ZipSink:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _zip_file(zf: zipfile.ZipFile, sink: _ZipSink, path: str, arcname: str):
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    # DOCX e PDF já são comprimidos
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb") as src, zf.open(info, "w") as dest:
+        for chunk in iter(lambda: src.read(EXPORT_READ_CHUNK), b""):
+            dest.write(chunk)
+            yield sink.drain()
+    data = sink.drain()
+    if data:
+        yield data
+
+# Gera o ZIP com as propostas na ordem em que terminam de renderizar.
+# items: [(rfp_id, título, dados_json)]; formats: ("docx",), ("pdf",) ou ambos.
+# Falhas não interrompem o export: são listadas em ERROS.txt no fim do arquivo.
+def stream_proposals_zip(items: list, formats: tuple):
+    pool = _get_pool()
+    futures = {}
+    errors = []
+    try:
+        for rfp_id, title, dados in items:
+            for fmt in formats:
+                futures[pool.submit(_task_render, dados, title, fmt)] = (rfp_id, fmt)
+        sink = _ZipSink()
+        with zipfile.ZipFile(sink, mode="w") as zf:
+            for fut in as_completed(futures):
+                rfp_id, fmt = futures[fut]
+                try:
+                    path = fut.result()
+                except BrokenProcessPool:
+                    _discard_pool(pool)
+                    errors.append(f"RFP {rfp_id} ({fmt}): processo de renderização encerrado")
+                    continue
+                except Exception as e:
+                    logger.warning("Falha ao renderizar a proposta da RFP %s (%s)", rfp_id, fmt, exc_info=True)
+                    errors.append(f"RFP {rfp_id} ({fmt}): {e}")
+                    continue
+                yield from _zip_file(zf, sink, path, f"proposta_tecnica_rfp_{rfp_id}.{fmt}")
+            if errors:
+                zf.writestr("ERROS.txt", "\n".join(errors) + "\n")
+        yield sink.drain()
+    finally:
+        # Cliente desconectou ou erro: descarta o que ainda não começou a renderizar
+        for fut in futures:
+            fut.cancel()
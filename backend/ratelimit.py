@@ -0,0 +1,306 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import datetime
+import threading
+import email.utils
+import anyio
+import openai
+from types import SimpleNamespace
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import SessionLocal
+from models import AIProvider, LLMRateBucket
+from metrics import LLM_RATE_QUEUE, LLM_RATE_WAIT, LLM_RATE_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Limites de taxa (rpm_limit/tpm_limit do AIProvider) aplicados antes de cada chamada ao provedor.
+# 'postgres': buckets na tabela llm_rate_buckets, compartilhados por todos os workers;
+# 'local': só neste processo (também usado se o banco falhar)
+LLM_RATE_BACKEND = os.getenv('LLM_RATE_BACKEND', 'postgres')
+# Espera máxima na fila; acima disso a chamada falha com RateLimitTimeout (503 + Retry-After)
+LLM_RATE_MAX_WAIT = float(os.getenv('LLM_RATE_MAX_WAIT', '120'))
+# Retentativas em 429/5xx/timeout (o cliente openai é criado sem retentativas próprias)
+LLM_RATE_MAX_RETRIES = int(os.getenv('LLM_RATE_MAX_RETRIES', '3'))
+LLM_RATE_BACKOFF_BASE = float(os.getenv('LLM_RATE_BACKOFF_BASE', '1'))
+LLM_RATE_BACKOFF_MAX = float(os.getenv('LLM_RATE_BACKOFF_MAX', '30'))
+# Provedor sem rpm/tpm não passa pelo bucket: só o Retry-After compartilhado vale, relido a cada N segundos
+LLM_RATE_BLOCK_CHECK = float(os.getenv('LLM_RATE_BLOCK_CHECK', '5'))
+
+# Mesma estimativa conservadora de chunked_analysis (português sem tiktoken)
+CHARS_PER_TOKEN = 3
+RETRY_STATUS = (408, 409, 429)
+# Quem espera acorda um pouco depois, espalhado, para não disputar o bucket todos ao mesmo tempo
+QUEUE_JITTER = 0.2
+QUEUE_MIN_SLEEP = 0.05
+
+class RateLimitTimeout(Exception):
+    def __init__(self, provider: AIProvider, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Limite de uso do provedor {provider.name} atingido; tente novamente em {int(retry_after) + 1}s")
+
+# Limites são da conta: provedores com a mesma chave de API dividem o bucket
+def bucket_key(provider: AIProvider) -> str:
+    return hashlib.sha256(provider.api_key.encode("utf-8")).hexdigest()
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return chars // CHARS_PER_TOKEN + 1 + (max_tokens or 0)
+
+# Repõe o bucket pelo tempo decorrido e, havendo saldo, consome 1 requisição e os tokens.
+# Retorna 0 (liberado) ou quantos segundos esperar
+def take(bucket, rpm: int, tpm: int, tokens: int, now: datetime.datetime) -> float:
+    elapsed = max(0.0, (now - bucket.refilled_at).total_seconds())
+    bucket.refilled_at = now
+    if rpm:
+        bucket.requests = min(rpm, bucket.requests + elapsed * rpm / 60)
+    if tpm:
+        bucket.tokens = min(tpm, bucket.tokens + elapsed * tpm / 60)
+    wait = 0.0
+    if bucket.blocked_until is not None and bucket.blocked_until > now:
+        wait = (bucket.blocked_until - now).total_seconds()
+    if rpm and bucket.requests < 1:
+        wait = max(wait, (1 - bucket.requests) * 60 / rpm)
+    # Chamada maior que o limite por minuto espera o bucket cheio (senão nunca passaria)
+    need = min(tokens, tpm) if tpm else 0
+    if tpm and bucket.tokens < need:
+        wait = max(wait, (need - bucket.tokens) * 60 / tpm)
+    if wait > 0:
+        return wait
+    if rpm:
+        bucket.requests -= 1
+    if tpm:
+        bucket.tokens -= tokens
+    return 0.0
+
+class LocalBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, key: str, rpm: int, tpm: int, now: datetime.datetime):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = SimpleNamespace(requests=rpm or 0, tokens=tpm or 0, refilled_at=now, blocked_until=None)
+        return bucket
+
+    def take(self, key: str, rpm: int, tpm: int, tokens: int) -> float:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            return take(self._bucket(key, rpm, tpm, now), rpm, tpm, tokens, now)
+
+    def settle(self, key: str, tokens: int):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.tokens += tokens
+
+    def block(self, key: str, seconds: float, rpm: int = None, tpm: int = None):
+        until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+        with self._lock:
+            bucket = self._bucket(key, rpm, tpm, until)
+            bucket.blocked_until = max(bucket.blocked_until or until, until)
+
+    def blocked_until(self, key: str):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            return bucket.blocked_until if bucket is not None else None
+
+# Linha por chave, travada (FOR UPDATE) só durante a conta do bucket; relógio do banco
+class PostgresBuckets:
+    def take(self, key: str, rpm: int, tpm: int, tokens: int) -> float:
+        query = select(LLMRateBucket, func.clock_timestamp()).where(LLMRateBucket.key == key).with_for_update(of=LLMRateBucket)
+        with SessionLocal() as db:
+            row = db.execute(query).first()
+            if row is None:
+                db.execute(pg_insert(LLMRateBucket).values(
+                    key=key, requests=rpm or 0, tokens=tpm or 0, refilled_at=func.clock_timestamp(),
+                ).on_conflict_do_nothing())
+                row = db.execute(query).first()
+            bucket, now = row
+            wait = take(bucket, rpm, tpm, tokens, now)
+            db.commit()
+        return wait
+
+    def settle(self, key: str, tokens: int):
+        with SessionLocal() as db:
+            db.execute(update(LLMRateBucket).where(LLMRateBucket.key == key).values(tokens=LLMRateBucket.tokens + tokens))
+            db.commit()
+
+    # Upsert: provedores sem limites só têm linha quando recebem Retry-After
+    def block(self, key: str, seconds: float, rpm: int = None, tpm: int = None):
+        until = func.clock_timestamp() + datetime.timedelta(seconds=seconds)
+        stmt = pg_insert(LLMRateBucket).values(key=key, requests=rpm or 0, tokens=tpm or 0, refilled_at=func.clock_timestamp(), blocked_until=until)
+        with SessionLocal() as db:
+            db.execute(stmt.on_conflict_do_update(index_elements=[LLMRateBucket.key], set_={
+                "blocked_until": func.greatest(func.coalesce(LLMRateBucket.blocked_until, stmt.excluded.blocked_until), stmt.excluded.blocked_until),
+            }))
+            db.commit()
+
+    def blocked_until(self, key: str):
+        with SessionLocal() as db:
+            return db.scalar(select(LLMRateBucket.blocked_until).where(LLMRateBucket.key == key))
+
+_local = LocalBuckets()
+_shared = PostgresBuckets() if LLM_RATE_BACKEND == 'postgres' else _local
+
+def _buckets(method: str, *args):
+    if _shared is not _local:
+        try:
+            return getattr(_shared, method)(*args)
+        except Exception:
+            logger.warning("Falha ao acessar llm_rate_buckets; usando limites locais", exc_info=True)
+    return getattr(_local, method)(*args)
+
+# --- Fila ---
+
+_blocks_lock = threading.Lock()
+_blocks = {}  # chave -> (válido até, em monotonic; blocked_until)
+
+def _cache_block(key: str, until):
+    with _blocks_lock:
+        _blocks[key] = (time.monotonic() + LLM_RATE_BLOCK_CHECK, until)
+
+def _block_wait(key: str) -> float:
+    with _blocks_lock:
+        entry = _blocks.get(key)
+    if entry is None or entry[0] <= time.monotonic():
+        until = _buckets("blocked_until", key)
+        _cache_block(key, until)
+    else:
+        until = entry[1]
+    if until is None:
+        return 0.0
+    return max(0.0, (until - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def _next_sleep(provider: AIProvider, key: str, tokens: int, started: float) -> float:
+    if provider.rpm_limit or provider.tpm_limit:
+        wait = _buckets("take", key, provider.rpm_limit, provider.tpm_limit, tokens)
+    else:
+        wait = _block_wait(key)
+    if wait <= 0:
+        return 0.0
+    if time.monotonic() - started + wait > LLM_RATE_MAX_WAIT:
+        raise RateLimitTimeout(provider, wait)
+    return max(QUEUE_MIN_SLEEP, wait * random.uniform(1, 1 + QUEUE_JITTER))
+
+# Aguarda (em fila) saldo de requisições e tokens no bucket da chave do provedor
+def acquire(provider: AIProvider, tokens: int):
+    key, started, queue = bucket_key(provider), time.monotonic(), None
+    try:
+        while True:
+            sleep = _next_sleep(provider, key, tokens, started)
+            if not sleep:
+                break
+            if queue is None:
+                queue = LLM_RATE_QUEUE.labels(provider.name)
+                queue.inc()
+            time.sleep(sleep)
+    finally:
+        if queue is not None:
+            queue.dec()
+        LLM_RATE_WAIT.labels(provider.name).observe(time.monotonic() - started)
+
+async def acquire_async(provider: AIProvider, tokens: int):
+    key, started, queue = bucket_key(provider), time.monotonic(), None
+    try:
+        while True:
+            sleep = await anyio.to_thread.run_sync(_next_sleep, provider, key, tokens, started)
+            if not sleep:
+                break
+            if queue is None:
+                queue = LLM_RATE_QUEUE.labels(provider.name)
+                queue.inc()
+            await anyio.sleep(sleep)
+    finally:
+        if queue is not None:
+            queue.dec()
+        LLM_RATE_WAIT.labels(provider.name).observe(time.monotonic() - started)
+
+# Devolve ao bucket a diferença entre os tokens reservados e os de fato usados
+def settle(provider: AIProvider, reserved: int, used: int):
+    if provider.tpm_limit and used and reserved != used:
+        _buckets("settle", bucket_key(provider), reserved - used)
+
+# Devolve a reserva inteira de uma tentativa que falhou (o chamador só acerta a que deu certo)
+def refund(provider: AIProvider, reserved: int):
+    if provider.tpm_limit and reserved:
+        _buckets("settle", bucket_key(provider), reserved)
+
+# --- Retentativas ---
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, openai.APIConnectionError):  # inclui timeout
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRY_STATUS or exc.status_code >= 500
+    return False
+
+# Retry-After do provedor em segundos (retry-after-ms, segundos ou data HTTP), se houver
+def retry_after(exc: BaseException):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Backoff exponencial com jitter completo
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(LLM_RATE_BACKOFF_MAX, LLM_RATE_BACKOFF_BASE * 2 ** attempt))
+
+# Quanto esperar antes de repetir; um Retry-After em 429 pausa a chave em todos os workers
+# (a espera acontece na fila, no próximo acquire)
+def _retry_sleep(provider: AIProvider, exc: BaseException, attempt: int) -> float:
+    status = getattr(exc, "status_code", None)
+    LLM_RATE_RETRIES.labels(provider.name, str(status) if status else "conexao").inc()
+    delay = retry_after(exc)
+    if status == 429 and delay:
+        logger.warning("Provedor %s pediu para aguardar %.1fs (429)", provider.name, delay)
+        key = bucket_key(provider)
+        _buckets("block", key, delay, provider.rpm_limit, provider.tpm_limit)
+        _cache_block(key, datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay))
+        return 0.0
+    return delay if delay is not None else backoff(attempt)
+
+# Executa call() respeitando os limites do provedor e repetindo em 429/5xx/timeout;
+# cada tentativa reserva os tokens de novo e a que falha devolve a sua reserva
+def governed(provider: AIProvider, tokens: int, call):
+    attempt = 0
+    while True:
+        acquire(provider, tokens)
+        try:
+            return call()
+        except Exception as e:
+            refund(provider, tokens)
+            if attempt >= LLM_RATE_MAX_RETRIES or not is_retryable(e):
+                raise
+            sleep = _retry_sleep(provider, e, attempt)
+        attempt += 1
+        time.sleep(sleep)
+
+async def governed_async(provider: AIProvider, tokens: int, call):
+    attempt = 0
+    while True:
+        await acquire_async(provider, tokens)
+        try:
+            return await call()
+        except Exception as e:
+            await anyio.to_thread.run_sync(refund, provider, tokens)
+            if attempt >= LLM_RATE_MAX_RETRIES or not is_retryable(e):
+                raise
+            sleep = await anyio.to_thread.run_sync(_retry_sleep, provider, e, attempt)
+        attempt += 1
+        await anyio.sleep(sleep)
@@ -0,0 +1,149 @@
+import logging
+from sqlalchemy.orm import Session
+from llm import complete, CACHE_USE
+from models import RFP, AIProvider
+from extraction import get_files_text, PAGE_BREAK
+from chunked_analysis import build_rfp_notes, count_tokens, ANALYSIS_CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Instruções do analista usadas em toda análise de RFP
+ANALYSIS_SYSTEM_PROMPT = (
+    "Você é um Analista de Pré-Vendas e Comercial Sênior, especializado em analisar RFPs (Request for Proposal). "
+    "Seu objetivo é interpretar documentos de RFP enviados, extrair as informações mais importantes, identificar riscos ou lacunas, "
+    "e apresentar a análise de forma organizada, consultiva e clara em Markdown. "
+    "Use títulos e listas para estruturar o conteúdo. "
+    "Se alguma informação estiver ausente, aponte claramente como 'Informação não fornecida - recomendar esclarecimento'. "
+    "Seja técnico, profissional e objetivo."
+)
+
+ANALYSIS_USER_PROMPT = (
+    "Analise o seguinte conteúdo de RFP, leve em consideração as informações fornecidas em todo o conteúdo da RFP, inclusive anexos ou descrições de especificação técnica, e estruture a resposta em Markdown seguindo rigorosamente este formato, preenchendo TODOS os tópicos, mesmo que a informação não esteja presente (neste caso, escreva 'Informação não fornecida - recomendar esclarecimento').\n"
+    "\n## 1. Identificação Geral\n"
+    "- **Nome do Projeto:** <preencher>\n"
+    "- **Cliente:** <preencher>\n"
+    "- **Número da RFP (se aplicável):** <preencher>\n"
+    "- **Data de Emissão:** <preencher>\n"
+    "- **Data de Entrega da Proposta:** <preencher>\n"
+    "\n## 2. Objetivo do Projeto\n"
+    "- <preencher>\n"
+    "\n## 3. Escopo Técnico\n"
+    "- **Descrição geral do escopo:** <preencher>\n"
+    "- **Tecnologias envolvidas:** <preencher>\n"
+    "- **Quantitativos estimados:** <preencher>\n"
+    "\n## 4. Equipamentos e Serviços Detalhados\n"
+    "Liste os equipamentos e serviços solicitados, preenchendo as tabelas abaixo:\n"
+    "\n### Equipamentos\n"
+    "| Equipamento | Modelo/Descrição | Quantidade | Observações |\n"
+    "|:------------|:------------------|:-----------|:------------|\n"
+    "| <preencher> | <preencher>       | <preencher>| <preencher> |\n"
+    "\n### Serviços\n"
+    "| Serviço | Descrição resumida | Observações |\n"
+    "|:--------|:-------------------|:------------|\n"
+    "| <preencher> | <preencher> | <preencher> |\n"
+    "\n**Nota:** Se algum dado como modelo, quantidade ou descrição técnica não estiver presente, indicar 'Informação não fornecida - recomendar esclarecimento'.\n"
+    "\n## 5. Requisitos Obrigatórios\n"
+    "- <preencher>\n"
+    "\n## 6. Requisitos Desejáveis\n"
+    "- <preencher>\n"
+    "\n## 7. Critérios de Qualificação\n"
+    "- <preencher>\n"
+    "\n## 8. Modelo de Precificação\n"
+    "- **Forma de precificação exigida:** <preencher>\n"
+    "- **Tipo de contrato:** <preencher>\n"
+    "\n## 9. Entregáveis Esperados\n"
+    "- <preencher>\n"
+    "\n## 10. Prazos e Condições\n"
+    "- **Prazos de execução:** <preencher>\n"
+    "- **Condições comerciais relevantes:** <preencher>\n"
+    "\n## 11. Riscos Identificados\n"
+    "- <preencher>\n"
+    "\n## 12. Perguntas ou Pontos a Esclarecer\n"
+    "- <preencher>\n"
+    "\n---\n"
+    "**DICAS DE FORMATAÇÃO:**\n"
+    "- Use sempre listas ou tópicos para respostas longas.\n"
+    "- Nunca deixe um item sem resposta (caso contrário, escreva 'Informação não fornecida - recomendar esclarecimento').\n"
+    "- Use negrito para títulos internos dos tópicos.\n"
+    "- Separe visualmente os tópicos com linhas em branco.\n"
+    "- Respeite o layout Markdown para garantir legibilidade, mesmo para textos extensos.\n"
+    "\n\nConteúdo da RFP:\n"
+)
+
+# Usado quando o conteúdo são notas da etapa map-reduce e não o texto integral
+NOTES_PREAMBLE = (
+    "O conteúdo da RFP abaixo é composto por notas extraídas de cada trecho dos documentos originais "
+    "(identificados por arquivo e página), pois o texto integral excede o limite de contexto.\n\n"
+)
+
+ANALYSIS_MAX_TOKENS = 10000
+ANALYSIS_TEMPERATURE = 0.3
+
+def _noop_progress(percent: int, stage: str):
+    pass
+
+# Texto de cada arquivo da RFP, na ordem de upload
+def extract_rfp_texts(db: Session, rfp: RFP, progress=_noop_progress) -> list:
+    files = sorted(rfp.files, key=lambda f: f.id)
+    progress(0, f"Extraindo texto de {len(files)} arquivo(s)")
+
+    def file_progress(done: int, total: int):
+        progress(int(40 * done / total), f"Texto extraído de {done}/{total} arquivo(s)")
+
+    contents = get_files_text(db, files, file_progress)
+    return [(file_rec, content) for file_rec, content in zip(files, contents) if content is not None]
+
+def join_rfp_texts(files: list) -> str:
+    text = ""
+    for file_rec, content in files:
+        text += f"\n\nConteúdo do arquivo {file_rec.filename}:\n{content.replace(PAGE_BREAK, chr(10))}"
+    return text
+
+# Concatena o texto de todos os arquivos da RFP, na ordem de upload
+def extract_rfp_text(db: Session, rfp: RFP, progress=_noop_progress) -> str:
+    return join_rfp_texts(extract_rfp_texts(db, rfp, progress))
+
+def build_analysis_messages(text: str, from_notes: bool = False) -> list:
+    user = ANALYSIS_USER_PROMPT
+    if from_notes:
+        user = NOTES_PREAMBLE + user
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": user + text},
+    ]
+
+# Orçamento de tokens para o conteúdo da RFP no prompt final
+def analysis_content_budget() -> int:
+    overhead = count_tokens(ANALYSIS_SYSTEM_PROMPT + NOTES_PREAMBLE + ANALYSIS_USER_PROMPT)
+    return ANALYSIS_CONTEXT_TOKENS - ANALYSIS_MAX_TOKENS - overhead
+
+# Extrai os textos e monta o prompt final; se o conteúdo não couber na janela de
+# contexto, passa antes pela etapa map-reduce (resumos por trecho)
+def prepare_analysis_messages(db: Session, rfp: RFP, provider: AIProvider, progress=_noop_progress, cache: str = CACHE_USE) -> list:
+    files = extract_rfp_texts(db, rfp, progress)
+    text = join_rfp_texts(files)
+    budget = analysis_content_budget()
+    if count_tokens(text) <= budget:
+        return build_analysis_messages(text)
+    logger.info("RFP %s excede a janela de contexto; usando análise map-reduce", rfp.id)
+
+    def map_progress(percent: int, stage: str):
+        progress(40 + int(45 * percent / 100), stage)
+
+    notes = build_rfp_notes(db, provider, files, budget, map_progress, cache)
+    return build_analysis_messages(notes, from_notes=True)
+
+def save_rfp_analysis(db: Session, rfp: RFP, resumo: str):
+    # Salvar o resumo IA no banco e atualizar status
+    rfp.resumo_ia = resumo
+    rfp.status = "Análise IA"
+    db.commit()
+
+# Extrai o texto dos arquivos, gera o resumo IA e grava na RFP
+def run_rfp_analysis(db: Session, rfp: RFP, provider: AIProvider, progress=_noop_progress, cache: str = CACHE_USE) -> str:
+    messages = prepare_analysis_messages(db, rfp, provider, progress, cache)
+    progress(85, "Aguardando resposta da IA")
+    resumo = complete(provider, messages, max_tokens=ANALYSIS_MAX_TOKENS, temperature=ANALYSIS_TEMPERATURE, cache=cache)
+    progress(95, "Salvando análise")
+    save_rfp_analysis(db, rfp, resumo)
+    return resumo
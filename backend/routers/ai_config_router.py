@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, FastAPI, Response
+from fastapi import APIRouter, Depends, HTTPException, FastAPI, Response, Query
 from sqlalchemy.orm import Session
-from models import AIConfig, User
+from models import AIConfig, User, LLMResponse, LLMBudget, LLMRoutingPolicy, AIProvider
 from auth import get_db, get_current_user
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Literal
+from llm import cache_stats
+from usage import usage_summary, budget_consumption
+from routing import health_snapshot
 import datetime
 
 router = APIRouter(prefix="/admin/config", tags=["admin_config"])
@@ -46,3 +50,170 @@ def set_ai_config(data: AIConfigIn, db: Session = Depends(get_db), current_user:
     db.commit()
     db.refresh(cfg)
     return cfg
+
+# Métricas do cache de respostas LLM (acertos/erros neste worker, entradas e tamanho no banco)
+@router.get("/llm-cache")
+def get_llm_cache_stats(current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    return cache_stats()
+
+@router.delete("/llm-cache")
+def clear_llm_cache(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    deleted = db.query(LLMResponse).filter(LLMResponse.status == "ready").delete(synchronize_session=False)
+    db.commit()
+    return {"ok": True, "removidos": deleted}
+
+# Uso das LLMs (ledger llm_usage) agregado por dia, usuário, RFP, operação, modelo ou provedor
+@router.get("/llm-usage")
+def get_llm_usage(
+    group_by: Literal["day", "user", "rfp", "operation", "model", "provider"] = Query("day"),
+    date_from: Optional[datetime.datetime] = Query(None),
+    date_to: Optional[datetime.datetime] = Query(None),
+    user_id: Optional[int] = Query(None),
+    rfp_id: Optional[int] = Query(None),
+    operation: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    return usage_summary(db, group_by, date_from, date_to, user_id, rfp_id, operation)
+
+class LLMBudgetIn(BaseModel):
+    scope: Literal["user", "rfp"]
+    scope_id: Optional[int] = None  # nulo = cota padrão para todos os usuários/RFPs
+    period: Literal["day", "month", "total"]
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    action: Literal["reject", "downgrade"] = "reject"
+    downgrade_model: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_limits(self):
+        if self.max_tokens is None and self.max_cost is None:
+            raise ValueError("Informe max_tokens e/ou max_cost")
+        if self.action == "downgrade" and not self.downgrade_model:
+            raise ValueError("downgrade_model é obrigatório para action=downgrade")
+        return self
+
+class LLMBudgetOut(LLMBudgetIn):
+    id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    consumed_tokens: Optional[int] = None
+    consumed_cost: Optional[float] = None
+
+    class Config:
+        orm_mode = True
+
+# Cotas cadastradas; as específicas (scope_id) trazem o consumo no período atual
+@router.get("/llm-budgets", response_model=List[LLMBudgetOut])
+def list_llm_budgets(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    budgets = db.query(LLMBudget).order_by(LLMBudget.scope, LLMBudget.scope_id, LLMBudget.period).all()
+    result = []
+    for budget in budgets:
+        out = LLMBudgetOut.model_validate(budget, from_attributes=True)
+        if budget.scope_id is not None:
+            out.consumed_tokens, out.consumed_cost = budget_consumption(db, budget, budget.scope_id)
+        result.append(out)
+    return result
+
+# Cria ou atualiza a cota de (scope, scope_id, period)
+@router.post("/llm-budgets", response_model=LLMBudgetOut)
+def set_llm_budget(data: LLMBudgetIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    budget = db.query(LLMBudget).filter(
+        LLMBudget.scope == data.scope,
+        LLMBudget.scope_id.is_(None) if data.scope_id is None else LLMBudget.scope_id == data.scope_id,
+        LLMBudget.period == data.period,
+    ).first()
+    if not budget:
+        budget = LLMBudget(scope=data.scope, scope_id=data.scope_id, period=data.period)
+        db.add(budget)
+    budget.max_tokens = data.max_tokens
+    budget.max_cost = data.max_cost
+    budget.action = data.action
+    budget.downgrade_model = data.downgrade_model
+    db.commit()
+    db.refresh(budget)
+    return budget
+
+@router.delete("/llm-budgets/{budget_id}")
+def delete_llm_budget(budget_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    budget = db.query(LLMBudget).filter(LLMBudget.id == budget_id).first()
+    if not budget:
+        raise HTTPException(status_code=404, detail="Cota não encontrada")
+    db.delete(budget)
+    db.commit()
+    return {"ok": True}
+
+class LLMRoutingPolicyIn(BaseModel):
+    operation: str = Field(..., min_length=1, max_length=50)  # prefixo da operação (ex.: analise, proposta) ou 'default'
+    provider_ids: Optional[List[int]] = None  # ordem de preferência; nulo = selecionado e depois os demais
+    failover: bool = True
+    hedge: bool = False
+    hedge_delay_ms: Optional[int] = Field(None, ge=0)  # nulo = p95 da operação no provedor primário
+    max_attempts: int = Field(3, ge=1, le=10)
+
+class LLMRoutingPolicyOut(LLMRoutingPolicyIn):
+    id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+    class Config:
+        orm_mode = True
+
+@router.get("/llm-routing", response_model=List[LLMRoutingPolicyOut])
+def list_llm_routing(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    return db.query(LLMRoutingPolicy).order_by(LLMRoutingPolicy.operation).all()
+
+# Cria ou atualiza a política de roteamento da operação
+@router.post("/llm-routing", response_model=LLMRoutingPolicyOut)
+def set_llm_routing(data: LLMRoutingPolicyIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    if data.provider_ids:
+        existing = {row.id for row in db.query(AIProvider.id).filter(AIProvider.id.in_(data.provider_ids))}
+        missing = [provider_id for provider_id in data.provider_ids if provider_id not in existing]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Provedor não encontrado: {', '.join(map(str, missing))}")
+    policy = db.query(LLMRoutingPolicy).filter(LLMRoutingPolicy.operation == data.operation).first()
+    if not policy:
+        policy = LLMRoutingPolicy(operation=data.operation)
+        db.add(policy)
+    policy.provider_ids = list(dict.fromkeys(data.provider_ids)) if data.provider_ids else None
+    policy.failover = data.failover
+    policy.hedge = data.hedge
+    policy.hedge_delay_ms = data.hedge_delay_ms
+    policy.max_attempts = data.max_attempts
+    db.commit()
+    db.refresh(policy)
+    return policy
+
+@router.delete("/llm-routing/{policy_id}")
+def delete_llm_routing(policy_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    policy = db.query(LLMRoutingPolicy).filter(LLMRoutingPolicy.id == policy_id).first()
+    if not policy:
+        raise HTTPException(status_code=404, detail="Política não encontrada")
+    db.delete(policy)
+    db.commit()
+    return {"ok": True}
+
+# Saúde dos provedores (latência, taxa de erro, disponibilidade) medida por este worker
+@router.get("/llm-health")
+def get_llm_health(current_user: User = Depends(get_current_user)):
+    if current_user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    return health_snapshot()
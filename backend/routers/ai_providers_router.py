@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from models import AIProvider, User
 from auth import get_db, get_current_user
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from llm_clients import invalidate_provider
+from cache import TTLCache, invalidate_on_write
 import datetime
+import os
 
 router = APIRouter(prefix="/admin/config/providers", tags=["admin_providers"])
 
@@ -12,6 +15,8 @@ class AIProviderIn(BaseModel):
     name: str
     model: str
     api_key: str
+    rpm_limit: Optional[int] = Field(None, ge=1)  # requisições por minuto da conta; nulo = sem limite
+    tpm_limit: Optional[int] = Field(None, ge=1)  # tokens por minuto
 
 class AIProviderOut(AIProviderIn):
     id: int
@@ -26,8 +31,20 @@ def admin_only(user: User):
     if user.perfil != "admin":
         raise HTTPException(status_code=403, detail="Permissão negada")
 
-def get_selected_provider(db: Session = Depends(get_db)) -> AIProvider:
+PROVIDER_CACHE_TTL = float(os.getenv('PROVIDER_CACHE_TTL', '30'))
+
+# Provedor selecionado; limpo a cada escrita em AIProvider (inclusive em outros workers)
+provider_cache = TTLCache('selected_provider', PROVIDER_CACHE_TTL)
+invalidate_on_write(AIProvider, 'selected_provider')
+
+def _load_selected_provider(db: Session):
     prov = db.query(AIProvider).filter(AIProvider.is_selected == True).first()
+    if prov is not None:
+        db.expunge(prov)
+    return prov
+
+def get_selected_provider(db: Session = Depends(get_db)) -> AIProvider:
+    prov = provider_cache.get('selected', lambda: _load_selected_provider(db))
     if not prov:
         raise HTTPException(status_code=500, detail="Nenhum provedor IA selecionado")
     return prov
@@ -45,6 +62,8 @@ def create_provider(data: AIProviderIn, db: Session = Depends(get_db), current_u
         name=data.name,
         model=data.model,
         api_key=data.api_key,
+        rpm_limit=data.rpm_limit,
+        tpm_limit=data.tpm_limit,
         is_selected=False,
         created_at=now,
         updated_at=now
@@ -63,16 +82,24 @@ def update_provider(provider_id: int, data: AIProviderIn, db: Session = Depends(
     prov.name = data.name
     prov.model = data.model
     prov.api_key = data.api_key
+    prov.rpm_limit = data.rpm_limit
+    prov.tpm_limit = data.tpm_limit
     prov.updated_at = datetime.datetime.utcnow()
     db.commit()
     db.refresh(prov)
+    invalidate_provider(provider_id)
     return prov
 
 @router.patch("/{provider_id}/select")
 def select_provider(provider_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     admin_only(current_user)
     providers = db.query(AIProvider).all()
+    changed = []
     for p in providers:
+        if p.is_selected != (p.id == provider_id):
+            changed.append(p.id)
         p.is_selected = (p.id == provider_id)
     db.commit()
+    for changed_id in changed:
+        invalidate_provider(changed_id)
     return {"ok": True}
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from models import AnalysisJob, RFP, User
+from auth import get_db, get_current_user
+from pydantic import BaseModel
+import datetime
+
+router = APIRouter(prefix="/analysis_jobs", tags=["analysis_jobs"])
+
+class AnalysisJobOut(BaseModel):
+    id: int
+    rfp_id: int
+    status: str
+    cache_mode: str
+    progress: int
+    stage: str | None = None
+    error: str | None = None
+    attempts: int
+    created_at: datetime.datetime | None = None
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+    class Config:
+        orm_mode = True
+
+class AnalysisJobResult(BaseModel):
+    id: int
+    rfp_id: int
+    status: str
+    resumo: str
+
+def get_job_or_404(job_id: int, db: Session, current_user: User) -> AnalysisJob:
+    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job de análise não encontrado")
+    rfp = db.query(RFP).filter(RFP.id == job.rfp_id).first()
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="Job de análise não encontrado")
+    return job
+
+@router.get("/rfp/{rfp_id}", response_model=AnalysisJobOut)
+def get_latest_job(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    job = db.query(AnalysisJob).filter(AnalysisJob.rfp_id == rfp_id).order_by(AnalysisJob.id.desc()).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Nenhuma análise solicitada para esta RFP")
+    return job
+
+@router.get("/{job_id}", response_model=AnalysisJobOut)
+def get_job(job_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return get_job_or_404(job_id, db, current_user)
+
+@router.get("/{job_id}/result", response_model=AnalysisJobResult)
+def get_job_result(job_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    job = get_job_or_404(job_id, db, current_user)
+    if job.status == 'failed':
+        raise HTTPException(status_code=500, detail=f"Análise falhou: {job.error}")
+    if job.status != 'completed':
+        raise HTTPException(status_code=409, detail="Análise ainda em andamento")
+    return {"id": job.id, "rfp_id": job.rfp_id, "status": job.status, "resumo": job.result}
@@ -1,14 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, insert, update, delete, values, column, cast, Integer
 from sqlalchemy.orm import Session
-from typing import List
-from models import BoMItem, User, RFP, Vendor
-from auth import get_db, get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from models import BoMItem, User, RFP, Vendor, AIProvider
+from catalog import match_part_numbers, CATALOG_AUTOFIX_SIMILARITY
+from auth import get_db, get_async_db, get_current_user
+from routers.ai_providers_router import get_selected_provider
+from llm import complete, llm_cache_mode
+from usage import usage_scope
 from pydantic import BaseModel
-import os
-from openai import OpenAI
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 class BoMItemCreate(BaseModel):
     descricao: str
     modelo: str
@@ -21,14 +22,116 @@ class BoMItemUpdate(BaseModel):
     part_number: str = None
     quantidade: int = None
 
+class BoMItemOut(BoMItemCreate):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+class BoMItemPatch(BoMItemUpdate):
+    id: int
+
+# Diff de um BoM aplicado de uma vez: novos itens, alterações (só os campos enviados) e remoções
+class BoMBatch(BaseModel):
+    create: List[BoMItemCreate] = []
+    update: List[BoMItemPatch] = []
+    delete: List[int] = []
+
+class BoMBatchResult(BaseModel):
+    created: List[int]  # na ordem de "create"
+    updated: List[int]
+    deleted: List[int]
+
+class CatalogMatch(BaseModel):
+    id: int
+    part_number: str
+    descricao: Optional[str] = None
+    modelo: Optional[str] = None
+    preco: Optional[float] = None
+    moeda: Optional[str] = None
+    score: float  # similaridade do part number (1 = igual, ignorando formatação)
+
+class BoMValidationLine(BaseModel):
+    item_id: int
+    part_number: Optional[str] = None
+    status: str  # ok, corrigido, divergente, sugestao ou nao_encontrado
+    sku: Optional[CatalogMatch] = None
+    candidatos: List[CatalogMatch] = []
+
 router = APIRouter(prefix="/bom", tags=["bom"])
 
-@router.get("/rfp/{rfp_id}", response_model=List[BoMItemCreate])
-def list_bom_items(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    bom_items = db.query(BoMItem).filter(BoMItem.rfp_id == rfp_id).all()
-    return bom_items
+BOM_FIELDS = ("descricao", "modelo", "part_number", "quantidade")
+
+# Escrita em lote do BoM de uma RFP, sem commit: um INSERT multi-linha com RETURNING,
+# um UPDATE ... FROM (VALUES ...) por conjunto de campos alterados e um DELETE.
+# replace=True remove antes todos os itens da RFP.
+def write_bom(db: Session, rfp_id: int, creates: List[dict] = (), updates: List[dict] = (), deletes: List[int] = (), replace: bool = False) -> dict:
+    if replace:
+        db.execute(delete(BoMItem).where(BoMItem.rfp_id == rfp_id))
+    elif deletes:
+        db.execute(delete(BoMItem).where(BoMItem.rfp_id == rfp_id, BoMItem.id.in_(deletes)))
+    groups = {}
+    for item in updates:
+        fields = tuple(f for f in BOM_FIELDS if f in item)
+        if fields:
+            groups.setdefault(fields, []).append(item)
+    table = BoMItem.__table__
+    for fields, items in groups.items():
+        data = values(column("id", Integer), *[column(f, table.c[f].type) for f in fields], name="data").data(
+            [(item["id"], *[item[f] for f in fields]) for item in items]
+        )
+        db.execute(
+            update(table)
+            .where(table.c.id == data.c.id, table.c.rfp_id == rfp_id)
+            .values({f: cast(data.c[f], table.c[f].type) for f in fields})
+        )
+    created = []
+    if creates:
+        created = db.scalars(
+            insert(BoMItem).returning(BoMItem.id, sort_by_parameter_order=True),
+            [{"rfp_id": rfp_id, **{f: item.get(f) for f in BOM_FIELDS}} for item in creates],
+        ).all()
+    return {"created": list(created), "updated": [item["id"] for item in updates], "deleted": list(deletes)}
+
+# Confere cada linha do BoM com o catálogo do vendor. Com fix=True, linhas cujo melhor
+# candidato tem similaridade >= CATALOG_AUTOFIX_SIMILARITY recebem o part number do catálogo
+# (sem commit)
+def check_bom(db: Session, rfp_id: int, vendor_id: int, fix: bool = False) -> list:
+    items = db.execute(
+        select(BoMItem.id, BoMItem.part_number).where(BoMItem.rfp_id == rfp_id).order_by(BoMItem.id)
+    ).all()
+    matches = match_part_numbers(db, vendor_id, {item.id: item.part_number for item in items})
+    report, fixes = [], []
+    for item in items:
+        candidates = matches.get(item.id, [])
+        best = candidates[0] if candidates else None
+        if best is None:
+            line_status = "nao_encontrado"
+        elif best["part_number"] == (item.part_number or "").strip():
+            line_status = "ok"
+        elif best["score"] >= CATALOG_AUTOFIX_SIMILARITY:
+            line_status = "corrigido" if fix else "divergente"
+            if fix:
+                fixes.append({"id": item.id, "part_number": best["part_number"]})
+        else:
+            line_status = "sugestao"
+        report.append({
+            "item_id": item.id,
+            "part_number": best["part_number"] if line_status == "corrigido" else item.part_number,
+            "status": line_status,
+            "sku": best if line_status in ("ok", "corrigido", "divergente") else None,
+            "candidatos": candidates,
+        })
+    if fixes:
+        write_bom(db, rfp_id, updates=fixes)
+    return report
+
+@router.get("/rfp/{rfp_id}", response_model=List[BoMItemOut])
+async def list_bom_items(rfp_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    result = await db.execute(select(BoMItem).where(BoMItem.rfp_id == rfp_id).order_by(BoMItem.id))
+    return result.scalars().all()
 
-@router.post("/rfp/{rfp_id}", response_model=BoMItemCreate)
+@router.post("/rfp/{rfp_id}", response_model=BoMItemOut)
 def create_bom_item(rfp_id: int, item: BoMItemCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp:
@@ -39,14 +142,14 @@ def create_bom_item(rfp_id: int, item: BoMItemCreate, db: Session = Depends(get_
     db.refresh(new_item)
     return new_item
 
-@router.get("/item/{item_id}", response_model=BoMItemCreate)
+@router.get("/item/{item_id}", response_model=BoMItemOut)
 def get_bom_item(item_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     item = db.query(BoMItem).filter(BoMItem.id == item_id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item de BoM não encontrado")
     return item
 
-@router.put("/item/{item_id}", response_model=BoMItemCreate)
+@router.put("/item/{item_id}", response_model=BoMItemOut)
 def update_bom_item(item_id: int, item_update: BoMItemUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     item = db.query(BoMItem).filter(BoMItem.id == item_id).first()
     if not item:
@@ -66,9 +169,48 @@ def delete_bom_item(item_id: int, db: Session = Depends(get_db), current_user: U
     db.commit()
     return {"ok": True}
 
+# Salva a edição de um BoM inteiro numa única transação; ids de update/delete precisam ser da RFP
+@router.post("/rfp/{rfp_id}/batch", response_model=BoMBatchResult)
+def apply_bom_batch(rfp_id: int, batch: BoMBatch, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    update_ids = [item.id for item in batch.update]
+    if len(set(update_ids)) != len(update_ids) or len(set(batch.delete)) != len(batch.delete):
+        raise HTTPException(status_code=400, detail="Item repetido no lote")
+    if set(update_ids) & set(batch.delete):
+        raise HTTPException(status_code=400, detail="Item alterado e removido no mesmo lote")
+    ids = set(update_ids) | set(batch.delete)
+    if ids:
+        found = set(db.scalars(select(BoMItem.id).where(BoMItem.rfp_id == rfp_id, BoMItem.id.in_(ids))).all())
+        missing = sorted(ids - found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Itens de BoM não encontrados: {', '.join(map(str, missing))}")
+    result = write_bom(
+        db, rfp_id,
+        creates=[item.dict() for item in batch.create],
+        updates=[item.dict(exclude_unset=True) for item in batch.update],
+        deletes=batch.delete,
+    )
+    db.commit()
+    return result
 
-@router.post("/rfp/{rfp_id}/generate", response_model=List[BoMItemCreate])
-def generate_bom_ia(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+# Valida o BoM contra o catálogo de SKUs (por padrão o do fabricante escolhido na RFP)
+@router.post("/rfp/{rfp_id}/validate", response_model=List[BoMValidationLine])
+def validate_bom(rfp_id: int, vendor_id: Optional[int] = None, fix: bool = False, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    vendor_id = vendor_id or rfp.fabricante_escolhido_id
+    if not vendor_id:
+        raise HTTPException(status_code=400, detail="Informe o fabricante (vendor_id) ou selecione um na RFP")
+    report = check_bom(db, rfp_id, vendor_id, fix=fix)
+    db.commit()
+    return report
+
+
+@router.post("/rfp/{rfp_id}/generate", response_model=List[BoMItemOut])
+def generate_bom_ia(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp or not rfp.resumo_ia or not rfp.fabricante_escolhido_id:
         raise HTTPException(status_code=400, detail="RFP precisa de resumo da IA e fabricante selecionado")
@@ -96,14 +238,9 @@ Responda APENAS em JSON, lista de itens no formato:
 ]
 Inclua módulos, licenças e equipamentos essenciais. Não adicione comentários fora do JSON.
 """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=1500,
-        temperature=0.2
-    )
+    with usage_scope("bom_ia", user_id=current_user.id, rfp_id=rfp_id):
+        content = complete(provider, [{"role": "user", "content": prompt}], max_tokens=1500, temperature=0.2, cache=cache)
     import json, re
-    content = response.choices[0].message.content
     # Extrair JSON da resposta
     json_match = re.search(r'\[.*\]', content, re.DOTALL)
     if not json_match:
@@ -112,25 +249,18 @@ Inclua módulos, licenças e equipamentos essenciais. Não adicione comentários
         items = json.loads(json_match.group(0))
     except Exception:
         raise HTTPException(status_code=500, detail="Falha ao processar JSON gerado pela IA")
-    # Limpar BoM antigo
-    db.query(BoMItem).filter(BoMItem.rfp_id == rfp_id).delete()
-    # Criar novos itens
-    result = []
-    for item in items:
-        new_item = BoMItem(
-            rfp_id=rfp_id,
-            descricao=item.get("descricao", ""),
-            modelo=item.get("modelo", ""),
-            part_number=item.get("part_number", ""),
-            quantidade=item.get("quantidade", 1)
-        )
-        db.add(new_item)
-        db.flush()
-        result.append(BoMItemCreate(
-            descricao=new_item.descricao,
-            modelo=new_item.modelo,
-            part_number=new_item.part_number,
-            quantidade=new_item.quantidade
-        ))
+    # Substitui o BoM antigo pelos itens gerados
+    creates = [
+        {
+            "descricao": item.get("descricao", ""),
+            "modelo": item.get("modelo", ""),
+            "part_number": item.get("part_number", ""),
+            "quantidade": item.get("quantidade", 1),
+        }
+        for item in items
+    ]
+    write_bom(db, rfp_id, creates=creates, replace=True)
+    # Part numbers inventados pela IA: troca pelo SKU do catálogo quando há um bem próximo
+    check_bom(db, rfp_id, fabricante.id, fix=True)
     db.commit()
-    return result
+    return db.query(BoMItem).filter(BoMItem.rfp_id == rfp_id).order_by(BoMItem.id).all()
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import BaseModel
+from models import CatalogItem, Vendor, User
+from auth import get_db, get_async_db, get_current_user
+from catalog import import_catalog, lookup, CatalogImportError, CATALOG_EXTENSIONS, CATALOG_LOOKUP_MAX
+
+router = APIRouter(prefix="/catalog", tags=["catalog"])
+
+class CatalogHit(BaseModel):
+    id: int
+    vendor_id: int
+    part_number: str
+    descricao: Optional[str] = None
+    modelo: Optional[str] = None
+    preco: Optional[float] = None
+    moeda: Optional[str] = None
+    score: float
+    match: str  # prefixo, part_number ou descricao
+
+def admin_only(user: User):
+    if user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+
+# Autocomplete de SKU (part number ou descrição), do catálogo de um vendor ou de todos
+@router.get("/lookup", response_model=List[CatalogHit])
+async def lookup_catalog(
+    q: str = Query(..., min_length=1, max_length=200),
+    vendor_id: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=CATALOG_LOOKUP_MAX),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    return await lookup(db, q, vendor_id, limit)
+
+# Importa a lista de preços (CSV ou XLSX com cabeçalho) do vendor; replace=true descarta o catálogo anterior
+@router.post("/vendors/{vendor_id}/import")
+def import_vendor_catalog(vendor_id: int, file: UploadFile = File(...), replace: bool = False, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    admin_only(current_user)
+    if not db.query(Vendor).filter(Vendor.id == vendor_id).first():
+        raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
+    ext = (file.filename or "").rsplit(".", 1)[-1].lower()
+    if ext not in CATALOG_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Formato não suportado (use CSV ou XLSX)")
+    try:
+        result = import_catalog(db, vendor_id, file.file, ext, replace=replace)
+    except CatalogImportError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    total = db.scalar(select(func.count()).select_from(CatalogItem).where(CatalogItem.vendor_id == vendor_id))
+    return {**result, "total": total}
+
+@router.get("/vendors/{vendor_id}")
+def get_vendor_catalog_summary(vendor_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    total, updated_at = db.execute(
+        select(func.count(), func.max(CatalogItem.updated_at)).where(CatalogItem.vendor_id == vendor_id)
+    ).one()
+    return {"vendor_id": vendor_id, "total": total, "updated_at": updated_at}
+
+@router.delete("/vendors/{vendor_id}")
+def delete_vendor_catalog(vendor_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    admin_only(current_user)
+    deleted = db.execute(delete(CatalogItem).where(CatalogItem.vendor_id == vendor_id)).rowcount
+    db.commit()
+    return {"deleted": deleted}
@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from models import EscopoServico, RFP, User
-from auth import get_db, get_current_user
+from models import EscopoServico, RFP, User, AIProvider
+from auth import get_db, get_async_db, get_current_user
+from routers.ai_providers_router import get_selected_provider
+from llm import complete, llm_cache_mode
+from usage import usage_scope
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -34,8 +39,9 @@ def create_escopo(rfp_id: int, escopo: EscopoServicoCreate, db: Session = Depend
     return novo
 
 @router.get("/rfp/{rfp_id}", response_model=List[EscopoServicoOut])
-def list_escopos(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(EscopoServico).filter(EscopoServico.rfp_id == rfp_id).all()
+async def list_escopos(rfp_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    result = await db.execute(select(EscopoServico).where(EscopoServico.rfp_id == rfp_id))
+    return result.scalars().all()
 
 @router.put("/{escopo_id}", response_model=EscopoServicoOut)
 def update_escopo(escopo_id: int, escopo: EscopoServicoCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -58,24 +64,16 @@ def delete_escopo(escopo_id: int, db: Session = Depends(get_db), current_user: U
     return {"ok": True}
 
 # Endpoint para sugerir escopo via IA
-from openai import OpenAI
-import os
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 @router.post("/rfp/{rfp_id}/sugerir", response_model=EscopoServicoCreate)
-def sugerir_escopo_ia(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def sugerir_escopo_ia(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp or not rfp.resumo_ia:
         raise HTTPException(status_code=404, detail="RFP não encontrada ou sem resumo IA")
     prompt = f"""
 Considerando o seguinte resumo de uma RFP, gere uma sugestão de escopo de serviços (em português, formato Markdown):\n\nResumo:\n{rfp.resumo_ia}\n\nSugira um título objetivo e um texto descritivo para o escopo de serviços.\n\nFormato de resposta:\nTÍTULO: <título>\nDESCRICAO: <descrição detalhada em Markdown>"""
-    response = client.chat.completions.create(
-        model="gpt-4.1-nano",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=1000,
-        temperature=0.3,
-    )
-    content = response.choices[0].message.content
+    with usage_scope("escopo_ia", user_id=current_user.id, rfp_id=rfp_id):
+        content = complete(provider, [{"role": "user", "content": prompt}], max_tokens=1000, temperature=0.3, cache=cache)
     # Extrair título e descrição
     titulo = "Sugestão de Escopo"
     descricao = content
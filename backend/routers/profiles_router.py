@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Literal
+from models import User
+from auth import get_current_user
+from profiling import list_profiles, load_profile, delete_profile, to_collapsed, to_speedscope
+
+router = APIRouter(prefix="/admin/profiles", tags=["admin_profiles"])
+
+def admin_only(user: User):
+    if user.perfil != "admin":
+        raise HTTPException(status_code=403, detail="Permissão negada")
+
+# Profiles gravados (header X-Profile de um admin ou amostragem por PROFILE_SAMPLE_RATE), mais recentes primeiro
+@router.get("/")
+def list_request_profiles(limit: int = Query(50, ge=1, le=1000), current_user: User = Depends(get_current_user)):
+    admin_only(current_user)
+    return list_profiles()[:limit]
+
+# Download para o speedscope (JSON) ou no formato collapsed (flamegraph.pl/inferno)
+@router.get("/{profile_id}")
+def get_request_profile(profile_id: str, format: Literal["speedscope", "collapsed"] = Query("speedscope"), current_user: User = Depends(get_current_user)):
+    admin_only(current_user)
+    loaded = load_profile(profile_id)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Profile não encontrado")
+    meta, data = loaded
+    if format == "collapsed":
+        return PlainTextResponse(
+            to_collapsed(data),
+            headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.collapsed.txt"'},
+        )
+    return JSONResponse(
+        to_speedscope(meta, data),
+        headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.speedscope.json"'},
+    )
+
+@router.delete("/{profile_id}")
+def delete_request_profile(profile_id: str, current_user: User = Depends(get_current_user)):
+    admin_only(current_user)
+    if not delete_profile(profile_id):
+        raise HTTPException(status_code=404, detail="Profile não encontrado")
+    return {"ok": True}
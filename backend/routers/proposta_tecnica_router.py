@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from models import RFP, EscopoServico, User, Proposta, AIProvider, Vendor, BoMItem, RFPFile
 from auth import get_db, get_current_user
 from routers.ai_providers_router import get_selected_provider
 from pydantic import BaseModel
-from openai import OpenAI
+from llm_clients import get_async_client
+from llm import complete, llm_cache_mode
+from usage import usage_scope, bind_scope, enforce_budget, record_stream_usage
+from routing import pick_provider, record_health, is_failover_error
+from ratelimit import governed_async, estimate_tokens
+from database import SessionLocal
+from sse import sse_event, sse_response, close_upstream, iter_completion_deltas
+from profiling import run_in_threadpool
 import os
-import io
 import uuid
-from fastapi.responses import StreamingResponse
-from docxtpl import DocxTemplate
+from docx_render import render_docx
+from downloads import file_response
+from proposal_export import stream_proposals_zip, pdf_available, EXPORT_MAX_RFPS
+from typing import List, Optional, Literal
+import datetime
+import time
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
-import unicodedata
 from jinja2 import TemplateSyntaxError
 import logging
 
@@ -21,6 +34,12 @@ router = APIRouter(prefix="/propostas_tecnicas", tags=["propostas_tecnicas"])
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+PROPOSTA_MAX_TOKENS = 10000
+PROPOSTA_TEMPERATURE = 0.3
+# Regeneração por seção: cada seção é uma chamada menor, várias em paralelo
+PROPOSTA_SECTION_MAX_TOKENS = int(os.getenv('PROPOSTA_SECTION_MAX_TOKENS', '2000'))
+PROPOSTA_SECTION_CONCURRENCY = int(os.getenv('PROPOSTA_SECTION_CONCURRENCY', '6'))
+
 class PropostaTecnicaSections(BaseModel):
     introducao: str
     metodologia: str
@@ -29,12 +48,35 @@ class PropostaTecnicaSections(BaseModel):
     class Config:
         orm_mode = True
 
-@router.post("/rfp/{rfp_id}/gerar")
-def gerar_proposta_tecnica(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider)):
-    client = OpenAI(api_key=provider.api_key)
-    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
-    if not rfp or not rfp.resumo_ia:
-        raise HTTPException(status_code=404, detail="RFP não encontrada ou sem resumo IA")
+# Seções da proposta, na ordem do template: (título, instruções, partes do contexto usadas).
+# Títulos repetidos (ESCOPO DE SERVIÇOS) caem na mesma chave de dados_json.
+PROPOSTA_SECTIONS = [
+    ('CLIENTE', '- Trazer o nome do cliente', ("rfp",)),
+    ('NOME DO PROJETO', '- Trazer o nome do projeto', ("rfp",)),
+    ('BOM', '- Trazer o BoM em formato de tabela', ("bom",)),
+    ('O PROJETO', '- Descrição clara do projeto proposto.\n- Contextualização do que será implementado (solução Wireless, SD-WAN, etc.).\n- Alinhamento com o objetivo da RFP.', ("rfp", "vendor", "bom", "escopos")),
+    ('ESCOPO DE SERVIÇOS', '- Lista de atividades previstas, de forma detalhada, contemplando:\n  - Kick-off\n  - Projetos HLD e LLD\n  - Implantação\n  - Configurações específicas (ex.: VPN, políticas de segurança, SSIDs)\n  - Documentação As-Built\n  - Repasse de conhecimento / treinamentos', ("rfp", "vendor", "bom", "escopos")),
+    ('REUNIÃO DE KICK-OFF', '- Objetivos da reunião de início do projeto.\n- Principais definições esperadas nessa fase (ex.: equipe, endereços, cronograma, critérios de sucesso).', ("rfp", "escopos")),
+    ('DESENHO DA SOLUÇÃO', '- Definição da topologia lógica.\n- Considerações sobre customizações, funcionalidades e versões de software.', ("rfp", "vendor", "bom")),
+    ('ESCOPO DE SERVIÇOS', '- Detalhar serviços relacionados à instalação e configuração. Detalhe separadamente o escopo para cada tipo de tecnologia, criando subseções para cada tipo de solução.', ("rfp", "vendor", "bom", "escopos")),
+    ('PROJETO EXECUTIVO HLD', '- Explicação sobre a criação do High Level Design (topologias, protocolos, segurança, etc.).', ("rfp", "vendor", "bom")),
+    ('PROJETO LÓGICO LLD', '- Explicação sobre a criação do Low Level Design (endereçamento IP, NAT, ACLs, DHCP, etc.).', ("rfp", "vendor", "bom")),
+    ('ESCOPO DE SERVIÇOS ', '- Configuração de funcionalidades específicas do produto (ex.: VPN, UTP Licenses, políticas de segurança).', ("rfp", "vendor", "bom", "escopos")),
+    ('DOCUMENTAÇÃO', '- Itens de documentação que serão entregues (HLD, LLD, As-Built, caderno de testes, etc.).', ("rfp", "escopos")),
+    ('PASSAGEM DE CONHECIMENTO', '- Treinamento e repasse de conhecimento remoto caso solicitado.', ("rfp", "escopos")),
+    ('TREINAMENTO CLIENTE', '- Treinamento presencial focado nos produtos implementados (ex.: SD-WAN, WLAN).', ("rfp", "vendor", "bom")),
+    ('LOCAL DA EXECUÇÃO DOS SERVIÇOS', '- Informar o(s) local(is) de execução conforme a RFP.', ("rfp", "arquivos")),
+    ('FORA DO ESCOPO', '- Lista clara do que **não está incluído** na proposta.', ("rfp", "bom", "escopos")),
+    ('PREMISSAS', '- Condições e expectativas que devem ser garantidas para execução correta do projeto.', ("rfp", "escopos")),
+    ('VALIDADE DA PROPOSTA', '- Prazo de validade da proposta conforme a oportunidade.', ("rfp",)),
+    ('ACEITE DA PROPOSTA', '- Orientações sobre como formalizar o aceite (pedido de compra ou e-mail de concordância).', ("rfp",)),
+]
+# Versão dos prompts por seção: alterar marca todas as seções como desatualizadas
+PROPOSTA_SECTION_PROMPT_VERSION = 1
+
+# Contexto da RFP usado nos prompts (textos já formatados)
+def load_proposta_context(db: Session, rfp: RFP) -> dict:
+    rfp_id = rfp.id
     escopos = db.query(EscopoServico).filter(EscopoServico.rfp_id == rfp_id).all()
     escopos_text = "\n".join([f"- {e.titulo}: {e.descricao or ''}" for e in escopos])
     # Arquivos anexados
@@ -49,22 +91,30 @@ def gerar_proposta_tecnica(rfp_id: int, db: Session = Depends(get_db), current_u
     # Itens de BoM
     bom_items = db.query(BoMItem).filter(BoMItem.rfp_id == rfp_id).all()
     bom_text = "\n".join([f"- {item.descricao} (modelo: {item.modelo}, part_number: {item.part_number}, quantidade: {item.quantidade})" for item in bom_items]) or "Nenhum BoM gerado"
+    return {
+        "nome": rfp.nome, "resumo": rfp.resumo_ia, "arquivos": arquivos_text,
+        "vendor": vendor_info, "bom": bom_text, "escopos": escopos_text,
+    }
+
+# Monta o prompt da proposta a partir do contexto completo da RFP
+def build_proposta_prompt(ctx: dict) -> str:
+    template_text = "\n\n".join(f"### {title}\n{instructions}" for title, instructions, _ in PROPOSTA_SECTIONS) + "\n"
     prompt = f"""
 Você é um consultor técnico de pré-vendas sênior, especializado em elaborar propostas técnicas para projetos de infraestrutura, redes e segurança da informação.
 
 Abaixo está o contexto completo da RFP:
 
-- Nome da RFP: {rfp.nome}
+- Nome da RFP: {ctx['nome']}
 - Arquivos Anexados:
-{arquivos_text}
+{ctx['arquivos']}
 - Resumo IA:
-{rfp.resumo_ia}
+{ctx['resumo']}
 - Fabricante Selecionado:
-{vendor_info}
+{ctx['vendor']}
 - Itens de BoM:
-{bom_text}
+{ctx['bom']}
 - Escopo de Serviços:
-{escopos_text}
+{ctx['escopos']}
 
 ---
 
@@ -78,73 +128,7 @@ Use exatamente as seguintes seções e títulos:
 
 ### Estrutura da Resposta (Template):
 
-### CLIENTE
-- Trazer o nome do cliente
-
-### NOME DO PROJETO
-- Trazer o nome do projeto
-
-### BOM
-- Trazer o BoM em formato de tabela
-
-### O PROJETO
-- Descrição clara do projeto proposto.
-- Contextualização do que será implementado (solução Wireless, SD-WAN, etc.).
-- Alinhamento com o objetivo da RFP.
-
-### ESCOPO DE SERVIÇOS
-- Lista de atividades previstas, de forma detalhada, contemplando:
-  - Kick-off
-  - Projetos HLD e LLD
-  - Implantação
-  - Configurações específicas (ex.: VPN, políticas de segurança, SSIDs)
-  - Documentação As-Built
-  - Repasse de conhecimento / treinamentos
-
-### REUNIÃO DE KICK-OFF
-- Objetivos da reunião de início do projeto.
-- Principais definições esperadas nessa fase (ex.: equipe, endereços, cronograma, critérios de sucesso).
-
-### DESENHO DA SOLUÇÃO
-- Definição da topologia lógica.
-- Considerações sobre customizações, funcionalidades e versões de software.
-
-### ESCOPO DE SERVIÇOS
-- Detalhar serviços relacionados à instalação e configuração. Detalhe separadamente o escopo para cada tipo de tecnologia, criando subseções para cada tipo de solução.
-
-### PROJETO EXECUTIVO HLD
-- Explicação sobre a criação do High Level Design (topologias, protocolos, segurança, etc.).
-
-### PROJETO LÓGICO LLD
-- Explicação sobre a criação do Low Level Design (endereçamento IP, NAT, ACLs, DHCP, etc.).
-
-### ESCOPO DE SERVIÇOS 
-- Configuração de funcionalidades específicas do produto (ex.: VPN, UTP Licenses, políticas de segurança).
-
-### DOCUMENTAÇÃO
-- Itens de documentação que serão entregues (HLD, LLD, As-Built, caderno de testes, etc.).
-
-### PASSAGEM DE CONHECIMENTO
-- Treinamento e repasse de conhecimento remoto caso solicitado.
-
-### TREINAMENTO CLIENTE
-- Treinamento presencial focado nos produtos implementados (ex.: SD-WAN, WLAN).
-
-### LOCAL DA EXECUÇÃO DOS SERVIÇOS
-- Informar o(s) local(is) de execução conforme a RFP.
-
-### FORA DO ESCOPO
-- Lista clara do que **não está incluído** na proposta.
-
-### PREMISSAS
-- Condições e expectativas que devem ser garantidas para execução correta do projeto.
-
-### VALIDADE DA PROPOSTA
-- Prazo de validade da proposta conforme a oportunidade.
-
-### ACEITE DA PROPOSTA
-- Orientações sobre como formalizar o aceite (pedido de compra ou e-mail de concordância).
-
+{template_text}
 ---
 
 ### Orientações Importantes:
@@ -161,63 +145,381 @@ Use exatamente as seguintes seções e títulos:
 **Agora prossiga gerando a proposta técnica conforme o template e instruções acima.**
 
 """
-    response = client.chat.completions.create(
-        model=provider.model,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=10000,
-        temperature=0.3,
-    )
-    content = response.choices[0].message.content
-    # Extrair seções usando headings '###' no início da linha
-    parts = re.split(r"^###\s+", content, flags=re.MULTILINE)
-    sections = {}
-    for part in parts[1:]:  # pular conteudo antes do primeiro ###
-        part = part.strip()
-        if not part:
-            continue
-        lines = part.splitlines()
-        heading = lines[0].strip()
-        body = "\n".join(lines[1:]).strip() if len(lines) > 1 else ""
-        sections[heading] = body
-    # Salvar dados
+    return prompt
+
+def _section_specs() -> dict:
+    specs = {}
+    for title, instructions, inputs in PROPOSTA_SECTIONS:
+        key = title.strip()
+        previous_instructions, previous_inputs = specs.get(key, ([], ()))
+        specs[key] = (previous_instructions + [instructions], tuple(dict.fromkeys(previous_inputs + inputs)))
+    return specs
+
+# Chave em dados_json -> (instruções, partes do contexto)
+SECTION_SPECS = _section_specs()
+SECTION_CONTEXT_LABELS = [
+    ("nome", "Nome da RFP"), ("arquivos", "Arquivos Anexados"), ("resumo", "Resumo IA"),
+    ("vendor", "Fabricante Selecionado"), ("bom", "Itens de BoM"), ("escopos", "Escopo de Serviços"),
+]
+
+def _section_inputs(ctx: dict, key: str) -> dict:
+    values = {"nome": ctx["nome"]}
+    for name in SECTION_SPECS[key][1]:
+        if name == "rfp":
+            values["resumo"] = ctx["resumo"]
+        else:
+            values[name] = ctx[name]
+    return values
+
+# Hash das entradas da seção (contexto usado + instruções): se mudar, a seção está desatualizada
+def section_input_hash(ctx: dict, key: str) -> str:
+    payload = json.dumps({
+        "versao": PROPOSTA_SECTION_PROMPT_VERSION,
+        "secao": key,
+        "instrucoes": SECTION_SPECS[key][0],
+        "entradas": _section_inputs(ctx, key),
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def section_meta(ctx: dict, keys) -> dict:
+    now = datetime.datetime.utcnow().isoformat()
+    return {key: {"input_hash": section_input_hash(ctx, key), "gerada_em": now} for key in keys if key in SECTION_SPECS}
+
+def stale_sections(ctx: dict, meta: dict) -> list:
+    meta = meta or {}
+    return [key for key in SECTION_SPECS if (meta.get(key) or {}).get("input_hash") != section_input_hash(ctx, key)]
+
+def build_section_prompt(ctx: dict, key: str) -> str:
+    values = _section_inputs(ctx, key)
+    context = "\n".join(f"- {label}:\n{values[name]}" for name, label in SECTION_CONTEXT_LABELS if name in values)
+    instructions = "\n".join(SECTION_SPECS[key][0])
+    return f"""
+Você é um consultor técnico de pré-vendas sênior, especializado em elaborar propostas técnicas para projetos de infraestrutura, redes e segurança da informação.
+
+Contexto da RFP:
+
+{context}
+
+---
+
+Escreva somente a seção "{key}" da proposta técnica, seguindo estas instruções:
+
+{instructions}
+
+### Orientações Importantes:
+
+- Use linguagem técnica, consultiva e organizada.
+- Caso alguma informação esteja ausente no contexto, sinalize "Informação não disponível — sugerir alinhamento com o cliente."
+- Use Markdown, sem repetir o título da seção.
+- Evite explicações adicionais fora da seção solicitada.
+"""
+
+def _generate_section(provider: AIProvider, ctx: dict, key: str, cache: str) -> str:
+    content = complete(
+        provider,
+        [{"role": "user", "content": build_section_prompt(ctx, key)}],
+        max_tokens=PROPOSTA_SECTION_MAX_TOKENS,
+        temperature=PROPOSTA_TEMPERATURE,
+        cache=cache,
+    ).strip()
+    # Alguns modelos repetem o título mesmo assim
+    return re.sub(r"^#{1,6}\s*" + re.escape(key) + r"\s*\n", "", content, flags=re.IGNORECASE).strip()
+
+# Gera as seções em paralelo; retorna ({seção: texto}, {seção: erro})
+def generate_sections(provider: AIProvider, ctx: dict, keys: list, cache: str) -> tuple:
+    sections, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(PROPOSTA_SECTION_CONCURRENCY, len(keys)))) as pool:
+        futures = {pool.submit(bind_scope(_generate_section), provider, ctx, key, cache): key for key in keys}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                sections[key] = fut.result()
+            except Exception as e:
+                logger.warning("Falha ao gerar a seção %s da proposta", key, exc_info=True)
+                errors[key] = str(e)
+    return sections, errors
+
+# Extrai seções usando headings '###' no início da linha; as seções ficam disponíveis
+# assim que o heading seguinte chega, o que permite emiti-las durante o streaming
+class SectionStreamParser:
+    def __init__(self):
+        self.sections = {}
+        self._buffer = ""
+        self._heading = None
+        self._lines = []
+
+    def feed(self, text: str) -> list:
+        self._buffer += text
+        completed = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            completed.extend(self._feed_line(line))
+        # Um novo heading começou a chegar: a seção anterior já está completa
+        if re.match(r"^###\s", self._buffer):
+            completed.extend(self._close_section())
+        return completed
+
+    def finish(self) -> list:
+        completed = []
+        if self._buffer:
+            completed.extend(self._feed_line(self._buffer))
+            self._buffer = ""
+        completed.extend(self._close_section())
+        return completed
+
+    def _feed_line(self, line: str) -> list:
+        match = re.match(r"^###\s+(.*)", line)
+        if match:
+            completed = self._close_section()
+            self._heading = match.group(1).strip()
+            self._lines = []
+            return completed
+        if self._heading is not None:  # pular conteudo antes do primeiro ###
+            self._lines.append(line)
+        return []
+
+    def _close_section(self) -> list:
+        if self._heading is None:
+            return []
+        heading, body = self._heading, "\n".join(self._lines).strip()
+        self._heading = None
+        self._lines = []
+        if not heading:
+            return []
+        self.sections[heading] = body
+        return [(heading, body)]
+
+def parse_sections(content: str) -> dict:
+    parser = SectionStreamParser()
+    parser.feed(content)
+    parser.finish()
+    return parser.sections
+
+def save_proposta_sections(db: Session, rfp_id: int, sections: dict, meta: dict = None):
     obj = db.query(Proposta).filter(Proposta.rfp_id == rfp_id).first()
     if obj:
         obj.dados_json = sections
+        obj.secoes_meta = meta
     else:
-        obj = Proposta(rfp_id=rfp_id, dados_json=sections)
+        obj = Proposta(rfp_id=rfp_id, dados_json=sections, secoes_meta=meta)
         db.add(obj)
     db.commit()
+
+# Atualiza só as seções informadas; as demais (inclusive edições manuais) ficam como estão
+def merge_proposta_sections(db: Session, rfp_id: int, sections: dict, meta: dict) -> dict:
+    obj = db.query(Proposta).filter(Proposta.rfp_id == rfp_id).with_for_update().first()
+    if not obj:
+        obj = Proposta(rfp_id=rfp_id)
+        db.add(obj)
+    merged = {**(obj.dados_json or {}), **sections}
+    order = {key: i for i, key in enumerate(SECTION_SPECS)}
+    obj.dados_json = dict(sorted(merged.items(), key=lambda item: order.get(item[0], len(order))))
+    obj.secoes_meta = {**(obj.secoes_meta or {}), **meta}
+    db.commit()
+    return obj.dados_json
+
+@router.post("/rfp/{rfp_id}/gerar")
+def gerar_proposta_tecnica(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or not rfp.resumo_ia:
+        raise HTTPException(status_code=404, detail="RFP não encontrada ou sem resumo IA")
+    ctx = load_proposta_context(db, rfp)
+    prompt = build_proposta_prompt(ctx)
+    with usage_scope("proposta_tecnica", user_id=current_user.id, rfp_id=rfp_id):
+        content = complete(
+            provider,
+            [{"role": "user", "content": prompt}],
+            max_tokens=PROPOSTA_MAX_TOKENS,
+            temperature=PROPOSTA_TEMPERATURE,
+            cache=cache,
+        )
+    sections = parse_sections(content)
+    # Salvar dados
+    save_proposta_sections(db, rfp_id, sections, section_meta(ctx, sections))
     return sections
 
+def _save_stream_sections(rfp_id: int, sections: dict, meta: dict):
+    with SessionLocal() as db:
+        save_proposta_sections(db, rfp_id, sections, meta)
+
+# Variante em streaming (SSE): relaya os tokens e emite cada seção '###' assim que termina
+@router.post("/rfp/{rfp_id}/gerar/stream")
+async def gerar_proposta_tecnica_stream(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider)):
+    rfp = await run_in_threadpool(lambda: db.query(RFP).filter(RFP.id == rfp_id).first())
+    if not rfp or not rfp.resumo_ia:
+        raise HTTPException(status_code=404, detail="RFP não encontrada ou sem resumo IA")
+    ctx = await run_in_threadpool(load_proposta_context, db, rfp)
+    prompt = build_proposta_prompt(ctx)
+    scope = {"operation": "proposta_tecnica", "user_id": current_user.id, "rfp_id": rfp_id}
+    # Stream não é repetido em outro provedor: escolhe o primeiro saudável pela política da operação
+    provider = await run_in_threadpool(pick_provider, provider, scope["operation"])
+    model = await run_in_threadpool(enforce_budget, provider.model, scope)
+    client = get_async_client(provider)
+
+    async def events():
+        stream = None
+        parser = SectionStreamParser()
+        messages = [{"role": "user", "content": prompt}]
+        usage, status, started = {}, "error", None
+        reserved = estimate_tokens(messages, PROPOSTA_MAX_TOKENS)
+
+        # Espera a vez no limite de taxa do provedor; 429/5xx antes do primeiro token são repetidos
+        async def create():
+            nonlocal started
+            started = time.monotonic()
+            return await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=PROPOSTA_MAX_TOKENS,
+                temperature=PROPOSTA_TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+        try:
+            stream = await governed_async(provider, reserved, create)
+            async for delta in iter_completion_deltas(stream, usage):
+                yield sse_event("token", {"delta": delta})
+                for heading, body in parser.feed(delta):
+                    yield sse_event("section", {"heading": heading, "body": body})
+            status = "ok"
+            for heading, body in parser.finish():
+                yield sse_event("section", {"heading": heading, "body": body})
+            record_health(provider, scope["operation"], time.monotonic() - started)
+            await run_in_threadpool(_save_stream_sections, rfp_id, parser.sections, section_meta(ctx, parser.sections))
+            yield sse_event("done", parser.sections)
+        except Exception as e:
+            logger.error("Falha na geração em streaming da proposta da RFP %s", rfp_id, exc_info=True)
+            if started is not None and is_failover_error(e):
+                record_health(provider, scope["operation"], time.monotonic() - started, e)
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            # Em desconexão do cliente a tarefa é cancelada e a chamada ao provedor é abortada
+            await close_upstream(stream)
+            if started is not None:
+                await record_stream_usage(provider, model, PROPOSTA_MAX_TOKENS, int((time.monotonic() - started) * 1000), usage, status, scope, reserved)
+
+    return sse_response(events())
+
+class SecoesGerarRequest(BaseModel):
+    secoes: Optional[List[str]] = None
+    desatualizadas: bool = False
+
+# Estado de cada seção: desatualizada quando o hash das entradas mudou (ou nunca foi registrado)
+@router.get("/rfp/{rfp_id}/secoes")
+def list_secoes_proposta(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp:
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    obj = db.query(Proposta).filter(Proposta.rfp_id == rfp_id).first()
+    dados = (obj.dados_json if obj else None) or {}
+    meta = (obj.secoes_meta if obj else None) or {}
+    ctx = load_proposta_context(db, rfp)
+    return [
+        {
+            "secao": key,
+            "gerada": key in dados,
+            "gerada_em": (meta.get(key) or {}).get("gerada_em"),
+            "input_hash": (meta.get(key) or {}).get("input_hash"),
+            "desatualizada": (meta.get(key) or {}).get("input_hash") != section_input_hash(ctx, key),
+        }
+        for key in SECTION_SPECS
+    ]
+
+# Regenera só as seções escolhidas (e/ou as desatualizadas), em paralelo, sem tocar nas demais
+@router.post("/rfp/{rfp_id}/secoes/gerar")
+def gerar_secoes_proposta(rfp_id: int, data: SecoesGerarRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or not rfp.resumo_ia:
+        raise HTTPException(status_code=404, detail="RFP não encontrada ou sem resumo IA")
+    if not data.secoes and not data.desatualizadas:
+        raise HTTPException(status_code=400, detail="Informe as seções ou desatualizadas=true")
+    keys = [key.strip() for key in data.secoes or []]
+    invalid = [key for key in keys if key not in SECTION_SPECS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Seção inválida: {', '.join(invalid)}")
+    ctx = load_proposta_context(db, rfp)
+    obj = db.query(Proposta).filter(Proposta.rfp_id == rfp_id).first()
+    if data.desatualizadas:
+        keys += stale_sections(ctx, obj.secoes_meta if obj else None)
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return (obj.dados_json if obj else None) or {}
+    # Libera a conexão durante as chamadas à LLM
+    db.rollback()
+    with usage_scope("proposta_secoes", user_id=current_user.id, rfp_id=rfp_id):
+        # Cota já estourada: recusa antes de disparar as seções
+        enforce_budget(provider.model)
+        sections, errors = generate_sections(provider, ctx, keys, cache)
+    merged = merge_proposta_sections(db, rfp_id, sections, section_meta(ctx, sections)) if sections else None
+    if errors:
+        saved = f" Seções salvas: {', '.join(sections)}." if sections else ""
+        raise HTTPException(status_code=502, detail=f"Falha ao gerar: {', '.join(errors)}.{saved}")
+    return merged
+
 @router.get("/rfp/{rfp_id}/download")
-def download_proposta_tecnica(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def download_proposta_tecnica(request: Request, rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     # busca proposta e dados
     obj = db.query(Proposta).filter(Proposta.rfp_id == rfp_id).first()
     if not obj or not obj.dados_json:
         raise HTTPException(status_code=404, detail="Proposta não encontrada. Gere antes via IA.")
-    raw_sections = obj.dados_json
-    # normaliza chaves para jinja
-    def normalize_key(key: str) -> str:
-        nk = unicodedata.normalize('NFKD', key)
-        nk = nk.encode('ASCII', 'ignore').decode('ASCII')
-        return re.sub(r"\W+", "_", nk).strip("_").upper()
-    sections = {normalize_key(k): v for k, v in raw_sections.items()}
-    logger.debug("Sections normalized for Jinja: %s", list(sections.keys()))
-    template_path = os.path.join(os.path.dirname(__file__), "..", "templates", "proposta_template.docx")
     try:
-        tpl = DocxTemplate(template_path)
-        # renderiza e salva buffer
-        tpl.render(sections)
-        logger.debug("Docx rendered successfully")
-        buffer = io.BytesIO()
-        tpl.save(buffer)
+        # Template compilado uma vez; proposta sem alterações vem direto do cache de renders
+        path, key = render_docx(obj.dados_json)
     except Exception as e:
         logger.error("Falha ao gerar docx", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro ao gerar proposta docx: {e}")
-    buffer.seek(0)
     filename = f"proposta_tecnica_rfp_{rfp_id}.docx"
-    return StreamingResponse(
-        buffer,
+    return file_response(
+        request, path, filename, key,
         media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+class PropostaExportRequest(BaseModel):
+    rfp_ids: Optional[List[int]] = None
+    status: Optional[List[str]] = None
+    owner: Optional[int] = None
+    updated_from: Optional[datetime.datetime] = None
+    updated_to: Optional[datetime.datetime] = None
+    formato: Literal["docx", "pdf", "docx+pdf"] = "docx"
+
+# Export em lote: renderiza as propostas num pool de processos e devolve um ZIP em streaming,
+# com cada arquivo adicionado assim que fica pronto
+@router.post("/export")
+def export_propostas_tecnicas(data: PropostaExportRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    formats = tuple(data.formato.split("+"))
+    if "pdf" in formats and not pdf_available():
+        raise HTTPException(status_code=400, detail="Conversão para PDF indisponível (WeasyPrint não instalado)")
+    if data.rfp_ids is None and not (data.status or data.owner is not None or data.updated_from or data.updated_to):
+        raise HTTPException(status_code=400, detail="Informe rfp_ids ou ao menos um filtro")
+    query = (
+        db.query(RFP.id, RFP.nome, Proposta.dados_json)
+        .join(Proposta, Proposta.rfp_id == RFP.id)
+        .filter(Proposta.dados_json.isnot(None))
+    )
+    if current_user.perfil != 'admin':
+        query = query.filter(RFP.user_id == current_user.id)
+    if data.rfp_ids is not None:
+        query = query.filter(RFP.id.in_(data.rfp_ids))
+    if data.owner is not None:
+        query = query.filter(RFP.user_id == data.owner)
+    if data.status:
+        query = query.filter(RFP.status.in_(data.status))
+    if data.updated_from is not None:
+        query = query.filter(RFP.updated_at >= data.updated_from)
+    if data.updated_to is not None:
+        query = query.filter(RFP.updated_at < data.updated_to)
+    rows = query.order_by(RFP.id, Proposta.id).limit(EXPORT_MAX_RFPS + 1).all()
+    if len(rows) > EXPORT_MAX_RFPS:
+        raise HTTPException(status_code=400, detail=f"Export limitado a {EXPORT_MAX_RFPS} propostas")
+    if not rows:
+        raise HTTPException(status_code=404, detail="Nenhuma proposta encontrada")
+    items = {}
+    for rfp_id, nome, dados in rows:
+        if dados:
+            items.setdefault(rfp_id, (rfp_id, f"Proposta Técnica - {nome}", dados))
+    return StreamingResponse(
+        stream_proposals_zip(list(items.values()), formats),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="propostas_tecnicas.zip"'},
     )
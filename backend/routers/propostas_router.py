@@ -3,8 +3,8 @@ from sqlalchemy.orm import Session
 from typing import List, Optional, Any
 from models import Proposta, User, RFP
 from auth import get_db, get_current_user
+import storage
 from pydantic import BaseModel
-import os
 import shutil
 
 class PropostaCreate(BaseModel):
@@ -29,7 +29,8 @@ def create_proposta(rfp_id: int, proposta: PropostaCreate, db: Session = Depends
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp:
         raise HTTPException(status_code=404, detail="RFP não encontrada")
-    new_proposta = Proposta(rfp_id=rfp_id, **proposta.dict())
+    # Arquivos só entram pelos endpoints de upload (são referências do armazenamento)
+    new_proposta = Proposta(rfp_id=rfp_id, **proposta.dict(exclude={'arquivo_pdf', 'arquivo_docx'}))
     db.add(new_proposta)
     db.commit()
     db.refresh(new_proposta)
@@ -47,7 +48,7 @@ def update_proposta(proposta_id: int, proposta_update: PropostaUpdate, db: Sessi
     proposta = db.query(Proposta).filter(Proposta.id == proposta_id).first()
     if not proposta:
         raise HTTPException(status_code=404, detail="Proposta não encontrada")
-    for field, value in proposta_update.dict(exclude_unset=True).items():
+    for field, value in proposta_update.dict(exclude_unset=True, exclude={'arquivo_pdf', 'arquivo_docx'}).items():
         setattr(proposta, field, value)
     db.commit()
     db.refresh(proposta)
@@ -58,8 +59,10 @@ def delete_proposta(proposta_id: int, db: Session = Depends(get_db), current_use
     proposta = db.query(Proposta).filter(Proposta.id == proposta_id).first()
     if not proposta:
         raise HTTPException(status_code=404, detail="Proposta não encontrada")
+    blobs = [storage.release(db, proposta.arquivo_pdf), storage.release(db, proposta.arquivo_docx)]
     db.delete(proposta)
     db.commit()
+    storage.purge_unreferenced_blobs(db, blobs)
     return {"ok": True}
 
 @router.post("/item/{proposta_id}/upload_pdf")
@@ -67,27 +70,29 @@ def upload_proposta_pdf(proposta_id: int, file: UploadFile = File(...), db: Sess
     proposta = db.query(Proposta).filter(Proposta.id == proposta_id).first()
     if not proposta:
         raise HTTPException(status_code=404, detail="Proposta não encontrada")
-    upload_dir = "uploaded_propostas"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, f"proposta_{proposta_id}_{file.filename}")
+    file_path = storage.staging_path(file.filename)
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-    proposta.arquivo_pdf = file_path
+    # O arquivo anterior perde a referência; conteúdo repetido vira o mesmo blob
+    old = storage.release(db, proposta.arquivo_pdf)
+    proposta.arquivo_pdf = storage.store(db, file_path)
     db.commit()
     db.refresh(proposta)
-    return {"msg": "Arquivo PDF enviado com sucesso", "arquivo_pdf": file_path}
+    storage.purge_unreferenced_blobs(db, [old])
+    return {"msg": "Arquivo PDF enviado com sucesso", "arquivo_pdf": proposta.arquivo_pdf}
 
 @router.post("/item/{proposta_id}/upload_docx")
 def upload_proposta_docx(proposta_id: int, file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     proposta = db.query(Proposta).filter(Proposta.id == proposta_id).first()
     if not proposta:
         raise HTTPException(status_code=404, detail="Proposta não encontrada")
-    upload_dir = "uploaded_propostas"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, f"proposta_{proposta_id}_{file.filename}")
+    file_path = storage.staging_path(file.filename)
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-    proposta.arquivo_docx = file_path
+    # O arquivo anterior perde a referência; conteúdo repetido vira o mesmo blob
+    old = storage.release(db, proposta.arquivo_docx)
+    proposta.arquivo_docx = storage.store(db, file_path)
     db.commit()
     db.refresh(proposta)
-    return {"msg": "Arquivo DOCX enviado com sucesso", "arquivo_docx": file_path}
+    storage.purge_unreferenced_blobs(db, [old])
+    return {"msg": "Arquivo DOCX enviado com sucesso", "arquivo_docx": proposta.arquivo_docx}
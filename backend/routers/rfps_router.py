@@ -1,20 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response, Request
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response, Request, Query, BackgroundTasks
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select, tuple_, delete
 from sqlalchemy.orm import Session
-from typing import List
-from auth import get_db, get_current_user
-from models import RFP, User, Vendor, AIProvider, RFPFile
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from auth import get_db, get_async_db, get_current_user
+from models import RFP, User, Vendor, AIProvider, RFPFile, FileUpload
 from routers.ai_providers_router import get_selected_provider
-from openai import OpenAI
+from routers.analysis_jobs_router import AnalysisJobOut
+from analysis_jobs import enqueue_analysis
+from extraction import purge_orphan_texts, ensure_content_hash
+import storage
+from rfp_analysis import prepare_analysis_messages, save_rfp_analysis, ANALYSIS_MAX_TOKENS, ANALYSIS_TEMPERATURE
+from database import SessionLocal
+from sse import sse_event, sse_response, close_upstream, iter_completion_deltas
+from profiling import run_in_threadpool
+from llm_clients import get_async_client
+from llm import complete, llm_cache_mode
+from usage import usage_scope, enforce_budget, record_stream_usage
+from routing import pick_provider, record_health, is_failover_error
+from ratelimit import governed_async, estimate_tokens
+from vendor_index import reindex_vendor, top_vendors
+from uploads import (
+    UPLOAD_CHUNK_SIZE, UPLOAD_MAX_CHUNK, UPLOAD_MAX_SIZE, UPLOAD_EXPIRE_HOURS, ChunkTooLarge,
+    new_upload_path, create_upload_file, remove_upload_file, hasher_at, store_hasher, drop_hasher, final_hash, write_stream,
+)
+import logging
 import os
-import uuid
+import json
+import base64
+import hashlib
 import datetime
-import shutil
+import time
 from pydantic import BaseModel
-from docx import Document
-from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
 
 # Initialize router for RFP endpoints
 router = APIRouter(prefix="/rfps", tags=["RFPs"])
@@ -39,6 +61,40 @@ class RFPOut(BaseModel):
     class Config:
         orm_mode = True
 
+# Listagem leve: resumo_ia e analise_vendors só vêm quando pedidos em `fields`
+class RFPListItem(BaseModel):
+    id: int
+    nome: str
+    status: str
+    user_id: int | None = None
+    arquivo_url: str | None = None
+    fabricante_escolhido_id: int | None = None
+    created_at: datetime.datetime | None = None
+    updated_at: datetime.datetime | None = None
+    resumo_ia: str | None = None
+    analise_vendors: str | None = None
+
+class RFPPage(BaseModel):
+    items: List[RFPListItem]
+    next_cursor: str | None = None
+
+RFP_LIST_COLUMNS = [RFP.id, RFP.nome, RFP.status, RFP.user_id, RFP.arquivo_url, RFP.fabricante_escolhido_id, RFP.created_at, RFP.updated_at]
+RFP_LARGE_FIELDS = {"resumo_ia": RFP.resumo_ia, "analise_vendors": RFP.analise_vendors}
+RFP_PAGE_DEFAULT = 50
+RFP_PAGE_MAX = 200
+
+def encode_rfp_cursor(updated_at: datetime.datetime, rfp_id: int) -> str:
+    raw = json.dumps([updated_at.isoformat(), rfp_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_rfp_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, rfp_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(updated_at), int(rfp_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 class VendorMatchSave(BaseModel):
     analise: str
 
@@ -64,7 +120,7 @@ class VendorOut(BaseModel):
         orm_mode = True
 
 @router.post("/vendors", response_model=VendorOut)
-def create_vendor(vendor: VendorCreate, db: Session = Depends(get_db)):
+def create_vendor(vendor: VendorCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     v = Vendor(
         nome=vendor.nome,
         tecnologias=vendor.tecnologias,
@@ -75,11 +131,13 @@ def create_vendor(vendor: VendorCreate, db: Session = Depends(get_db)):
     db.add(v)
     db.commit()
     db.refresh(v)
+    background_tasks.add_task(reindex_vendor, v.id)
     return v
 
 @router.get("/vendors", response_model=List[VendorOut])
-def list_vendors(db: Session = Depends(get_db)):
-    return db.query(Vendor).all()
+async def list_vendors(db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(Vendor))
+    return result.scalars().all()
 
 @router.post("/{rfp_id}/save-vendor-analysis")
 def save_vendor_analysis(rfp_id: int, data: VendorMatchSave, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -93,7 +151,7 @@ def save_vendor_analysis(rfp_id: int, data: VendorMatchSave, db: Session = Depen
     return {"msg": "Análise dos vendors salva com sucesso"}
 
 @router.get("/{rfp_id}/vendors-matching")
-def match_vendors_to_rfp(rfp_id: int, db: Session = Depends(get_db), provider: AIProvider = Depends(get_selected_provider)):
+def match_vendors_to_rfp(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp or not rfp.resumo_ia:
         raise HTTPException(status_code=404, detail="RFP não encontrada ou sem análise IA")
@@ -101,6 +159,8 @@ def match_vendors_to_rfp(rfp_id: int, db: Session = Depends(get_db), provider: A
     vendors = db.query(Vendor).all()
     if not vendors:
         return JSONResponse(content=[])
+    # Só os vendors mais próximos do resumo (por embeddings) vão para a LLM
+    vendors = top_vendors(db, provider, rfp.resumo_ia, vendors)
 
     # Preparar contexto para IA
     vendors_info = "\n".join([
@@ -118,22 +178,21 @@ def match_vendors_to_rfp(rfp_id: int, db: Session = Depends(get_db), provider: A
         "\n\nResponda apenas com o JSON solicitado, sem comentários extras."
     )
 
-    # Instantiate client with selected provider
-    client = OpenAI(api_key=provider.api_key)
-    # Chamada à LLM configurada
-    response = client.chat.completions.create(
-        model=provider.model,
-        messages=[
-            {"role": "system", "content": "Você é um consultor técnico de pré-vendas."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=4096,
-        temperature=0.2
-    )
+    # Chamada à LLM configurada (respostas repetidas vêm do cache compartilhado)
+    with usage_scope("match_vendors", user_id=current_user.id, rfp_id=rfp_id):
+        ai_content = complete(
+            provider,
+            [
+                {"role": "system", "content": "Você é um consultor técnico de pré-vendas."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=4096,
+            temperature=0.2,
+            cache=cache,
+        )
     import json
     # Extrair JSON da resposta
     import re as regex
-    ai_content = response.choices[0].message.content
     # Extrai o primeiro bloco JSON da resposta
     json_match = regex.search(r'\[.*\]', ai_content, regex.DOTALL)
     if json_match:
@@ -159,67 +218,43 @@ def set_fabricante_escolhido(rfp_id: int, data: FabricanteEscolhidoUpdate, db: S
     db.refresh(rfp)
     return {"msg": "Fabricante escolhido atualizado com sucesso"}
 
-def match_vendors_to_rfp(rfp_id: int, db: Session = Depends(get_db)):
-    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
-    if not rfp or not rfp.resumo_ia:
-        raise HTTPException(status_code=404, detail="RFP não encontrada ou sem análise IA")
-
-    vendors = db.query(Vendor).all()
-    if not vendors:
-        return JSONResponse(content=[])
-
-    # Preparar contexto para IA
-    vendors_info = "\n".join([
-        f"Vendor: {v.nome}\nTecnologias: {v.tecnologias}\nProdutos: {v.produtos}\nCertificacoes: {v.certificacoes}\nRequisitos_Atendidos: {v.requisitos_atendidos}"
-        for v in vendors
-    ])
-    prompt = (
-        "Você é um consultor técnico especializado em pré-vendas. Receberá abaixo o resumo de uma RFP e uma lista de vendors/fabricantes com suas características.\n"
-        "Avalie, para cada vendor, o nível de aderência aos requisitos da RFP.\n"
-        "Para cada vendor, atribua uma pontuação de 0 a 10 e explique resumidamente o motivo da nota, indicando requisitos atendidos e não atendidos.\n"
-        "Responda em JSON, com o seguinte formato:\n"
-        "[{'vendor': <nome>, 'score': <0-10>, 'motivo': <texto explicativo>}, ...]\n"
-        "\nResumo da RFP:\n" + rfp.resumo_ia +
-        "\n\nVendors:\n" + vendors_info +
-        "\n\nResponda apenas com o JSON solicitado, sem comentários extras."
-    )
-
-    # Chamada à OpenAI
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Você é um consultor técnico de pré-vendas."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=4096,
-        temperature=0.2
-    )
-    import json
-    # Extrair JSON da resposta
-    import re as regex
-    ai_content = response.choices[0].message.content
-    # Extrai o primeiro bloco JSON da resposta
-    json_match = regex.search(r'\[.*\]', ai_content, regex.DOTALL)
-    if json_match:
-        try:
-            result = json.loads(json_match.group(0))
-            # Enriquecer cada item com vendor_id
-            for item in result:
-                vendor_obj = next((v for v in vendors if v.nome == item.get("vendor")), None)
-                if vendor_obj:
-                    item["vendor_id"] = vendor_obj.id
-            return JSONResponse(content=result)
-        except Exception:
-            pass
-    return JSONResponse(content={"erro": "Falha ao processar resposta da IA", "raw": ai_content})
-
-@router.get("/", response_model=List[RFPOut])
-def list_rfps(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if current_user.perfil == 'admin':
-        rfps = db.query(RFP).all()
-    else:
-        rfps = db.query(RFP).filter(RFP.user_id == current_user.id).all()
-    return rfps
+# Listagem paginada por cursor em (updated_at, id), das mais recentes para as mais antigas
+@router.get("/", response_model=RFPPage, response_model_exclude_unset=True)
+async def list_rfps(
+    cursor: Optional[str] = None,
+    limit: int = Query(RFP_PAGE_DEFAULT, ge=1, le=RFP_PAGE_MAX),
+    status: Optional[List[str]] = Query(None),
+    owner: Optional[int] = None,
+    updated_from: Optional[datetime.datetime] = None,
+    updated_to: Optional[datetime.datetime] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    extra = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    invalid = [f for f in extra if f not in RFP_LARGE_FIELDS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Campo inválido: {', '.join(invalid)}")
+    query = select(*RFP_LIST_COLUMNS, *[RFP_LARGE_FIELDS[f] for f in extra])
+    if current_user.perfil != 'admin':
+        query = query.where(RFP.user_id == current_user.id)
+    if owner is not None:
+        query = query.where(RFP.user_id == owner)
+    if status:
+        query = query.where(RFP.status.in_(status))
+    if updated_from is not None:
+        query = query.where(RFP.updated_at >= updated_from)
+    if updated_to is not None:
+        query = query.where(RFP.updated_at < updated_to)
+    if cursor:
+        query = query.where(tuple_(RFP.updated_at, RFP.id) < tuple_(*decode_rfp_cursor(cursor)))
+    query = query.order_by(RFP.updated_at.desc(), RFP.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rfp_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+    return {"items": [dict(row) for row in rows], "next_cursor": next_cursor}
 
 @router.post("/", response_model=RFPOut)
 def create_rfp(rfp: RFPCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -256,13 +291,18 @@ def delete_rfp(rfp_id: int, db: Session = Depends(get_db), current_user: User =
         raise HTTPException(status_code=404, detail="RFP não encontrada")
     if current_user.perfil != 'admin':
         raise HTTPException(status_code=403, detail="Apenas administradores podem remover RFPs")
+    hashes = [f.content_hash for f in rfp.files]
+    blobs = [storage.release(db, f.filepath) for f in rfp.files] + [storage.release(db, rfp.arquivo_url)]
+    partial = [path for (path,) in db.query(FileUpload.filepath).filter(FileUpload.rfp_id == rfp_id)]
     db.delete(rfp)
     db.commit()
+    for path in partial:
+        remove_upload_file(path)
+    storage.purge_unreferenced_blobs(db, blobs)
+    purge_orphan_texts(db, hashes)
     return {"ok": True}
 
 # --- NOVOS ENDPOINTS ---
-import shutil
-import os
 
 class RFPFileOut(BaseModel):
     id: int
@@ -273,11 +313,13 @@ class RFPFileOut(BaseModel):
 
 @router.get("/{rfp_id}/files", response_model=List[RFPFileOut])
 @router.get("/{rfp_id}/list", response_model=List[RFPFileOut], include_in_schema=False)
-def list_rfp_files(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+async def list_rfp_files(rfp_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    rfp = await db.get(RFP, rfp_id)
     if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
         raise HTTPException(status_code=404, detail="RFP não encontrada")
-    return rfp.files
+    # Lazy load não funciona em sessão assíncrona: consulta os arquivos explicitamente
+    result = await db.execute(select(RFPFile).where(RFPFile.rfp_id == rfp_id).order_by(RFPFile.id))
+    return result.scalars().all()
 
 @router.post("/{rfp_id}/upload", response_model=RFPFileOut)
 @router.post("/{rfp_id}/files", response_model=RFPFileOut)
@@ -285,33 +327,157 @@ def upload_rfp_file_item(rfp_id: int, file: UploadFile = File(...), db: Session
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
         raise HTTPException(status_code=404, detail="RFP não encontrada")
-    upload_dir = "uploaded_rfps"
-    os.makedirs(upload_dir, exist_ok=True)
-    unique_name = f"{rfp_id}_{uuid.uuid4().hex}_{file.filename}"
-    file_path = os.path.join(upload_dir, unique_name)
+    file_path = storage.staging_path(file.filename)
     file.file.seek(0)
+    # Copia calculando o SHA-256: chave do blob e do cache de texto extraído
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    new_file = RFPFile(rfp_id=rfp_id, filename=file.filename, filepath=file_path)
+        for chunk in iter(lambda: file.file.read(storage.HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            buffer.write(chunk)
+    locator = storage.store(db, file_path, digest.hexdigest())
+    new_file = RFPFile(rfp_id=rfp_id, filename=file.filename, filepath=locator, content_hash=digest.hexdigest())
     db.add(new_file)
     db.commit()
     db.refresh(new_file)
     return new_file
 
+# --- Upload em partes (retomável): init -> PUT das partes por offset -> commit ---
+
+class FileUploadInit(BaseModel):
+    filename: str
+    size: int
+
+class FileUploadCommit(BaseModel):
+    sha256: Optional[str] = None
+
+class FileUploadOut(BaseModel):
+    id: str
+    filename: str
+    size: int
+    offset: int
+    chunk_size: int
+
+def _upload_out(upload: FileUpload) -> dict:
+    return {"id": upload.id, "filename": upload.filename, "size": upload.size, "offset": upload.received, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+async def _get_owned_rfp(db: AsyncSession, rfp_id: int, current_user: User) -> RFP:
+    rfp = await db.get(RFP, rfp_id)
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    return rfp
+
+async def _get_upload(db: AsyncSession, rfp_id: int, upload_id: str, current_user: User, lock: bool = False) -> FileUpload:
+    await _get_owned_rfp(db, rfp_id, current_user)
+    upload = await db.get(FileUpload, upload_id, with_for_update=lock)
+    if not upload or upload.rfp_id != rfp_id:
+        raise HTTPException(status_code=404, detail="Upload não encontrado")
+    return upload
+
+async def _purge_expired_uploads(db: AsyncSession):
+    limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=UPLOAD_EXPIRE_HOURS)
+    result = await db.execute(delete(FileUpload).where(FileUpload.updated_at < limit).returning(FileUpload.id, FileUpload.filepath))
+    expired = result.all()
+    await db.commit()
+    for upload_id, path in expired:
+        drop_hasher(upload_id)
+        await run_in_threadpool(remove_upload_file, path)
+
+@router.post("/{rfp_id}/files/uploads", response_model=FileUploadOut, status_code=201)
+async def init_file_upload(rfp_id: int, data: FileUploadInit, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    await _get_owned_rfp(db, rfp_id, current_user)
+    if data.size <= 0:
+        raise HTTPException(status_code=400, detail="Tamanho do arquivo inválido")
+    if data.size > UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Arquivo excede o tamanho máximo permitido")
+    await _purge_expired_uploads(db)
+    upload_id, file_path = new_upload_path(rfp_id, data.filename)
+    await run_in_threadpool(create_upload_file, file_path)
+    upload = FileUpload(
+        id=upload_id, rfp_id=rfp_id, user_id=current_user.id,
+        filename=os.path.basename(data.filename), filepath=file_path, size=data.size, received=0,
+    )
+    db.add(upload)
+    await db.commit()
+    return _upload_out(upload)
+
+# Estado do upload: o cliente retoma a partir de `offset`
+@router.get("/{rfp_id}/files/uploads/{upload_id}", response_model=FileUploadOut)
+async def get_file_upload(rfp_id: int, upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    return _upload_out(await _get_upload(db, rfp_id, upload_id, current_user))
+
+# Corpo da requisição = bytes da parte, gravados direto no arquivo final a partir de `offset`
+@router.put("/{rfp_id}/files/uploads/{upload_id}", response_model=FileUploadOut)
+async def upload_file_chunk(rfp_id: int, upload_id: str, request: Request, offset: int = Query(..., ge=0), db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    # Partes do mesmo upload são serializadas: a linha fica travada (FOR UPDATE) até o commit,
+    # e uma parte concorrente só confere o offset depois que a anterior terminar
+    upload = await _get_upload(db, rfp_id, upload_id, current_user, lock=True)
+    if offset != upload.received:
+        raise HTTPException(status_code=409, detail=f"Offset inválido: o upload está em {upload.received}")
+    hasher = hasher_at(upload.id, offset)
+    try:
+        written = await write_stream(upload.filepath, offset, request.stream(), min(UPLOAD_MAX_CHUNK, upload.size - offset), hasher)
+    except ChunkTooLarge:
+        await db.rollback()
+        raise HTTPException(status_code=413, detail="Parte excede o tamanho permitido")
+    upload.received = offset + written
+    await db.commit()
+    store_hasher(upload.id, offset + written, hasher)
+    return _upload_out(upload)
+
+# Commit: o arquivo já completo passa da área de staging para o armazenamento (rename)
+@router.post("/{rfp_id}/files/uploads/{upload_id}/commit", response_model=RFPFileOut)
+def commit_file_upload(rfp_id: int, upload_id: str, data: FileUploadCommit = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    upload = db.query(FileUpload).filter(FileUpload.id == upload_id, FileUpload.rfp_id == rfp_id).first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload não encontrado")
+    if upload.received != upload.size:
+        raise HTTPException(status_code=409, detail=f"Upload incompleto: {upload.received} de {upload.size} bytes recebidos")
+    content_hash = final_hash(upload.id, upload.filepath, upload.size)
+    if data and data.sha256 and data.sha256.lower() != content_hash:
+        raise HTTPException(status_code=422, detail="SHA-256 do arquivo não confere")
+    if db.query(FileUpload).filter(FileUpload.id == upload.id).delete(synchronize_session=False) != 1:
+        raise HTTPException(status_code=404, detail="Upload não encontrado")
+    locator = storage.store(db, upload.filepath, content_hash)
+    new_file = RFPFile(rfp_id=rfp_id, filename=upload.filename, filepath=locator, content_hash=content_hash)
+    db.add(new_file)
+    db.commit()
+    db.refresh(new_file)
+    drop_hasher(upload_id)
+    return new_file
+
+@router.delete("/{rfp_id}/files/uploads/{upload_id}")
+async def abort_file_upload(rfp_id: int, upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    upload = await _get_upload(db, rfp_id, upload_id, current_user)
+    await db.delete(upload)
+    await db.commit()
+    drop_hasher(upload.id)
+    await run_in_threadpool(remove_upload_file, upload.filepath)
+    return {"ok": True}
+
 @router.get("/{rfp_id}/files/{file_id}/download", response_class=FileResponse)
 @router.get("/{rfp_id}/download", response_class=FileResponse)
-def download_rfp_file_item(rfp_id: int, file_id: int = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def download_rfp_file_item(request: Request, rfp_id: int, file_id: int = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     if file_id is None:
         rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
         if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
             raise HTTPException(status_code=404, detail="RFP não encontrada")
         if not rfp.arquivo_url:
             raise HTTPException(status_code=400, detail="Nenhum arquivo enviado para esta RFP")
-        file_path = rfp.arquivo_url
-        if not os.path.isfile(file_path):
+        locator = rfp.arquivo_url
+        if not storage.exists(locator):
             raise HTTPException(status_code=404, detail="Arquivo não encontrado no servidor")
-        filename = os.path.basename(file_path)
-        return FileResponse(path=file_path, filename=filename)
+        if storage.is_blob(locator):
+            # O localizador do blob não guarda o nome: usa o do RFPFile de mesmo conteúdo, se houver
+            content_hash = storage.hash_from_locator(locator)
+            filename = db.query(RFPFile.filename).filter(RFPFile.rfp_id == rfp_id, RFPFile.content_hash == content_hash).limit(1).scalar() or f"rfp_{rfp_id}"
+        else:
+            content_hash = db.query(RFPFile.content_hash).filter(RFPFile.filepath == locator).limit(1).scalar()
+            filename = os.path.basename(locator)
+        return storage.download_response(request, locator, filename, content_hash)
     else:
         file_rec = db.query(RFPFile).filter(RFPFile.id == file_id, RFPFile.rfp_id == rfp_id).first()
         if not file_rec:
@@ -319,7 +485,10 @@ def download_rfp_file_item(rfp_id: int, file_id: int = None, db: Session = Depen
         rfp = file_rec.rfp
         if current_user.perfil != 'admin' and rfp.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="Permissão negada")
-        return FileResponse(path=file_rec.filepath, filename=file_rec.filename)
+        if not storage.exists(file_rec.filepath):
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado no servidor")
+        # Arquivos antigos ganham o hash no primeiro download: ETag forte a partir daí
+        return storage.download_response(request, file_rec.filepath, file_rec.filename, ensure_content_hash(db, file_rec))
 
 @router.delete("/{rfp_id}/files/{file_id}")
 def delete_rfp_file_item(rfp_id: int, file_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -329,110 +498,91 @@ def delete_rfp_file_item(rfp_id: int, file_id: int, db: Session = Depends(get_db
     rfp = file_rec.rfp
     if current_user.perfil != 'admin' and rfp.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Permissão negada")
-    try:
-        os.remove(file_rec.filepath)
-    except OSError:
-        pass
+    content_hash = file_rec.content_hash
+    blob = storage.release(db, file_rec.filepath)
     db.delete(file_rec)
     db.commit()
+    storage.purge_unreferenced_blobs(db, [blob])
+    purge_orphan_texts(db, [content_hash])
     return {"ok": True}
 
-@router.post("/{rfp_id}/analyze")
-def analyze_rfp(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider)):
+@router.post("/{rfp_id}/analyze", response_model=AnalysisJobOut, status_code=202)
+def analyze_rfp(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
     rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
     if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
         raise HTTPException(status_code=404, detail="RFP não encontrada")
     if not getattr(rfp, 'files', None) or len(rfp.files) == 0:
         raise HTTPException(status_code=400, detail="Nenhum arquivo enviado para esta RFP")
-    # Concatenar texto de todos os arquivos
-    text = ""
-    for file_rec in rfp.files:
-        path = file_rec.filepath
-        ext = os.path.splitext(path)[1].lower()
-        content = ""
-        if ext == ".docx":
-            doc = Document(path)
-            content = "\n".join([p.text for p in doc.paragraphs])
-        elif ext == ".pdf":
-            reader = PdfReader(path)
-            content = "\n".join([page.extract_text() or "" for page in reader.pages])
-        else:
-            continue
-        text += f"\n\nConteúdo do arquivo {file_rec.filename}:\n{content}"
-    # Instanciar cliente e chamar LLM para gerar resumo a partir dos múltiplos arquivos
-    client = OpenAI(api_key=provider.api_key)
-    # Chamada à LLM configurada
-    response = client.chat.completions.create(
-        model=provider.model,
-        messages=[
-            {"role": "system", "content": (
-                "Você é um Analista de Pré-Vendas e Comercial Sênior, especializado em analisar RFPs (Request for Proposal). "
-                "Seu objetivo é interpretar documentos de RFP enviados, extrair as informações mais importantes, identificar riscos ou lacunas, "
-                "e apresentar a análise de forma organizada, consultiva e clara em Markdown. "
-                "Use títulos e listas para estruturar o conteúdo. "
-                "Se alguma informação estiver ausente, aponte claramente como 'Informação não fornecida - recomendar esclarecimento'. "
-                "Seja técnico, profissional e objetivo."
-            )},
-            {"role": "user", "content": (
-                "Analise o seguinte conteúdo de RFP, leve em consideração as informações fornecidas em todo o conteúdo da RFP, inclusive anexos ou descrições de especificação técnica, e estruture a resposta em Markdown seguindo rigorosamente este formato, preenchendo TODOS os tópicos, mesmo que a informação não esteja presente (neste caso, escreva 'Informação não fornecida - recomendar esclarecimento').\n"
-                "\n## 1. Identificação Geral\n"
-                "- **Nome do Projeto:** <preencher>\n"
-                "- **Cliente:** <preencher>\n"
-                "- **Número da RFP (se aplicável):** <preencher>\n"
-                "- **Data de Emissão:** <preencher>\n"
-                "- **Data de Entrega da Proposta:** <preencher>\n"
-                "\n## 2. Objetivo do Projeto\n"
-                "- <preencher>\n"
-                "\n## 3. Escopo Técnico\n"
-                "- **Descrição geral do escopo:** <preencher>\n"
-                "- **Tecnologias envolvidas:** <preencher>\n"
-                "- **Quantitativos estimados:** <preencher>\n"
-                "\n## 4. Equipamentos e Serviços Detalhados\n"
-                "Liste os equipamentos e serviços solicitados, preenchendo as tabelas abaixo:\n"
-                "\n### Equipamentos\n"
-                "| Equipamento | Modelo/Descrição | Quantidade | Observações |\n"
-                "|:------------|:------------------|:-----------|:------------|\n"
-                "| <preencher> | <preencher>       | <preencher>| <preencher> |\n"
-                "\n### Serviços\n"
-                "| Serviço | Descrição resumida | Observações |\n"
-                "|:--------|:-------------------|:------------|\n"
-                "| <preencher> | <preencher> | <preencher> |\n"
-                "\n**Nota:** Se algum dado como modelo, quantidade ou descrição técnica não estiver presente, indicar 'Informação não fornecida - recomendar esclarecimento'.\n"
-                "\n## 5. Requisitos Obrigatórios\n"
-                "- <preencher>\n"
-                "\n## 6. Requisitos Desejáveis\n"
-                "- <preencher>\n"
-                "\n## 7. Critérios de Qualificação\n"
-                "- <preencher>\n"
-                "\n## 8. Modelo de Precificação\n"
-                "- **Forma de precificação exigida:** <preencher>\n"
-                "- **Tipo de contrato:** <preencher>\n"
-                "\n## 9. Entregáveis Esperados\n"
-                "- <preencher>\n"
-                "\n## 10. Prazos e Condições\n"
-                "- **Prazos de execução:** <preencher>\n"
-                "- **Condições comerciais relevantes:** <preencher>\n"
-                "\n## 11. Riscos Identificados\n"
-                "- <preencher>\n"
-                "\n## 12. Perguntas ou Pontos a Esclarecer\n"
-                "- <preencher>\n"
-                "\n---\n"
-                "**DICAS DE FORMATAÇÃO:**\n"
-                "- Use sempre listas ou tópicos para respostas longas.\n"
-                "- Nunca deixe um item sem resposta (caso contrário, escreva 'Informação não fornecida - recomendar esclarecimento').\n"
-                "- Use negrito para títulos internos dos tópicos.\n"
-                "- Separe visualmente os tópicos com linhas em branco.\n"
-                "- Respeite o layout Markdown para garantir legibilidade, mesmo para textos extensos.\n"
-                f"\n\nConteúdo da RFP:\n{text}"
-            )}
-        ],
-        max_tokens=10000,
-        temperature=0.3
-    )
-    resumo = response.choices[0].message.content
-    # Salvar o resumo IA no banco e atualizar status
-    rfp.resumo_ia = resumo
-    rfp.status = "Análise IA"
-    db.commit()
-    db.refresh(rfp)
-    return {"resumo": resumo}
+    # A análise roda na fila de jobs; o cliente acompanha via /analysis_jobs/{id}
+    return enqueue_analysis(db, rfp, current_user, provider, cache)
+
+def _prepare_for_stream(rfp_id: int, provider_id: int, scope: dict, cache: str) -> list:
+    with SessionLocal() as db, usage_scope(**scope):
+        rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+        provider = db.query(AIProvider).filter(AIProvider.id == provider_id).first()
+        return prepare_analysis_messages(db, rfp, provider, cache=cache)
+
+def _save_stream_result(rfp_id: int, resumo: str):
+    with SessionLocal() as db:
+        rfp = db.query(RFP).filter(RFP.id == rfp_id).first()
+        if rfp:
+            save_rfp_analysis(db, rfp, resumo)
+
+# Variante em streaming (SSE): os tokens chegam ao cliente conforme o provedor gera
+@router.post("/{rfp_id}/analyze/stream")
+async def analyze_rfp_stream(rfp_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), provider: AIProvider = Depends(get_selected_provider), cache: str = Depends(llm_cache_mode)):
+    rfp = await run_in_threadpool(lambda: db.query(RFP).filter(RFP.id == rfp_id).first())
+    if not rfp or (current_user.perfil != 'admin' and rfp.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="RFP não encontrada")
+    if not await run_in_threadpool(lambda: len(rfp.files)):
+        raise HTTPException(status_code=400, detail="Nenhum arquivo enviado para esta RFP")
+    scope = {"operation": "analise_rfp", "user_id": current_user.id, "rfp_id": rfp_id}
+    # Stream não é repetido em outro provedor: escolhe o primeiro saudável pela política da operação
+    provider = await run_in_threadpool(pick_provider, provider, scope["operation"])
+    model = await run_in_threadpool(enforce_budget, provider.model, scope)
+    client, provider_id = get_async_client(provider), provider.id
+
+    async def events():
+        stream = None
+        parts = []
+        usage, call_status, started, reserved = {}, "error", None, 0
+
+        # Espera a vez no limite de taxa do provedor; 429/5xx antes do primeiro token são repetidos
+        async def create(messages):
+            nonlocal started
+            started = time.monotonic()
+            return await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=ANALYSIS_MAX_TOKENS,
+                temperature=ANALYSIS_TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+        try:
+            yield sse_event("status", {"stage": "Extraindo texto dos arquivos"})
+            messages = await run_in_threadpool(_prepare_for_stream, rfp_id, provider_id, scope, cache)
+            yield sse_event("status", {"stage": "Aguardando resposta da IA"})
+            reserved = estimate_tokens(messages, ANALYSIS_MAX_TOKENS)
+            stream = await governed_async(provider, reserved, lambda: create(messages))
+            async for delta in iter_completion_deltas(stream, usage):
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+            call_status = "ok"
+            record_health(provider, scope["operation"], time.monotonic() - started)
+            resumo = "".join(parts)
+            await run_in_threadpool(_save_stream_result, rfp_id, resumo)
+            yield sse_event("done", {"resumo": resumo})
+        except Exception as e:
+            logger.error("Falha na análise em streaming da RFP %s", rfp_id, exc_info=True)
+            if started is not None and is_failover_error(e):
+                record_health(provider, scope["operation"], time.monotonic() - started, e)
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            # Em desconexão do cliente a tarefa é cancelada e a chamada ao provedor é abortada
+            await close_upstream(stream)
+            if started is not None:
+                await record_stream_usage(provider, model, ANALYSIS_MAX_TOKENS, int((time.monotonic() - started) * 1000), usage, call_status, scope, reserved)
+
+    return sse_response(events())
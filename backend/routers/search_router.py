@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import BaseModel
+import datetime
+from auth import get_async_db, get_current_user
+from models import User
+from search import search_query, render_snippet, SEARCH_TYPES, SEARCH_PAGE_DEFAULT, SEARCH_PAGE_MAX
+
+router = APIRouter(prefix="/search", tags=["Busca"])
+
+class SearchHit(BaseModel):
+    tipo: str  # rfp, arquivo, escopo ou proposta
+    id: int  # id do item do tipo (RFP, RFPFile, EscopoServico ou Proposta)
+    rfp_id: int
+    rfp_nome: str
+    rfp_status: str
+    rfp_created_at: datetime.datetime | None = None
+    titulo: str
+    rank: float
+    snippet: str | None = None  # HTML escapado, termos encontrados em <mark>
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_offset: int | None = None
+
+# Busca textual em RFPs (nome e resumo), texto extraído dos arquivos, escopo de serviço e propostas.
+# q aceita a sintaxe de buscadores: "frase exata", OR, -termo
+@router.get("/", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=2, max_length=500),
+    tipo: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    limit: int = Query(SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    invalid = [t for t in tipo or [] if t not in SEARCH_TYPES]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Tipo inválido: {', '.join(invalid)}")
+    # Uma linha a mais indica se há próxima página
+    query = search_query(q, current_user, tipo, status, created_from, created_to, limit + 1, offset)
+    rows = (await db.execute(query)).mappings().all()
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    items = [
+        {**row, "id": row["item_id"], "rank": round(row["rank"], 6), "snippet": render_snippet(row["snippet"])}
+        for row in rows
+    ]
+    return {"items": items, "next_offset": next_offset}
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from models import Vendor, User
-from auth import get_db, get_current_user
+from auth import get_db, get_async_db, get_current_user
+from vendor_index import reindex_vendor
 from pydantic import BaseModel
 
 class VendorCreate(BaseModel):
@@ -34,18 +37,19 @@ class VendorOut(BaseModel):
 router = APIRouter(prefix="/vendors", tags=["vendors"])
 
 @router.get("/", response_model=List[VendorOut])
-def list_vendors(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    vendors = db.query(Vendor).all()
-    return vendors
+async def list_vendors(db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    result = await db.execute(select(Vendor))
+    return result.scalars().all()
 
 @router.post("/", response_model=VendorOut)
-def create_vendor(vendor: VendorCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def create_vendor(vendor: VendorCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Excluir campos não mapeados no modelo (contato, observacoes)
     payload = vendor.dict(exclude_unset=True, exclude={'contato', 'observacoes'})
     new_vendor = Vendor(**payload)
     db.add(new_vendor)
     db.commit()
     db.refresh(new_vendor)
+    background_tasks.add_task(reindex_vendor, new_vendor.id)
     return new_vendor
 
 @router.get("/{vendor_id}", response_model=VendorOut)
@@ -56,7 +60,7 @@ def get_vendor(vendor_id: int, db: Session = Depends(get_db), current_user: User
     return vendor
 
 @router.put("/{vendor_id}", response_model=VendorOut)
-def update_vendor(vendor_id: int, vendor_update: VendorUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def update_vendor(vendor_id: int, vendor_update: VendorUpdate, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     vendor = db.query(Vendor).filter(Vendor.id == vendor_id).first()
     if not vendor:
         raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
@@ -65,6 +69,7 @@ def update_vendor(vendor_id: int, vendor_update: VendorUpdate, db: Session = Dep
         setattr(vendor, field, value)
     db.commit()
     db.refresh(vendor)
+    background_tasks.add_task(reindex_vendor, vendor.id)
     return vendor
 
 @router.delete("/{vendor_id}")
@@ -0,0 +1,262 @@
+import os
+import time
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from cache import TTLCache, invalidate_on_write
+from database import SessionLocal
+from models import AIProvider, LLMRoutingPolicy
+from usage import bind_scope, current_scope
+from metrics import LLM_FAILOVERS, LLM_HEDGES
+from ratelimit import RateLimitTimeout
+
+logger = logging.getLogger(__name__)
+
+# Saúde dos provedores, medida por processo (cada worker com a sua) nas chamadas roteadas
+LLM_HEALTH_WINDOW = int(os.getenv('LLM_HEALTH_WINDOW', '200'))
+LLM_HEALTH_WINDOW_SECONDS = float(os.getenv('LLM_HEALTH_WINDOW_SECONDS', '900'))
+# Provedor fica indisponível (só é tentado por último) por LLM_UNHEALTHY_COOLDOWN segundos após
+# N falhas seguidas ou taxa de erro acima do limite na janela
+LLM_UNHEALTHY_CONSECUTIVE = int(os.getenv('LLM_UNHEALTHY_CONSECUTIVE', '3'))
+LLM_UNHEALTHY_ERROR_RATE = float(os.getenv('LLM_UNHEALTHY_ERROR_RATE', '0.5'))
+LLM_UNHEALTHY_MIN_SAMPLES = int(os.getenv('LLM_UNHEALTHY_MIN_SAMPLES', '5'))
+LLM_UNHEALTHY_COOLDOWN = float(os.getenv('LLM_UNHEALTHY_COOLDOWN', '30'))
+# Hedging: espera o p95 da operação no provedor (com amostras suficientes) ou o padrão
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_DEFAULT_MS = int(os.getenv('LLM_HEDGE_DEFAULT_MS', '30000'))
+LLM_HEDGE_MIN_MS = int(os.getenv('LLM_HEDGE_MIN_MS', '1000'))
+LLM_HEDGE_WORKERS = int(os.getenv('LLM_HEDGE_WORKERS', '16'))
+ROUTING_CACHE_TTL = float(os.getenv('ROUTING_CACHE_TTL', '30'))
+
+# Erros do provedor (e não da requisição) que justificam tentar outro
+FAILOVER_STATUS = (401, 403, 404, 408, 409, 429)
+
+def is_failover_error(exc: BaseException) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, RateLimitTimeout)):  # inclui timeout e fila do limite de taxa
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in FAILOVER_STATUS or exc.status_code >= 500
+    return False
+
+class ProviderHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=LLM_HEALTH_WINDOW)  # (instante, segundos, ok, operação)
+        self.consecutive_failures = 0
+        self.unavailable_until = 0.0
+        self.last_error = None
+
+    def _recent(self):
+        cutoff = time.monotonic() - LLM_HEALTH_WINDOW_SECONDS
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return self._samples
+
+    def observe(self, seconds: float, ok: bool, operation: str = None, error: str = None):
+        with self._lock:
+            now = time.monotonic()
+            self._samples.append((now, seconds, ok, operation))
+            if ok:
+                self.consecutive_failures = 0
+                self.unavailable_until = 0.0
+                return
+            self.consecutive_failures += 1
+            self.last_error = error
+            samples = self._recent()
+            errors = sum(1 for sample in samples if not sample[2])
+            if self.consecutive_failures >= LLM_UNHEALTHY_CONSECUTIVE or \
+                    (len(samples) >= LLM_UNHEALTHY_MIN_SAMPLES and errors / len(samples) >= LLM_UNHEALTHY_ERROR_RATE):
+                self.unavailable_until = now + LLM_UNHEALTHY_COOLDOWN
+
+    # Passado o cooldown volta a ser tentado; nova falha com a taxa de erro alta o afasta de novo
+    def available(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+    # Percentil da latência das chamadas bem-sucedidas (da operação, se houver amostras suficientes)
+    def latency_percentile(self, q: float, operation: str = None, min_samples: int = 1):
+        with self._lock:
+            samples = self._recent()
+            latencies = [s[1] for s in samples if s[2] and s[3] == operation] if operation else []
+            if len(latencies) < min_samples:
+                latencies = [s[1] for s in samples if s[2]]
+        if len(latencies) < min_samples or not latencies:
+            return None
+        latencies.sort()
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = list(self._recent())
+            consecutive, until, last_error = self.consecutive_failures, self.unavailable_until, self.last_error
+        errors = sum(1 for sample in samples if not sample[2])
+        p50, p95 = self.latency_percentile(0.5), self.latency_percentile(0.95)
+        return {
+            "samples": len(samples),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 4) if samples else None,
+            "p50_ms": int(p50 * 1000) if p50 is not None else None,
+            "p95_ms": int(p95 * 1000) if p95 is not None else None,
+            "available": time.monotonic() >= until,
+            "unavailable_for_s": max(0, round(until - time.monotonic(), 1)),
+            "consecutive_failures": consecutive,
+            "last_error": last_error,
+        }
+
+_health_lock = threading.Lock()
+_health = {}  # provider_id -> ProviderHealth
+
+def health_of(provider_id: int) -> ProviderHealth:
+    with _health_lock:
+        health = _health.get(provider_id)
+        if health is None:
+            health = _health[provider_id] = ProviderHealth()
+        return health
+
+def record_health(provider: AIProvider, operation: str, seconds: float, error: BaseException = None):
+    health_of(provider.id).observe(seconds, error is None, operation, f"{type(error).__name__}: {error}"[:300] if error else None)
+
+# --- Políticas ---
+
+POLICY_FIELDS = ("operation", "provider_ids", "failover", "hedge", "hedge_delay_ms", "max_attempts")
+# Sem política 'default' cadastrada, só o provedor selecionado é usado (failover é opt-in do admin)
+DEFAULT_POLICY = {"operation": "default", "provider_ids": None, "failover": False, "hedge": False, "hedge_delay_ms": None, "max_attempts": 3}
+
+# Políticas e provedores cadastrados; limpo a cada escrita (inclusive em outros workers)
+routing_cache = TTLCache('llm_routing', ROUTING_CACHE_TTL)
+invalidate_on_write(LLMRoutingPolicy, 'llm_routing')
+invalidate_on_write(AIProvider, 'llm_routing')
+
+def _load_routing() -> dict:
+    with SessionLocal() as db:
+        policies = {
+            policy.operation: {field: getattr(policy, field) for field in POLICY_FIELDS}
+            for policy in db.query(LLMRoutingPolicy).all()
+        }
+        providers = db.query(AIProvider).order_by(AIProvider.id).all()
+        for provider in providers:
+            db.expunge(provider)
+    return {"policies": policies, "providers": providers}
+
+# Política da operação: a de maior prefixo em comum (ex.: 'analise' vale para 'analise_map'), senão 'default'
+def policy_for(operation: str, policies: dict) -> dict:
+    if operation:
+        matches = [name for name in policies if name != "default" and operation.startswith(name)]
+        if matches:
+            return policies[max(matches, key=len)]
+    return policies.get("default", DEFAULT_POLICY)
+
+# Provedores a tentar, em ordem: os da política (ou o selecionado seguido dos demais),
+# com os indisponíveis por último
+def candidates(primary: AIProvider, policy: dict, providers: list) -> list:
+    by_id = {provider.id: provider for provider in providers}
+    by_id[primary.id] = primary
+    if policy["provider_ids"]:
+        ordered = [by_id[provider_id] for provider_id in policy["provider_ids"] if provider_id in by_id] or [primary]
+    else:
+        ordered = [primary] + [provider for provider in providers if provider.id != primary.id]
+    if not policy["failover"] and not policy["hedge"]:
+        return ordered[:1]
+    ordered.sort(key=lambda provider: not health_of(provider.id).available())
+    return ordered[:max(1, policy["max_attempts"] or 1)]
+
+def _routing_for(primary: AIProvider, operation: str) -> tuple:
+    routing = routing_cache.get('routing', _load_routing)
+    policy = policy_for(operation, routing["policies"])
+    return policy, candidates(primary, policy, routing["providers"])
+
+# Provedor para uma chamada que não pode ser repetida (streaming): o primeiro candidato saudável
+def pick_provider(primary: AIProvider, operation: str) -> AIProvider:
+    return _routing_for(primary, operation)[1][0]
+
+# --- Execução ---
+
+_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+def _attempt(provider: AIProvider, model: str, operation: str, call):
+    started = time.monotonic()
+    try:
+        result = call(provider, model)
+    except Exception as e:
+        # Erros da requisição (ex.: 400) não contam contra o provedor
+        if is_failover_error(e):
+            record_health(provider, operation, time.monotonic() - started, e)
+        raise
+    record_health(provider, operation, time.monotonic() - started)
+    return result
+
+def hedge_delay(policy: dict, provider: AIProvider, operation: str) -> float:
+    if policy["hedge_delay_ms"]:
+        return policy["hedge_delay_ms"] / 1000
+    p95 = health_of(provider.id).latency_percentile(0.95, operation, LLM_HEDGE_MIN_SAMPLES)
+    if p95 is None:
+        return LLM_HEDGE_DEFAULT_MS / 1000
+    return max(p95, LLM_HEDGE_MIN_MS / 1000)
+
+# Dispara no 1º provedor e, se não responder em hedge_delay, também no seguinte; vale a primeira
+# resposta. A chamada perdedora não é cancelada (o cliente síncrono não permite): termina em
+# segundo plano e seu uso é registrado normalmente no ledger.
+def _hedged(providers: list, policy: dict, operation: str, model_for, call):
+    queue = list(providers)
+    running = {}
+
+    def launch():
+        provider = queue.pop(0)
+        running[_executor.submit(bind_scope(_attempt), provider, model_for(provider), operation, call)] = provider
+
+    launch()
+    done, _ = wait(running, timeout=hedge_delay(policy, providers[0], operation))
+    hedged = not done and bool(queue)
+    if hedged:
+        logger.info("Provedor %s sem resposta após o p95; disparando também em %s", providers[0].name, queue[0].name)
+        launch()
+    error = failed = None
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            provider = running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                error, failed = e, provider
+                continue
+            if hedged:
+                LLM_HEDGES.labels(operation or "", "primario" if provider is providers[0] else "alternativo").inc()
+            return result
+        if not running and queue and policy["failover"] and is_failover_error(error):
+            LLM_FAILOVERS.labels(operation or "", failed.name, queue[0].name).inc()
+            launch()
+    raise error
+
+# Executa call(provider, model) conforme a política da operação atual (escopo de uso):
+# failover para o próximo provedor em 429/5xx/timeout e, se configurado, hedging.
+# O modelo informado (já ajustado pelas cotas) vale para o provedor primário; os demais usam o próprio.
+def route(primary: AIProvider, model: str, call):
+    operation = current_scope().get("operation")
+    policy, providers = _routing_for(primary, operation)
+
+    def model_for(provider: AIProvider) -> str:
+        return model if provider.id == primary.id else provider.model
+
+    if policy["hedge"] and len(providers) > 1:
+        return _hedged(providers, policy, operation, model_for, call)
+    error = None
+    for i, provider in enumerate(providers):
+        if error is not None:
+            logger.warning("Falha no provedor %s (%s); tentando %s", providers[i - 1].name, error, provider.name)
+            LLM_FAILOVERS.labels(operation or "", providers[i - 1].name, provider.name).inc()
+        try:
+            return _attempt(provider, model_for(provider), operation, call)
+        except Exception as e:
+            if not is_failover_error(e):
+                raise
+            error = e
+    raise error
+
+def health_snapshot() -> list:
+    routing = routing_cache.get('routing', _load_routing)
+    return [
+        {"provider_id": provider.id, "name": provider.name, "model": provider.model, "is_selected": provider.is_selected, **health_of(provider.id).snapshot()}
+        for provider in routing["providers"]
+    ]
@@ -0,0 +1,95 @@
+"""
+Benchmark: extração serial (loop antigo do analyze_rfp) x pool de processos (extraction.extract_files_parallel)
+
+Uso (a partir de backend/):
+    python scripts/benchmark_extraction.py --files 12 --pages 120 --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from extraction import extract_file_text, extract_files_parallel
+
+LINES_PER_PAGE = 45
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+# Gera um PDF simples (Helvetica, texto em várias linhas por página) sem dependências externas
+def write_pdf(path: str, pages: int, seed: int):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # /Pages, preenchido depois
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [
+            f"Edital {seed} pagina {page + 1} item {line}: fornecimento de switches, access points e licencas SD-WAN"
+            for line in range(LINES_PER_PAGE)
+        ]
+        stream = "BT /F1 9 Tf 40 800 Td 12 TL " + " ".join(f"({_pdf_escape(l)}) '" for l in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+def serial(paths):
+    return [extract_file_text(p) for p in paths]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"edital_{i}.pdf")
+            write_pdf(path, args.pages, i)
+            paths.append(path)
+        size_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+        print(f"Corpus: {args.files} PDFs x {args.pages} páginas ({size_mb:.1f} MB), workers={args.workers}")
+
+        timings = {}
+        outputs = {}
+        for name, fn in (("serial", serial), ("paralelo", lambda p: extract_files_parallel(p, workers=args.workers))):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                outputs[name] = fn(paths)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+            print(f"{name:>9}: {best:.2f}s (melhor de {args.repeat})")
+
+        assert outputs["serial"] == outputs["paralelo"], "Textos divergentes entre serial e paralelo"
+        print(f"Speedup: {timings['serial'] / timings['paralelo']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Migração dos arquivos antigos (uploaded_rfps/, uploaded_propostas/) para o armazenamento
+deduplicado (storage.py): recalcula o SHA-256 de cada arquivo, grava um blob por conteúdo,
+atualiza RFPFile.filepath / RFP.arquivo_url / Proposta.arquivo_* e remove o original.
+
+Uso (a partir de backend/):
+    python scripts/migrate_storage.py --dry-run
+    python scripts/migrate_storage.py [--keep-originals] [--recount]
+"""
+import os
+import sys
+import argparse
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import func
+from database import SessionLocal
+from models import RFP, RFPFile, Proposta, Blob
+import storage
+
+logger = logging.getLogger("migrate_storage")
+
+def _migrate(db, path: str, dry_run: bool, keep_originals: bool, stats: dict):
+    if not os.path.isfile(path):
+        logger.warning("Arquivo não encontrado, mantido como está: %s", path)
+        stats["missing"] += 1
+        return None, None
+    content_hash = storage.file_sha256(path)
+    stats["files"] += 1
+    stats["bytes"] += os.path.getsize(path)
+    if content_hash not in stats["seen"]:
+        stats["seen"].add(content_hash)
+        stats["unique_bytes"] += os.path.getsize(path)
+    if dry_run:
+        return None, content_hash
+    locator = storage.store(db, path, content_hash, move=False)
+    return locator, content_hash
+
+# RFP.arquivo_url (upload único antigo) é mais uma referência ao blob do mesmo conteúdo
+def _rewrite_rfp_urls(db, original: str, content_hash: str):
+    for rfp in db.query(RFP).filter(RFP.arquivo_url == original):
+        rfp.arquivo_url = storage.store(db, original, content_hash, move=False)
+        logger.info("RFP %s (arquivo_url): %s -> %s", rfp.id, original, rfp.arquivo_url)
+
+def migrate_rfp_files(db, args, stats):
+    for file_rec in db.query(RFPFile).order_by(RFPFile.id).all():
+        if storage.is_blob(file_rec.filepath):
+            continue
+        original = file_rec.filepath
+        locator, content_hash = _migrate(db, original, args.dry_run, args.keep_originals, stats)
+        if content_hash and file_rec.content_hash and file_rec.content_hash != content_hash:
+            logger.warning("Hash divergente em RFPFile %s (%s): atualizado", file_rec.id, original)
+        if locator:
+            file_rec.filepath = locator
+            file_rec.content_hash = content_hash
+            _rewrite_rfp_urls(db, original, content_hash)
+            db.commit()
+            if not args.keep_originals:
+                os.remove(original)
+            logger.info("RFPFile %s: %s -> %s", file_rec.id, original, locator)
+
+# arquivo_url sem RFPFile correspondente
+def migrate_rfp_urls(db, args, stats):
+    for rfp in db.query(RFP).filter(RFP.arquivo_url.isnot(None)).order_by(RFP.id).all():
+        original = rfp.arquivo_url
+        if storage.is_blob(original):
+            continue
+        locator, _ = _migrate(db, original, args.dry_run, args.keep_originals, stats)
+        if locator:
+            rfp.arquivo_url = locator
+            db.commit()
+            if not args.keep_originals:
+                os.remove(original)
+            logger.info("RFP %s (arquivo_url): %s -> %s", rfp.id, original, locator)
+
+def migrate_propostas(db, args, stats):
+    for proposta in db.query(Proposta).order_by(Proposta.id).all():
+        for field in ("arquivo_pdf", "arquivo_docx"):
+            original = getattr(proposta, field)
+            if not original or storage.is_blob(original):
+                continue
+            locator, _ = _migrate(db, original, args.dry_run, args.keep_originals, stats)
+            if locator:
+                setattr(proposta, field, locator)
+                db.commit()
+                if not args.keep_originals:
+                    os.remove(original)
+                logger.info("Proposta %s (%s): %s -> %s", proposta.id, field, original, locator)
+
+# Recalcula as contagens de referências a partir das tabelas e remove blobs sem uso
+def recount(db):
+    counts = {}
+    for (locator,) in db.query(RFPFile.filepath):
+        if storage.is_blob(locator):
+            h = storage.hash_from_locator(locator)
+            counts[h] = counts.get(h, 0) + 1
+    for (locator,) in db.query(RFP.arquivo_url):
+        if storage.is_blob(locator):
+            h = storage.hash_from_locator(locator)
+            counts[h] = counts.get(h, 0) + 1
+    for pdf, docx in db.query(Proposta.arquivo_pdf, Proposta.arquivo_docx):
+        for locator in (pdf, docx):
+            if storage.is_blob(locator):
+                h = storage.hash_from_locator(locator)
+                counts[h] = counts.get(h, 0) + 1
+    fixed = 0
+    for blob in db.query(Blob).all():
+        expected = counts.get(blob.content_hash, 0)
+        if blob.refcount != expected:
+            logger.info("Blob %s: refcount %s -> %s", blob.content_hash, blob.refcount, expected)
+            blob.refcount = expected
+            fixed += 1
+    db.commit()
+    # Sem referências não há localizador: os órfãos são procurados no backend atual
+    backend = storage.get_backend()
+    storage.purge_unreferenced_blobs(db, [backend.locator(b) for (b,) in db.query(Blob.content_hash).filter(Blob.refcount <= 0)])
+    return fixed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="só calcula hashes e a economia estimada")
+    parser.add_argument("--keep-originals", action="store_true", help="não apaga os arquivos antigos após migrar")
+    parser.add_argument("--recount", action="store_true", help="recalcula as contagens de referências ao final")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    stats = {"files": 0, "missing": 0, "bytes": 0, "unique_bytes": 0, "seen": set()}
+    db = SessionLocal()
+    try:
+        migrate_rfp_files(db, args, stats)
+        migrate_rfp_urls(db, args, stats)
+        migrate_propostas(db, args, stats)
+        if args.recount and not args.dry_run:
+            print(f"Contagens corrigidas: {recount(db)}")
+        total_blobs = db.query(func.count(Blob.content_hash)).scalar()
+    finally:
+        db.close()
+
+    mb = 1024 * 1024
+    print(f"Arquivos {'analisados' if args.dry_run else 'migrados'}: {stats['files']} ({stats['missing']} ausentes)")
+    print(f"Volume: {stats['bytes'] / mb:.1f} MB -> {stats['unique_bytes'] / mb:.1f} MB em {len(stats['seen'])} conteúdos distintos")
+    print(f"Blobs no armazenamento: {total_blobs}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import html
+import datetime
+from sqlalchemy import select, union_all, literal, literal_column, case, cast, func, true
+from sqlalchemy.dialects.postgresql import JSONB
+from models import RFP, RFPFile, ExtractedText, EscopoServico, Proposta, User
+
+# Busca textual (português) sobre os vetores mantidos por trigger (migração add_search_vectors)
+SEARCH_PAGE_DEFAULT = int(os.getenv('SEARCH_PAGE_DEFAULT', '20'))
+SEARCH_PAGE_MAX = int(os.getenv('SEARCH_PAGE_MAX', '50'))
+SEARCH_TYPES = ("rfp", "arquivo", "escopo", "proposta")
+
+SEARCH_CONFIG = literal_column("'portuguese'::regconfig")
+# Marcadores de controle no ts_headline; o trecho é escapado antes de virar <mark>
+_START, _STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = f'StartSel={_START}, StopSel={_STOP}, MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "'
+# Mesmo limite do vetor de extracted_texts: trechos além dele não casam nem aparecem no destaque
+EXTRACTED_TEXT_SEARCH_CHARS = 1000000
+# Todos os valores string de um JSON, em qualquer nível
+_JSON_STRINGS = literal_column(''''strict $.** ? (@.type() == "string")'::jsonpath''')
+
+def _matches(vector, tsquery):
+    return vector.op("@@")(tsquery)
+
+def _rank(vector, tsquery):
+    # Normalização 32 (rank / (rank + 1)): escala comparável entre as fontes
+    return func.ts_rank_cd(vector, tsquery, 32)
+
+def _hit_sources(tsquery, tipos) -> list:
+    sources = {
+        "rfp": select(
+            literal("rfp").label("tipo"), RFP.id.label("item_id"), RFP.id.label("rfp_id"),
+            RFP.nome.label("titulo"), _rank(RFP.search_vector, tsquery).label("rank"),
+        ).where(_matches(RFP.search_vector, tsquery)),
+        # O texto é compartilhado por conteúdo: cada RFPFile com o mesmo hash é um resultado
+        "arquivo": select(
+            literal("arquivo").label("tipo"), RFPFile.id.label("item_id"), RFPFile.rfp_id.label("rfp_id"),
+            RFPFile.filename.label("titulo"), _rank(ExtractedText.search_vector, tsquery).label("rank"),
+        ).join(ExtractedText, ExtractedText.content_hash == RFPFile.content_hash)
+         .join(RFP, RFP.id == RFPFile.rfp_id)
+         .where(_matches(ExtractedText.search_vector, tsquery)),
+        "escopo": select(
+            literal("escopo").label("tipo"), EscopoServico.id.label("item_id"), EscopoServico.rfp_id.label("rfp_id"),
+            EscopoServico.titulo.label("titulo"), _rank(EscopoServico.search_vector, tsquery).label("rank"),
+        ).join(RFP, RFP.id == EscopoServico.rfp_id)
+         .where(_matches(EscopoServico.search_vector, tsquery)),
+        "proposta": select(
+            literal("proposta").label("tipo"), Proposta.id.label("item_id"), Proposta.rfp_id.label("rfp_id"),
+            literal("Proposta técnica").label("titulo"), _rank(Proposta.search_vector, tsquery).label("rank"),
+        ).join(RFP, RFP.id == Proposta.rfp_id)
+         .where(_matches(Proposta.search_vector, tsquery)),
+    }
+    return [(tipo, sources[tipo]) for tipo in SEARCH_TYPES if tipo in tipos]
+
+# Texto de onde sai o trecho destacado, por tipo (só para as linhas da página)
+def _documents(page) -> dict:
+    json_strings = func.jsonb_path_query(cast(Proposta.dados_json, JSONB), _JSON_STRINGS).table_valued("value").render_derived(name="v")
+    return {
+        "rfp": select(func.concat_ws(" ", RFP.nome, RFP.resumo_ia))
+            .where(RFP.id == page.c.item_id).correlate(page).scalar_subquery(),
+        "arquivo": select(func.left(ExtractedText.text, EXTRACTED_TEXT_SEARCH_CHARS))
+            .join(RFPFile, RFPFile.content_hash == ExtractedText.content_hash)
+            .where(RFPFile.id == page.c.item_id).correlate(page).scalar_subquery(),
+        "escopo": select(func.concat_ws(" ", EscopoServico.titulo, EscopoServico.descricao))
+            .where(EscopoServico.id == page.c.item_id).correlate(page).scalar_subquery(),
+        "proposta": select(func.string_agg(json_strings.c.value.op("#>>")(literal_column("'{}'")), " "))
+            .select_from(Proposta).join(json_strings, true())
+            .where(Proposta.id == page.c.item_id).correlate(page).scalar_subquery(),
+    }
+
+# Resultados de todas as fontes ordenados por relevância; o destaque (ts_headline, caro)
+# é calculado só para a página pedida
+def search_query(q: str, user: User, tipos=None, status=None, date_from: datetime.datetime = None,
+                 date_to: datetime.datetime = None, limit: int = SEARCH_PAGE_DEFAULT, offset: int = 0):
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    selects = []
+    for _, source in _hit_sources(tsquery, tipos or SEARCH_TYPES):
+        if user.perfil != 'admin':
+            source = source.where(RFP.user_id == user.id)
+        if status:
+            source = source.where(RFP.status.in_(status))
+        if date_from is not None:
+            source = source.where(RFP.created_at >= date_from)
+        if date_to is not None:
+            source = source.where(RFP.created_at < date_to)
+        selects.append(source)
+    hits = union_all(*selects).subquery("hits")
+    page = (
+        select(hits)
+        .order_by(hits.c.rank.desc(), hits.c.tipo, hits.c.item_id)
+        .limit(limit).offset(offset)
+        .subquery("page")
+    )
+    documents = _documents(page)
+    document = case(*[(page.c.tipo == tipo, documents[tipo]) for tipo in SEARCH_TYPES])
+    return (
+        select(
+            page.c.tipo, page.c.item_id, page.c.rfp_id, page.c.titulo, page.c.rank,
+            RFP.nome.label("rfp_nome"), RFP.status.label("rfp_status"), RFP.created_at.label("rfp_created_at"),
+            func.ts_headline(SEARCH_CONFIG, document, tsquery, HEADLINE_OPTIONS).label("snippet"),
+        )
+        .join(RFP, RFP.id == page.c.rfp_id)
+        .order_by(page.c.rank.desc(), page.c.tipo, page.c.item_id)
+    )
+
+def render_snippet(snippet: str):
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_START, "<mark>").replace(_STOP, "</mark>")
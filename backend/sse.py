@@ -0,0 +1,39 @@
+import json
+import anyio
+from fastapi.responses import StreamingResponse
+
+# Cabeçalhos para que proxies (nginx/Traefik) não bufferizem o stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+def sse_event(event: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+def sse_response(generator) -> StreamingResponse:
+    return StreamingResponse(generator, media_type="text/event-stream", headers=SSE_HEADERS)
+
+# Fecha o stream do provedor mesmo quando a tarefa foi cancelada (cliente desconectou),
+# o que aborta a requisição HTTP em andamento
+async def close_upstream(stream):
+    if stream is None:
+        return
+    with anyio.CancelScope(shield=True):
+        await stream.close()
+
+# Relaya os tokens de um chat.completions(stream=True) assíncrono; com usage, preenche
+# prompt_tokens/completion_tokens (chunk final de stream_options include_usage) e finish_reason
+async def iter_completion_deltas(stream, usage: dict = None):
+    async for chunk in stream:
+        if usage is not None and getattr(chunk, "usage", None):
+            usage.update(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens)
+        if not chunk.choices:
+            continue
+        if usage is not None and chunk.choices[0].finish_reason:
+            usage["finish_reason"] = chunk.choices[0].finish_reason
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
@@ -0,0 +1,260 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+from sqlalchemy import text, update, delete
+from sqlalchemy.orm import Session
+from fastapi import Request, Response
+from fastapi.responses import RedirectResponse
+from models import Blob
+from downloads import file_response, content_disposition
+
+logger = logging.getLogger(__name__)
+
+# 'local' (blobs em disco, endereçados pelo SHA-256) ou 's3' (qualquer serviço compatível: AWS, MinIO...)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local').lower()
+STORAGE_LOCAL_ROOT = os.getenv('STORAGE_LOCAL_ROOT', 'storage')
+LOCAL_BLOB_DIR = f"{STORAGE_LOCAL_ROOT}/blobs"
+# Arquivos em recebimento; no mesmo disco dos blobs para que o armazenamento seja um rename
+STAGING_DIR = f"{STORAGE_LOCAL_ROOT}/tmp"
+# Cópia local dos blobs do S3 usados na extração de texto; os menos usados saem acima do limite
+CACHE_DIR = f"{STORAGE_LOCAL_ROOT}/cache"
+STORAGE_CACHE_MAX_MB = int(os.getenv('STORAGE_CACHE_MAX_MB', '1024'))
+
+STORAGE_S3_BUCKET = os.getenv('STORAGE_S3_BUCKET', '')
+STORAGE_S3_PREFIX = os.getenv('STORAGE_S3_PREFIX', 'blobs/')
+STORAGE_S3_ENDPOINT_URL = os.getenv('STORAGE_S3_ENDPOINT_URL') or None
+STORAGE_S3_REGION = os.getenv('STORAGE_S3_REGION') or None
+# Downloads do S3 por redirect para URL pré-assinada (o worker não trafega os bytes)
+STORAGE_S3_PRESIGN = os.getenv('STORAGE_S3_PRESIGN', 'true').lower() in ('1', 'true', 'yes')
+STORAGE_S3_PRESIGN_EXPIRES = int(os.getenv('STORAGE_S3_PRESIGN_EXPIRES', '300'))
+
+S3_SCHEME = "s3://"
+# Diretórios dos uploads anteriores ao armazenamento deduplicado
+LEGACY_DIRS = ("uploaded_rfps", "uploaded_propostas")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LocalBlobBackend:
+    def locator(self, content_hash: str) -> str:
+        return f"{LOCAL_BLOB_DIR}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"
+
+    def exists(self, content_hash: str) -> bool:
+        return os.path.isfile(self.locator(content_hash))
+
+    def put(self, src_path: str, content_hash: str, move: bool = True):
+        dest = self.locator(content_hash)
+        if os.path.isfile(dest):
+            if move:
+                os.remove(src_path)
+            return
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        if move:
+            shutil.move(src_path, tmp)
+        else:
+            shutil.copyfile(src_path, tmp)
+        os.replace(tmp, dest)
+
+    def delete(self, content_hash: str):
+        try:
+            os.remove(self.locator(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, content_hash: str) -> str:
+        return self.locator(content_hash)
+
+def _prune_cache(keep: str):
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if path == keep or name.endswith(".tmp"):
+            continue
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat_result.st_mtime, stat_result.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    limit = STORAGE_CACHE_MAX_MB * 1024 * 1024
+    # Remove os menos usados (mtime é atualizado a cada acerto)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+class S3BlobBackend:
+    def __init__(self, bucket: str = STORAGE_S3_BUCKET, prefix: str = STORAGE_S3_PREFIX):
+        import boto3
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=STORAGE_S3_ENDPOINT_URL, region_name=STORAGE_S3_REGION)
+
+    def key(self, content_hash: str) -> str:
+        return f"{self.prefix}{content_hash}"
+
+    def locator(self, content_hash: str) -> str:
+        return f"{S3_SCHEME}{self.bucket}/{self.key(content_hash)}"
+
+    def exists(self, content_hash: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(content_hash))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, src_path: str, content_hash: str, move: bool = True):
+        if not self.exists(content_hash):
+            self.client.upload_file(src_path, self.bucket, self.key(content_hash))
+        if move:
+            os.remove(src_path)
+
+    def delete(self, content_hash: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(content_hash))
+        try:
+            os.remove(os.path.join(CACHE_DIR, content_hash))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, content_hash: str) -> str:
+        path = os.path.join(CACHE_DIR, content_hash)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.client.download_file(self.bucket, self.key(content_hash), tmp)
+        os.replace(tmp, path)
+        _prune_cache(keep=path)
+        return path
+
+    def presigned_url(self, content_hash: str, filename: str, disposition: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(content_hash),
+                "ResponseContentDisposition": content_disposition(filename, disposition),
+            },
+            ExpiresIn=STORAGE_S3_PRESIGN_EXPIRES,
+        )
+
+_backends = {}
+
+def get_backend(name: str = None):
+    name = name or STORAGE_BACKEND
+    if name not in _backends:
+        if name == 'local':
+            _backends[name] = LocalBlobBackend()
+        elif name == 's3':
+            _backends[name] = S3BlobBackend()
+        else:
+            raise RuntimeError(f"STORAGE_BACKEND inválido: {name}")
+    return _backends[name]
+
+# --- Localizadores ---
+# RFPFile.filepath / Proposta.arquivo_* guardam o localizador do blob; caminhos antigos
+# (uploaded_rfps/..., uploaded_propostas/...) continuam válidos até a migração
+
+def is_blob(locator: str) -> bool:
+    return bool(locator) and (locator.startswith(S3_SCHEME) or locator.startswith(LOCAL_BLOB_DIR + "/"))
+
+def _backend_for(locator: str):
+    return get_backend('s3' if locator.startswith(S3_SCHEME) else 'local')
+
+def hash_from_locator(locator: str) -> str:
+    return locator.rsplit("/", 1)[-1]
+
+def staging_path(filename: str = "") -> str:
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    return os.path.join(STAGING_DIR, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+# Caminho no disco local (extração de texto, envio pelo worker)
+def local_path(locator: str) -> str:
+    if not is_blob(locator):
+        return locator
+    return _backend_for(locator).local_path(hash_from_locator(locator))
+
+def exists(locator: str) -> bool:
+    if not is_blob(locator):
+        return os.path.isfile(locator)
+    return _backend_for(locator).exists(hash_from_locator(locator))
+
+# --- Contagem de referências ---
+
+def _lock_blob(db: Session, content_hash: str):
+    # Serializa store/coleta do mesmo conteúdo entre workers até o fim da transação
+    if db.get_bind().dialect.name == 'postgresql':
+        key = int.from_bytes(bytes.fromhex(content_hash[:16]), "big", signed=True)
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": key})
+
+# Armazena o arquivo (uma vez por conteúdo) e soma uma referência; retorna o localizador.
+# Com move=True o arquivo de origem é consumido. O commit fica a cargo de quem chama.
+def store(db: Session, src_path: str, content_hash: str = None, move: bool = True) -> str:
+    content_hash = content_hash or file_sha256(src_path)
+    backend = get_backend()
+    _lock_blob(db, content_hash)
+    result = db.execute(update(Blob).where(Blob.content_hash == content_hash).values(refcount=Blob.refcount + 1))
+    if result.rowcount == 0:
+        db.add(Blob(content_hash=content_hash, size=os.path.getsize(src_path), refcount=1))
+        db.flush()
+    backend.put(src_path, content_hash, move=move)
+    return backend.locator(content_hash)
+
+def _is_legacy(path: str) -> bool:
+    return os.path.dirname(os.path.normpath(path)) in LEGACY_DIRS
+
+# Remove uma referência e retorna o que purge_unreferenced_blobs deve coletar após o commit:
+# o localizador do blob ou, para arquivo antigo (fora do armazenamento deduplicado), o próprio caminho
+def release(db: Session, locator: str):
+    if not locator:
+        return None
+    if not is_blob(locator):
+        return locator if _is_legacy(locator) else None
+    content_hash = hash_from_locator(locator)
+    db.execute(update(Blob).where(Blob.content_hash == content_hash, Blob.refcount > 0).values(refcount=Blob.refcount - 1))
+    return locator
+
+# O blob sem referências é apagado do armazenamento do seu localizador, que pode não ser
+# o STORAGE_BACKEND atual (blobs gravados antes de trocar de backend)
+def purge_unreferenced_blobs(db: Session, locators):
+    for locator in {l for l in locators if l}:
+        if _is_legacy(locator):
+            try:
+                os.remove(locator)
+            except FileNotFoundError:
+                pass
+            continue
+        content_hash = hash_from_locator(locator)
+        _lock_blob(db, content_hash)
+        result = db.execute(delete(Blob).where(Blob.content_hash == content_hash, Blob.refcount <= 0))
+        if result.rowcount:
+            _backend_for(locator).delete(content_hash)
+            logger.info("Blob %s removido (sem referências)", content_hash)
+        db.commit()
+
+# --- Download ---
+
+def download_response(request: Request, locator: str, filename: str, content_hash: str = None, disposition: str = "attachment") -> Response:
+    if locator.startswith(S3_SCHEME) and STORAGE_S3_PRESIGN:
+        backend = _backend_for(locator)
+        return RedirectResponse(backend.presigned_url(hash_from_locator(locator), filename, disposition), status_code=307)
+    return file_response(request, local_path(locator), filename, content_hash, disposition=disposition)
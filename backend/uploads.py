@@ -0,0 +1,105 @@
+import os
+import uuid
+import hashlib
+import threading
+import anyio
+from storage import file_sha256, HASH_CHUNK_SIZE, STAGING_DIR
+
+# Partes são gravadas na área de staging do armazenamento; o commit só renomeia para o blob
+UPLOAD_DIR = STAGING_DIR
+# Tamanho de parte sugerido ao cliente e limites aceitos pelo servidor
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_MAX_CHUNK = int(os.getenv('UPLOAD_MAX_CHUNK', str(64 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))
+# Uploads sem atividade por mais tempo que isso são descartados
+UPLOAD_EXPIRE_HOURS = int(os.getenv('UPLOAD_EXPIRE_HOURS', '24'))
+
+class ChunkTooLarge(Exception):
+    pass
+
+# SHA-256 incremental por upload: (offset confirmado, hasher). Fica em memória; se a parte
+# cair em outro worker (ou após restart), o hash é recalculado a partir do disco no commit
+_lock = threading.Lock()
+_hashers = {}
+
+def new_upload_path(rfp_id: int, filename: str):
+    upload_id = uuid.uuid4().hex
+    return upload_id, os.path.join(UPLOAD_DIR, f"{rfp_id}_{upload_id}_{os.path.basename(filename)}")
+
+def create_upload_file(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+def remove_upload_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def hasher_at(upload_id: str, offset: int):
+    if offset == 0:
+        return hashlib.sha256()
+    with _lock:
+        entry = _hashers.get(upload_id)
+    # Cópia: só substitui o estado salvo se a parte for confirmada
+    return entry[1].copy() if entry and entry[0] == offset else None
+
+def store_hasher(upload_id: str, offset: int, hasher):
+    with _lock:
+        if hasher is None:
+            _hashers.pop(upload_id, None)
+        else:
+            _hashers[upload_id] = (offset, hasher)
+
+def drop_hasher(upload_id: str):
+    with _lock:
+        _hashers.pop(upload_id, None)
+
+def final_hash(upload_id: str, path: str, size: int) -> str:
+    with _lock:
+        entry = _hashers.get(upload_id)
+    if entry and entry[0] == size:
+        return entry[1].hexdigest()
+    return file_sha256(path)
+
+def _write_block(f, block: bytes, hasher):
+    f.write(block)
+    if hasher is not None:
+        hasher.update(block)
+
+def _close_synced(f):
+    # A parte só é confirmada ao cliente depois de persistida
+    try:
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+
+def _open_at(path: str, offset: int):
+    f = open(path, "r+b")
+    f.seek(offset)
+    f.truncate()
+    return f
+
+# Grava o corpo da requisição direto no arquivo final, a partir de offset, em blocos
+# de HASH_CHUNK_SIZE (escrita e hash no threadpool). O chamador serializa as partes do
+# mesmo upload (linha de file_uploads travada). Retorna o número de bytes gravados.
+async def write_stream(path: str, offset: int, stream, limit: int, hasher) -> int:
+    f = await anyio.to_thread.run_sync(_open_at, path, offset)
+    written = 0
+    buffer = bytearray()
+    try:
+        async for data in stream:
+            written += len(data)
+            if written > limit:
+                raise ChunkTooLarge()
+            buffer += data
+            if len(buffer) >= HASH_CHUNK_SIZE:
+                block = bytes(buffer)
+                buffer.clear()
+                await anyio.to_thread.run_sync(_write_block, f, block, hasher)
+        if buffer:
+            await anyio.to_thread.run_sync(_write_block, f, bytes(buffer), hasher)
+    finally:
+        await anyio.to_thread.run_sync(_close_synced, f)
+    return written
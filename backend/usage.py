@@ -0,0 +1,232 @@
+import os
+import json
+import logging
+import datetime
+import contextvars
+import anyio
+from contextlib import contextmanager
+from sqlalchemy import func, or_, case
+from database import SessionLocal
+from models import AIProvider, LLMUsage, LLMBudget
+from metrics import observe_llm
+from profiling import run_tracked
+from ratelimit import settle
+
+logger = logging.getLogger(__name__)
+
+# Preço por 1M de tokens, por modelo: {"gpt-4o": [entrada, saída], ...}; sem preço o custo fica nulo
+LLM_PRICES = json.loads(os.getenv('LLM_PRICES', '{}') or '{}')
+
+BUDGET_SCOPES = ("user", "rfp")
+BUDGET_PERIODS = ("day", "month", "total")
+BUDGET_ACTIONS = ("reject", "downgrade")
+
+class BudgetExceeded(Exception):
+    def __init__(self, budget: LLMBudget):
+        self.budget = budget
+        alvo = "usuário" if budget.scope == "user" else "RFP"
+        periodo = {"day": "diária", "month": "mensal", "total": "total"}[budget.period]
+        super().__init__(f"Cota {periodo} de uso de IA do {alvo} excedida")
+
+# Quem está consumindo (operação, usuário, RFP): definido pelos endpoints/jobs e lido
+# em cada chamada ao provedor. Threads de pools recebem o escopo (e o restante do
+# contexto, como as métricas e o profile da requisição) via bind_scope.
+_scope = contextvars.ContextVar("llm_usage_scope", default={})
+
+def current_scope() -> dict:
+    return _scope.get()
+
+# Escopos aninhados herdam o que não for informado (ex.: operação da etapa map dentro da análise)
+@contextmanager
+def usage_scope(operation: str = None, user_id: int = None, rfp_id: int = None):
+    values = {k: v for k, v in (("operation", operation), ("user_id", user_id), ("rfp_id", rfp_id)) if v is not None}
+    token = _scope.set({**_scope.get(), **values})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+def bind_scope(fn):
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(run_tracked, fn, *args, **kwargs)
+    return run
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int):
+    price = LLM_PRICES.get(model)
+    if not price:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+# Grava uma linha no ledger; falha ao gravar não interrompe a chamada
+def record_usage(provider: AIProvider, model: str, max_tokens: int, prompt_tokens: int = 0, completion_tokens: int = 0,
+                 latency_ms: int = 0, status: str = "ok", finish_reason: str = None, cached: bool = False, scope: dict = None):
+    scope = current_scope() if scope is None else scope
+    if not cached:
+        observe_llm(provider.name, model, scope.get("operation"), status, latency_ms / 1000, prompt_tokens, completion_tokens)
+    try:
+        with SessionLocal() as db:
+            db.add(LLMUsage(
+                operation=scope.get("operation"),
+                provider_id=provider.id,
+                provider=provider.name,
+                model=model,
+                user_id=scope.get("user_id"),
+                rfp_id=scope.get("rfp_id"),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                max_tokens=max_tokens,
+                cost=None if cached else cost_of(model, prompt_tokens, completion_tokens),
+                latency_ms=latency_ms,
+                status=status,
+                finish_reason=finish_reason,
+                cached=cached,
+            ))
+            db.commit()
+    except Exception:
+        logger.warning("Falha ao registrar uso de LLM", exc_info=True)
+
+# Registro de um stream ao final (inclusive em erro ou desconexão do cliente); usage vem de iter_completion_deltas.
+# O acerto da reserva no limite de taxa roda no mesmo escopo protegido contra o cancelamento
+async def record_stream_usage(provider: AIProvider, model: str, max_tokens: int, latency_ms: int, usage: dict, status: str, scope: dict, reserved: int = 0):
+    with anyio.CancelScope(shield=True):
+        used = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        await anyio.to_thread.run_sync(settle, provider, reserved, used)
+        await anyio.to_thread.run_sync(lambda: record_usage(
+            provider, model, max_tokens,
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0,
+            latency_ms=latency_ms,
+            status=status,
+            finish_reason=usage.get("finish_reason"),
+            scope=scope,
+        ))
+
+# --- Cotas ---
+
+def period_start(period: str, now: datetime.datetime = None):
+    now = now or datetime.datetime.utcnow()
+    if period == "day":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "month":
+        return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return None
+
+def budget_consumption(db, budget: LLMBudget, scope_id: int) -> tuple:
+    column = LLMUsage.user_id if budget.scope == "user" else LLMUsage.rfp_id
+    query = db.query(
+        func.coalesce(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens), 0),
+        func.coalesce(func.sum(LLMUsage.cost), 0.0),
+    ).filter(column == scope_id)
+    start = period_start(budget.period)
+    if start is not None:
+        query = query.filter(LLMUsage.created_at >= start)
+    tokens, cost = query.one()
+    return int(tokens), float(cost)
+
+# Cotas aplicáveis ao escopo: a específica (scope_id) substitui a padrão (scope_id nulo) do mesmo período
+def applicable_budgets(db, scope: dict) -> list:
+    targets = {name: scope.get(f"{name}_id") for name in BUDGET_SCOPES}
+    conditions = [
+        (LLMBudget.scope == name) & or_(LLMBudget.scope_id == target_id, LLMBudget.scope_id.is_(None))
+        for name, target_id in targets.items() if target_id is not None
+    ]
+    if not conditions:
+        return []
+    chosen = {}
+    for budget in db.query(LLMBudget).filter(or_(*conditions)).all():
+        slot = (budget.scope, budget.period)
+        if slot not in chosen or budget.scope_id is not None:
+            chosen[slot] = budget
+    return [(budget, targets[budget.scope]) for budget in chosen.values()]
+
+def exceeded_budgets(scope: dict = None) -> list:
+    scope = current_scope() if scope is None else scope
+    exceeded = []
+    with SessionLocal() as db:
+        for budget, scope_id in applicable_budgets(db, scope):
+            tokens, cost = budget_consumption(db, budget, scope_id)
+            if (budget.max_tokens is not None and tokens >= budget.max_tokens) or \
+                    (budget.max_cost is not None and cost >= budget.max_cost):
+                exceeded.append(budget)
+    return exceeded
+
+# Modelo a usar na chamada: o do provedor, ou o modelo de downgrade se uma cota 'downgrade'
+# foi ultrapassada; cota 'reject' (ou downgrade sem modelo) levanta BudgetExceeded
+def enforce_budget(model: str, scope: dict = None) -> str:
+    try:
+        exceeded = exceeded_budgets(scope)
+    except Exception:
+        logger.warning("Falha ao verificar cotas de uso de LLM", exc_info=True)
+        return model
+    for budget in exceeded:
+        if budget.action != "downgrade" or not budget.downgrade_model:
+            raise BudgetExceeded(budget)
+    if exceeded:
+        downgraded = exceeded[0].downgrade_model
+        logger.info("Cota de uso excedida (%s %s); usando o modelo %s", exceeded[0].scope, exceeded[0].period, downgraded)
+        return downgraded
+    return model
+
+# --- Agregados ---
+
+USAGE_GROUPS = {
+    "day": lambda: func.date(LLMUsage.created_at),
+    "user": lambda: LLMUsage.user_id,
+    "rfp": lambda: LLMUsage.rfp_id,
+    "operation": lambda: LLMUsage.operation,
+    "model": lambda: LLMUsage.model,
+    "provider": lambda: LLMUsage.provider_id,
+}
+
+def _count_if(condition):
+    return case((condition, 1), else_=0)
+
+def usage_summary(db, group_by: str, date_from: datetime.datetime = None, date_to: datetime.datetime = None,
+                  user_id: int = None, rfp_id: int = None, operation: str = None) -> list:
+    key = USAGE_GROUPS[group_by]().label("key")
+    query = db.query(
+        key,
+        func.count(LLMUsage.id).label("calls"),
+        func.sum(_count_if(LLMUsage.cached)).label("cached"),
+        func.sum(_count_if(LLMUsage.status == "error")).label("errors"),
+        func.coalesce(func.sum(LLMUsage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(LLMUsage.completion_tokens), 0).label("completion_tokens"),
+        func.sum(LLMUsage.cost).label("cost"),
+        func.avg(LLMUsage.latency_ms).label("avg_latency_ms"),
+        func.max(LLMUsage.latency_ms).label("max_latency_ms"),
+        func.max(LLMUsage.completion_tokens).label("max_completion_tokens"),
+        func.max(LLMUsage.max_tokens).label("max_tokens"),
+        # Respostas cortadas por max_tokens
+        func.sum(_count_if(LLMUsage.finish_reason == "length")).label("truncated"),
+    )
+    if date_from:
+        query = query.filter(LLMUsage.created_at >= date_from)
+    if date_to:
+        query = query.filter(LLMUsage.created_at < date_to)
+    if user_id is not None:
+        query = query.filter(LLMUsage.user_id == user_id)
+    if rfp_id is not None:
+        query = query.filter(LLMUsage.rfp_id == rfp_id)
+    if operation:
+        query = query.filter(LLMUsage.operation == operation)
+    rows = query.group_by(key).order_by(key).all()
+    return [
+        {
+            "key": str(row.key) if group_by == "day" and row.key is not None else row.key,
+            "calls": row.calls,
+            "cached": int(row.cached or 0),
+            "errors": int(row.errors or 0),
+            "prompt_tokens": int(row.prompt_tokens),
+            "completion_tokens": int(row.completion_tokens),
+            "total_tokens": int(row.prompt_tokens) + int(row.completion_tokens),
+            "cost": round(float(row.cost), 6) if row.cost is not None else None,
+            "avg_latency_ms": int(row.avg_latency_ms or 0),
+            "max_latency_ms": row.max_latency_ms,
+            "max_completion_tokens": row.max_completion_tokens,
+            "max_tokens": row.max_tokens,
+            "truncated": int(row.truncated or 0),
+        }
+        for row in rows
+    ]
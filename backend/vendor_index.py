@@ -0,0 +1,163 @@
+import os
+import re
+import math
+import hashlib
+import logging
+import operator
+import unicodedata
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from llm_clients import get_client
+from ratelimit import governed, CHARS_PER_TOKEN
+from models import Vendor, VendorEmbedding, AIProvider
+from database import SessionLocal
+from cache import TTLCache, invalidate_on_write
+
+logger = logging.getLogger(__name__)
+
+# 'openai' usa a API de embeddings do provedor selecionado; 'local' funciona sem rede
+VENDOR_EMBEDDING_BACKEND = os.getenv('VENDOR_EMBEDDING_BACKEND', 'openai').lower()
+VENDOR_EMBEDDING_MODEL = os.getenv('VENDOR_EMBEDDING_MODEL', 'text-embedding-3-small')
+# Quantos vendors mais próximos do resumo da RFP vão para a LLM
+VENDOR_MATCH_TOP_K = int(os.getenv('VENDOR_MATCH_TOP_K', '20'))
+VENDOR_INDEX_TTL = float(os.getenv('VENDOR_INDEX_TTL', '3600'))
+EMBEDDING_BATCH_SIZE = 100
+# Limite de entrada do modelo de embeddings (~8k tokens)
+MAX_EMBEDDING_CHARS = 24000
+LOCAL_EMBEDDING_DIM = 1024
+
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas", "um", "uma",
+    "para", "por", "com", "sem", "que", "se", "ao", "aos", "ou", "the", "and", "of", "for", "to", "in", "with",
+}
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*")
+
+# Vetores de todos os vendors, recarregados quando a tabela vendor_embeddings muda
+index_cache = TTLCache('vendor_index', VENDOR_INDEX_TTL)
+invalidate_on_write(VendorEmbedding, 'vendor_index')
+
+def vendor_profile(vendor: Vendor) -> str:
+    fields = (
+        ("Vendor", vendor.nome),
+        ("Tecnologias", vendor.tecnologias),
+        ("Produtos", vendor.produtos),
+        ("Certificações", vendor.certificacoes),
+        ("Requisitos atendidos", vendor.requisitos_atendidos),
+    )
+    return "\n".join(f"{label}: {value}" for label, value in fields if value)
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _normalize(vector: list) -> list:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+def _dot(a: list, b: list) -> float:
+    return sum(map(operator.mul, a, b))
+
+# --- Backends de embedding ---
+
+def _tokens(text: str) -> list:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in TOKEN_RE.findall(text) if t not in STOPWORDS]
+
+def _hash_embedding(text: str) -> list:
+    # Feature hashing de palavras e bigramas, com peso sublinear (1 + log tf)
+    tokens = _tokens(text)
+    counts = {}
+    for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        counts[feature] = counts.get(feature, 0) + 1
+    vector = [0.0] * LOCAL_EMBEDDING_DIM
+    for feature, count in counts.items():
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        sign = 1.0 if h >> 63 else -1.0
+        vector[h % LOCAL_EMBEDDING_DIM] += sign * (1.0 + math.log(count))
+    return _normalize(vector)
+
+class LocalEmbedder:
+    name = f"local-hash-{LOCAL_EMBEDDING_DIM}"
+
+    def embed(self, texts: list) -> list:
+        return [_hash_embedding(t) for t in texts]
+
+class OpenAIEmbedder:
+    def __init__(self, provider: AIProvider):
+        self.provider = provider
+        self.client = get_client(provider)
+        self.name = f"openai:{VENDOR_EMBEDDING_MODEL}"
+
+    def embed(self, texts: list) -> list:
+        vectors = []
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = [t[:MAX_EMBEDDING_CHARS] or " " for t in texts[i:i + EMBEDDING_BATCH_SIZE]]
+            tokens = sum(len(t) for t in batch) // CHARS_PER_TOKEN + 1
+            response = governed(self.provider, tokens, lambda: self.client.embeddings.create(model=VENDOR_EMBEDDING_MODEL, input=batch))
+            vectors.extend(_normalize(d.embedding) for d in sorted(response.data, key=lambda d: d.index))
+        return vectors
+
+def get_embedder(db: Session, provider: AIProvider = None):
+    if VENDOR_EMBEDDING_BACKEND == 'local':
+        return LocalEmbedder()
+    if provider is None:
+        provider = db.query(AIProvider).filter(AIProvider.is_selected == True).first()
+    if provider is None:
+        raise RuntimeError("Nenhum provedor IA selecionado para gerar embeddings")
+    return OpenAIEmbedder(provider)
+
+# --- Índice ---
+
+def _load_index(db: Session) -> dict:
+    rows = db.query(VendorEmbedding.vendor_id, VendorEmbedding.model, VendorEmbedding.profile_hash, VendorEmbedding.vector).all()
+    return {vendor_id: (model, profile_hash, vector) for vendor_id, model, profile_hash, vector in rows}
+
+# Vetores dos vendors informados; gera (e grava) os que faltam ou cujo perfil/modelo mudou
+def ensure_vendor_vectors(db: Session, vendors: list, embedder) -> dict:
+    index = index_cache.get('all', lambda: _load_index(db))
+    vectors, stale = {}, []
+    for vendor in vendors:
+        profile = vendor_profile(vendor)
+        entry = index.get(vendor.id)
+        if entry and entry[0] == embedder.name and entry[1] == _sha256(profile):
+            vectors[vendor.id] = entry[2]
+        else:
+            stale.append((vendor, profile))
+    if stale:
+        logger.info("Indexando %s vendor(s) com %s", len(stale), embedder.name)
+        embedded = embedder.embed([profile for _, profile in stale])
+        for (vendor, profile), vector in zip(stale, embedded):
+            vectors[vendor.id] = vector
+            db.merge(VendorEmbedding(vendor_id=vendor.id, model=embedder.name, profile_hash=_sha256(profile), vector=vector))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Outro worker indexou o mesmo vendor ao mesmo tempo
+            db.rollback()
+    return vectors
+
+# Reindexa um vendor após create/update (executado como background task)
+def reindex_vendor(vendor_id: int):
+    db = SessionLocal()
+    try:
+        vendor = db.query(Vendor).filter(Vendor.id == vendor_id).first()
+        if vendor:
+            ensure_vendor_vectors(db, [vendor], get_embedder(db))
+    except Exception:
+        logger.warning("Falha ao indexar o vendor %s; será reindexado no próximo matching", vendor_id, exc_info=True)
+    finally:
+        db.close()
+
+# Os k vendors mais similares ao texto (resumo da RFP); catálogos pequenos passam inteiros
+def top_vendors(db: Session, provider: AIProvider, text: str, vendors: list, k: int = VENDOR_MATCH_TOP_K) -> list:
+    if len(vendors) <= k:
+        return vendors
+    try:
+        embedder = get_embedder(db, provider)
+        vectors = ensure_vendor_vectors(db, vendors, embedder)
+        query = embedder.embed([text])[0]
+    except Exception:
+        logger.warning("Falha no pré-filtro por embeddings; enviando todos os vendors", exc_info=True)
+        return vendors
+    ranked = sorted(vendors, key=lambda v: _dot(query, vectors[v.id]), reverse=True)
+    return ranked[:k]
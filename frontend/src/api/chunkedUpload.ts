@@ -0,0 +1,55 @@
+import api from './axios';
+
+const MAX_RETRIES = 5;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Chave para retomar o upload do mesmo arquivo após recarregar a página
+const storageKey = (rfpId: string | number, file: File) =>
+  `upload:${rfpId}:${file.name}:${file.size}:${file.lastModified}`;
+
+// Upload em partes: init -> PUT de cada parte no offset confirmado -> commit.
+// Em falha de rede, consulta o offset atual no servidor e continua dali.
+export async function uploadFileInChunks(
+  rfpId: string | number,
+  file: File,
+  onProgress?: (percent: number) => void
+) {
+  const key = storageKey(rfpId, file);
+  let upload: any = null;
+  const savedId = localStorage.getItem(key);
+  if (savedId) {
+    try {
+      upload = (await api.get(`/rfps/${rfpId}/files/uploads/${savedId}`)).data;
+    } catch {
+      localStorage.removeItem(key);
+    }
+  }
+  if (!upload) {
+    upload = (await api.post(`/rfps/${rfpId}/files/uploads`, { filename: file.name, size: file.size })).data;
+    localStorage.setItem(key, upload.id);
+  }
+  const url = `/rfps/${rfpId}/files/uploads/${upload.id}`;
+  let offset: number = upload.offset;
+  let retries = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + upload.chunk_size);
+    try {
+      const res = await api.put(url, chunk, {
+        params: { offset },
+        headers: { 'Content-Type': 'application/octet-stream' },
+      });
+      offset = res.data.offset;
+      retries = 0;
+      onProgress?.(Math.round((offset / file.size) * 100));
+    } catch (err: any) {
+      if (err?.response && err.response.status !== 409) throw err;
+      if (++retries > MAX_RETRIES) throw err;
+      await sleep(1000 * retries);
+      offset = (await api.get(url)).data.offset;
+    }
+  }
+  const res = await api.post(`${url}/commit`);
+  localStorage.removeItem(key);
+  return res.data;
+}
@@ -1,5 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import api from '../../api/axios';
+import { uploadFileInChunks } from '../../api/chunkedUpload';
 import { useParams } from 'react-router-dom';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
@@ -27,6 +28,7 @@ const RFPDetailPage = () => {
   const [vendorAnalysisSaved, setVendorAnalysisSaved] = useState(false);
   const [selectedVendor, setSelectedVendor] = useState<number | null>(null);
   const [uploadError, setUploadError] = useState('');
+  const [uploadProgress, setUploadProgress] = useState<number | null>(null);
   const [analyzing, setAnalyzing] = useState<boolean>(false);
   const [proposals, setProposals] = useState<any[]>([]);
   const [proposalsError, setProposalsError] = useState('');
@@ -102,6 +104,24 @@ const RFPDetailPage = () => {
     }
   };
 
+  // Downloads exigem o token (interceptor do axios): baixa como blob em vez de link direto
+  const handleDownload = async (path: string, filename: string) => {
+    try {
+      const response = await api.get(path, { responseType: 'blob' });
+      const blob = new Blob([response.data], { type: response.headers['content-type'] });
+      const url = window.URL.createObjectURL(blob);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = filename;
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (err) {
+      console.error('Erro ao baixar arquivo', err);
+    }
+  };
+
   useEffect(() => {
     fetchRfp();
     fetchProposals();
@@ -187,16 +207,16 @@ const RFPDetailPage = () => {
       setUploadError('ID da RFP não encontrado. Não é possível enviar o arquivo.');
       return;
     }
-    const formData = new FormData();
-    formData.append('file', e.target.files[0]);
+    setUploadError('');
     try {
-      await api.post(`/rfps/${id}/upload`, formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-      });
+      await uploadFileInChunks(id, e.target.files[0], setUploadProgress);
       fetchRfp(); // Atualiza detalhes após upload
       fetchFiles();
     } catch (err: any) {
       setUploadError(err?.response?.data?.detail || 'Erro ao fazer upload.');
+    } finally {
+      setUploadProgress(null);
+      e.target.value = '';
     }
   };
 
@@ -204,8 +224,19 @@ const RFPDetailPage = () => {
     if (!id) return;
     setAnalyzing(true);
     try {
+      // A análise roda em background: acompanha o job até concluir
       const res = await api.post(`/rfps/${id}/analyze`);
-      setAnalysisResult(res.data.resumo);
+      let job = res.data;
+      while (job.status === 'pending' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        job = (await api.get(`/analysis_jobs/${job.id}`)).data;
+      }
+      if (job.status === 'completed') {
+        const result = await api.get(`/analysis_jobs/${job.id}/result`);
+        setAnalysisResult(result.data.resumo);
+      } else {
+        console.error('Análise falhou', job.error);
+      }
       await fetchRfp();
     } catch (err: any) {
       console.error('Erro ao analisar RFP', err);
@@ -291,15 +322,13 @@ const RFPDetailPage = () => {
           <div className="mb-4">
             <div className="font-medium">Arquivo:</div>
             {rfp.arquivo_url ? (
-              <a
-                href={api.getUri({ url: `/uploaded_rfps/${rfp.arquivo_url.split(/[\\/]/).pop()}` })}
-                target="_blank"
-                rel="noopener noreferrer"
+              <button
+                type="button"
+                onClick={() => handleDownload(`/rfps/${id}/download`, rfp.arquivo_url.split('_').slice(2).join('_') || `rfp_${id}`)}
                 className="text-blue-600 underline"
-                download
               >
-                {rfp.arquivo_url.split('_').slice(2).join('_')}
-              </a>
+                {rfp.arquivo_url.split('_').slice(2).join('_') || 'Baixar arquivo'}
+              </button>
             ) : (
               <span className="text-gray-500">Nenhum arquivo enviado</span>
             )}
@@ -309,15 +338,14 @@ const RFPDetailPage = () => {
             <div className="font-medium">Arquivos Adicionais:</div>
             {files.length > 0 ? (
               files.map(f => (
-                <a
+                <button
                   key={f.id}
-                  href={api.getUri({ url: `/rfps/${id}/download/${f.id}` })}
-                  target="_blank"
-                  rel="noopener noreferrer"
+                  type="button"
+                  onClick={() => handleDownload(`/rfps/${id}/download/${f.id}`, f.filename)}
                   className="block text-blue-600 underline"
                 >
                   {f.filename}
-                </a>
+                </button>
               ))
             ) : (
               <span className="text-gray-500">Nenhum arquivo adicional</span>
@@ -354,8 +382,9 @@ const RFPDetailPage = () => {
             <button
               className="bg-accent text-white px-4 py-2 rounded-lg font-semibold disabled:opacity-60"
               onClick={handleUploadClick}
+              disabled={uploadProgress !== null}
             >
-              Upload Arquivo
+              {uploadProgress !== null ? `Enviando... ${uploadProgress}%` : 'Upload Arquivo'}
             </button>
             {uploadError && <span className="text-red-500 text-sm ml-2">{uploadError}</span>}
             <button onClick={handleAnalyze} disabled={analyzing} className="bg-primary text-white px-4 py-2 rounded-lg font-semibold disabled:opacity-60">
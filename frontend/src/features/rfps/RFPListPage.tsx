@@ -18,19 +18,29 @@ const RFPListPage = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [modalOpen, setModalOpen] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const navigate = useNavigate();
 
+  const fetchPage = async (cursor: string | null) => {
+    const [rfpsRes, vendorsRes] = await Promise.all([
+      api.get('/rfps', { params: cursor ? { cursor } : {} }),
+      api.get('/vendors')
+    ]);
+    const vendorMap = new Map(vendorsRes.data.map((v: any) => [v.id, v.nome]));
+    const enriched = rfpsRes.data.items.map((rfp: RFP) => ({
+      ...rfp,
+      fabricante_escolhido_nome: rfp.fabricante_escolhido_id ? vendorMap.get(rfp.fabricante_escolhido_id) || '' : ''
+    }));
+    setNextCursor(rfpsRes.data.next_cursor || null);
+    return enriched;
+  };
+
   const fetchRFPs = async () => {
     setLoading(true);
     try {
-      const [rfpsRes, vendorsRes] = await Promise.all([api.get('/rfps'), api.get('/vendors')]);
-      const vendorMap = new Map(vendorsRes.data.map((v: any) => [v.id, v.nome]));
-      const enriched = rfpsRes.data.map((rfp: RFP) => ({
-        ...rfp,
-        fabricante_escolhido_nome: rfp.fabricante_escolhido_id ? vendorMap.get(rfp.fabricante_escolhido_id) || '' : ''
-      }));
-      setRfps(enriched);
+      setRfps(await fetchPage(null));
     } catch {
       setError('Erro ao carregar RFPs');
     } finally {
@@ -38,6 +48,19 @@ const RFPListPage = () => {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const more = await fetchPage(nextCursor);
+      setRfps(prev => [...prev, ...more]);
+    } catch {
+      setError('Erro ao carregar RFPs');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDownload = async (rfpId: number, filename: string) => {
     try {
       const response = await api.get(`/rfps/${rfpId}/download`, { responseType: 'blob' });
@@ -139,7 +162,17 @@ const RFPListPage = () => {
             </table>
           </div>
         )}
-        {/* Paginação aqui (futuro) */}
+        {!loading && !error && nextCursor && (
+          <div className="flex justify-center mt-6">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-primary/10 text-primary px-6 py-2 rounded-lg font-semibold hover:bg-primary/20 transition disabled:opacity-50"
+            >
+              {loadingMore ? 'Carregando...' : 'Carregar mais'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );